@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Indexes for case-insensitive email lookups (email__iexact compares
+    UPPER(email) on postgres)
+    """
+
+    dependencies = [
+        ('accounts', '0007_auto_20191019_1130'),
+        ('auth', '0011_update_proxy_permissions'),
+        ('account', '0002_email_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX auth_user_email_upper_idx '
+            'ON auth_user (UPPER(email));',
+            'DROP INDEX auth_user_email_upper_idx;'
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX account_emailaddress_email_upper_idx '
+            'ON account_emailaddress (UPPER(email));',
+            'DROP INDEX account_emailaddress_email_upper_idx;'
+        ),
+    ]
@@ -0,0 +1,59 @@
+import warnings
+
+from django.db import DatabaseError, migrations, transaction
+
+
+NAME_COLUMNS = ('first_name', 'last_name', 'username')
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    try:
+        # in a savepoint, so a failure doesn't abort the migration
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+    except DatabaseError as e:
+        warnings.warn(
+            'Trigram indexes for user search not created; the pg_trgm '
+            'extension could not be created ({}).  Ask a database superuser '
+            'to run "CREATE EXTENSION pg_trgm;", then run "python manage.py '
+            'migrate accounts 0008" and "python manage.py migrate accounts" '
+            'to add them.'.format(str(e).strip())
+        )
+        return
+    for column in NAME_COLUMNS:
+        schema_editor.execute(
+            'CREATE INDEX auth_user_{0}_upper_trgm_idx ON auth_user '
+            'USING gin (UPPER({0}) gin_trgm_ops);'.format(column)
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in NAME_COLUMNS:
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS auth_user_{}_upper_trgm_idx;'.format(column)
+        )
+
+
+class Migration(migrations.Migration):
+    """
+    Trigram indexes for the ppadmin user search and first letter filter
+    (icontains/istartswith compare UPPER(<field>) on postgres).  postgres
+    only; pg_trgm isn't available elsewhere.
+
+    Creating the pg_trgm extension needs a superuser (or, on postgres 13+,
+    a database owner, as pg_trgm is a trusted extension).  If the migration
+    user can't create it, the indexes are skipped with a warning; searches
+    still work, without the indexes.
+    """
+
+    dependencies = [
+        ('accounts', '0008_email_upper_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -6,14 +6,15 @@ import pytz
 from math import floor
 
 from django.conf import settings
-from django.core.cache import cache
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
 from activitylog.models import ActivityLog
-from .utils import active_data_privacy_cache_key
+from poleperformance import caching
+from .utils import active_data_privacy_cache_key, \
+    DATA_PRIVACY_CACHE_TIMEOUT, DATA_PRIVACY_VERSION_CACHE_KEY
 
 
 logger = logging.getLogger(__name__)
@@ -24,17 +25,14 @@ def disclaimer_cache_key(user):
 
 
 def has_disclaimer(user):
-    cache_key = disclaimer_cache_key(user)
-    # get disclaimer from cache
-    cached_disclaimer = cache.get(cache_key)
-    if cached_disclaimer is not None:
-        cached_disclaimer = bool(cached_disclaimer)
-    else:
-        cached_disclaimer = OnlineDisclaimer.objects.select_related('user').filter(
-            user=user, entry_year=settings.CURRENT_ENTRY_YEAR).exists()
+    return caching.get_or_set(
+        disclaimer_cache_key(user),
+        lambda: OnlineDisclaimer.objects.filter(
+            user=user, entry_year=settings.CURRENT_ENTRY_YEAR
+        ).exists(),
         # cache for 30 days
-        cache.set(cache_key, cached_disclaimer, timeout=2592000)
-    return cached_disclaimer
+        timeout=2592000
+    )
 
 
 # Decorator for django models that contain readonly fields.
@@ -116,7 +114,9 @@ class OnlineDisclaimer(models.Model):
                 log="Waiver created: {}".format(self.__str__())
             )
             # cache for 30 days; this will need to expire for the next entry year
-            cache.set(disclaimer_cache_key(self.user), True, timeout=2592000)
+            caching.set_value(
+                disclaimer_cache_key(self.user), True, timeout=2592000
+            )
 
         super(OnlineDisclaimer, self).save()
 
@@ -188,10 +188,13 @@ class DataPrivacyPolicy(models.Model):
 
     @classmethod
     def current_version(cls):
-        current_policy = DataPrivacyPolicy.current()
-        if current_policy is None:
-            return 0
-        return current_policy.version
+        def get_current_version():
+            current_policy = DataPrivacyPolicy.current()
+            return 0 if current_policy is None else current_policy.version
+        return caching.get_or_set(
+            DATA_PRIVACY_VERSION_CACHE_KEY, get_current_version,
+            timeout=DATA_PRIVACY_CACHE_TIMEOUT
+        )
 
     @classmethod
     def current(cls):
@@ -207,14 +210,21 @@ class DataPrivacyPolicy(models.Model):
             if current and current.content == self.content:
                 raise ValidationError('No changes made to content; not saved')
 
-        if not self.id and not self.version:
-            # if no version specified, go to next major version
-            self.version = floor((DataPrivacyPolicy.current_version() + 1))
+            if not self.version:
+                # if no version specified, go to next major version; the
+                # cached current version isn't used here in case it's stale
+                current_version = current.version if current else 0
+                self.version = floor((current_version + 1))
         super().save(**kwargs)
+        caching.delete(DATA_PRIVACY_VERSION_CACHE_KEY)
         ActivityLog.objects.create(
             log='Data Privacy Policy version {} created'.format(self.version)
         )
 
+    def delete(self, using=None, keep_parents=False):
+        super().delete(using, keep_parents)
+        caching.delete(DATA_PRIVACY_VERSION_CACHE_KEY)
+
 
 class SignedDataPrivacy(models.Model):
     read_only_fields = ('date_signed', 'version')
@@ -244,12 +254,13 @@ class SignedDataPrivacy(models.Model):
         super(SignedDataPrivacy, self).save()
         # cache agreement
         if self.is_active:
-            cache.set(
-                active_data_privacy_cache_key(self.user), True, timeout=600
+            caching.set_value(
+                active_data_privacy_cache_key(self.user), True,
+                timeout=DATA_PRIVACY_CACHE_TIMEOUT
             )
 
     def delete(self, using=None, keep_parents=False):
         # clear cache if this is the active signed agreement
         if self.is_active:
-            cache.delete(active_data_privacy_cache_key(self.user))
+            caching.delete(active_data_privacy_cache_key(self.user))
         super(SignedDataPrivacy, self).delete(using, keep_parents)
@@ -1,11 +1,15 @@
 from django.contrib.auth.models import User, Group
-from django.core.cache import cache
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+from allauth.account.models import EmailAddress
+
 from activitylog.models import ActivityLog
+from poleperformance import caching
 from accounts.models import disclaimer_cache_key, has_disclaimer, \
     OnlineDisclaimer
+from accounts.user_directory import clear_first_letter_counts
+from accounts.utils import unknown_email_cache_key
 
 
 @receiver(post_save, sender=User)
@@ -22,4 +26,20 @@ def user_post_save(sender, instance, created, *args, **kwargs):
 @receiver(post_delete, sender=OnlineDisclaimer)
 def update_cache(sender, instance, **kwargs):
     # set cache to False
-    cache.set(disclaimer_cache_key(instance.user), False, None)
+    caching.set_value(disclaimer_cache_key(instance.user), False, None)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=EmailAddress)
+def clear_unknown_email_cache(sender, instance, **kwargs):
+    if instance.email:
+        caching.delete(unknown_email_cache_key(instance.email))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def update_user_directory(sender, instance, update_fields=None, **kwargs):
+    # logins only update last_login, which doesn't affect the user list
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    clear_first_letter_counts()
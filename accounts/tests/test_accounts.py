@@ -26,8 +26,9 @@ from accounts.management.commands.import_disclaimer_data import logger as \
 from accounts.management.commands.export_encrypted_disclaimers import EmailMessage
 from accounts.models import CookiePolicy, OnlineDisclaimer, \
     WAIVER_TERMS, DataPrivacyPolicy, SignedDataPrivacy
-from ..utils import active_data_privacy_cache_key
+from ..utils import active_data_privacy_cache_key, find_user_by_email
 from accounts.views import ProfileUpdateView, DisclaimerCreateView
+from poleperformance import caching
 
 from .helpers import _create_session, has_active_data_privacy_agreement, \
     TestSetupMixin, make_data_privacy_agreement
@@ -129,8 +130,10 @@ class ProfileTests(TestSetupMixin, TestCase):
         cls.url = reverse('accounts:profile')
 
     def setUp(self):
-        super().setUp()
+        # clear before the user's data privacy agreement is made, so it isn't
+        # skipped because of a cached value from a previous test
         cache.clear()
+        super().setUp()
 
     def test_profile_view(self):
         self.client.login(username=self.user.username, password='test')
@@ -746,6 +749,9 @@ class ImportDisclaimersTests(TestCase):
 
 class DataPrivacyPolicyModelTests(TestCase):
 
+    def setUp(self):
+        cache.clear()
+
     def test_no_policy_version(self):
         self.assertEqual(DataPrivacyPolicy.current_version(), 0)
 
@@ -813,6 +819,7 @@ class SignedDataPrivacyModelTests(TestCase):
 
     def setUp(self):
         super().setUp()
+        cache.clear()
         self.user = baker.make(User)
 
     def test_cached_on_save(self):
@@ -829,6 +836,27 @@ class SignedDataPrivacyModelTests(TestCase):
         SignedDataPrivacy.objects.get(user=self.user).delete()
         self.assertIsNone(cache.get(active_data_privacy_cache_key(self.user)))
 
+    def test_current_version_cached(self):
+        with self.assertNumQueries(1):
+            DataPrivacyPolicy.current_version()
+        with self.assertNumQueries(0):
+            self.assertEqual(DataPrivacyPolicy.current_version(), Decimal('1.0'))
+
+        # cache is updated when a new version is created or deleted
+        policy = DataPrivacyPolicy.objects.create(content='New Foo')
+        self.assertEqual(DataPrivacyPolicy.current_version(), Decimal('2.0'))
+        policy.delete()
+        self.assertEqual(DataPrivacyPolicy.current_version(), Decimal('1.0'))
+
+    def test_has_active_agreement_single_query(self):
+        make_data_privacy_agreement(self.user)
+        DataPrivacyPolicy.current_version()
+        cache.delete(active_data_privacy_cache_key(self.user))
+        with self.assertNumQueries(1):
+            self.assertTrue(has_active_data_privacy_agreement(self.user))
+        with self.assertNumQueries(0):
+            self.assertTrue(has_active_data_privacy_agreement(self.user))
+
 
 class DataPrivacyViewTests(TestCase):
 
@@ -966,3 +994,40 @@ class DataPrivacyPolicyAdminFormTests(TestCase):
                 'update policy content'
             ]
         )
+
+
+class FindUserByEmailTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cache.clear()
+        self.user = baker.make(User, email='Test.User@test.com')
+
+    def test_case_insensitive(self):
+        self.assertEqual(find_user_by_email('test.user@TEST.com'), self.user)
+        self.assertEqual(find_user_by_email(' test.user@test.com '), self.user)
+
+    def test_allauth_email_addresses(self):
+        baker.make(EmailAddress, user=self.user, email='second@test.com')
+        self.assertEqual(find_user_by_email('Second@test.com'), self.user)
+
+    def test_first_user_returned_for_shared_email(self):
+        baker.make(User, email='test.user@test.com')
+        for _ in range(2):
+            self.assertEqual(
+                find_user_by_email('test.user@test.com'), self.user
+            )
+
+    def test_unknown_email_cached(self):
+        self.assertIsNone(find_user_by_email('unknown@test.com'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(find_user_by_email('Unknown@test.com'))
+
+    def test_unknown_email_cache_cleared_when_email_registered(self):
+        self.assertIsNone(find_user_by_email('unknown@test.com'))
+        new_user = baker.make(User, email='unknown@test.com')
+        self.assertEqual(find_user_by_email('unknown@test.com'), new_user)
+
+        self.assertIsNone(find_user_by_email('another@test.com'))
+        baker.make(EmailAddress, user=self.user, email='another@test.com')
+        self.assertEqual(find_user_by_email('another@test.com'), self.user)
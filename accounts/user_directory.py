@@ -0,0 +1,57 @@
+"""
+Users for the ppadmin user list: name search and first letter facet counts
+"""
+from django.contrib.auth.models import User
+from django.db.models import Count, Q
+from django.db.models.functions import Substr, Upper
+
+from poleperformance import caching
+
+
+LETTER_COUNTS_CACHE_KEY = 'user_directory_letter_counts'
+
+# icontains/istartswith on these compare UPPER(<field>), which the trigram
+# indexes added in accounts migration 0009 cover on postgres
+SEARCH_FIELDS = ('first_name', 'last_name', 'username')
+
+
+def search_users(queryset, search_text):
+    """
+    Users with search_text anywhere in their first name, last name or
+    username
+    """
+    query = Q()
+    for field in SEARCH_FIELDS:
+        query |= Q(**{'{}__icontains'.format(field): search_text})
+    return queryset.filter(query)
+
+
+def filter_by_first_letter(queryset, letter):
+    return queryset.filter(first_name__istartswith=letter)
+
+
+def first_letter_counts(queryset=None):
+    """
+    Return {first letter of first name (upper case): number of users}, from
+    one grouped query.  Counts for all users are cached until a user is
+    saved or deleted.
+    """
+    if queryset is None:
+        return caching.get_or_set(
+            LETTER_COUNTS_CACHE_KEY,
+            lambda: _count_first_letters(User.objects.all()), None
+        )
+    return _count_first_letters(queryset)
+
+
+def _count_first_letters(queryset):
+    rows = queryset.order_by().annotate(
+        letter=Upper(Substr('first_name', 1, 1))
+    ).values('letter').annotate(count=Count('id')).values_list(
+        'letter', 'count'
+    )
+    return dict(rows)
+
+
+def clear_first_letter_counts():
+    caching.delete(LETTER_COUNTS_CACHE_KEY)
@@ -1,21 +1,82 @@
 # -*- coding: utf-8 -*-
+import hashlib
 
-from django.conf import settings
-from django.core.cache import cache
+from poleperformance import caching
 
 
-def active_data_privacy_cache_key(user):
+# 30 days; cached values are invalidated when policies and agreements change
+DATA_PRIVACY_CACHE_TIMEOUT = 2592000
+DATA_PRIVACY_VERSION_CACHE_KEY = 'data_privacy_policy_current_version'
+
+
+def active_data_privacy_cache_key(user, current_version=None):
     from accounts.models import DataPrivacyPolicy
-    current_version = DataPrivacyPolicy.current_version()
+    if current_version is None:
+        current_version = DataPrivacyPolicy.current_version()
     return 'user_{}_active_data_privacy_agreement_version_{}'.format(
         user.id, current_version
     )
 
 
 def has_active_data_privacy_agreement(user):
-    key = active_data_privacy_cache_key(user)
-    has_active_agreement = cache.get(key)
-    if has_active_agreement is None:
-        has_active_agreement = any([True for dp in user.data_privacy_agreement.all() if dp.is_active])
-        cache.set(key, has_active_agreement, timeout=600)
-    return bool(has_active_agreement)
+    from accounts.models import DataPrivacyPolicy
+    current_version = DataPrivacyPolicy.current_version()
+    return caching.get_or_set(
+        active_data_privacy_cache_key(user, current_version),
+        lambda: user.data_privacy_agreement.filter(
+            version=current_version
+        ).exists(),
+        timeout=DATA_PRIVACY_CACHE_TIMEOUT
+    )
+
+
+# unknown email addresses are remembered briefly, so repeated checks (e.g.
+# the doubles partner check while an email is being typed) don't query again
+UNKNOWN_EMAIL_CACHE_TIMEOUT = 60
+
+
+def normalise_email(email):
+    return email.strip().lower()
+
+
+def email_hash(email):
+    # for cache keys, which can't contain all the characters an email can
+    return hashlib.md5(normalise_email(email).encode('utf-8')).hexdigest()
+
+
+def unknown_email_cache_key(email):
+    return 'unknown_email_{}'.format(email_hash(email))
+
+
+def find_user_by_email(email):
+    """
+    Return the user with this email address (case-insensitive) as their
+    account email or one of their allauth email addresses, or None.  Both
+    lookups use the UPPER(email) indexes.
+    """
+    if not email:
+        return None
+    email = normalise_email(email)
+    users = []
+
+    def is_unknown():
+        users.append(_find_user_by_email(email))
+        return users[0] is None
+
+    if caching.get_or_set(
+            unknown_email_cache_key(email), is_unknown,
+            UNKNOWN_EMAIL_CACHE_TIMEOUT
+    ):
+        return None
+    # known emails are cached as False; look the user up again unless we
+    # just did
+    return users[0] if users else _find_user_by_email(email)
+
+
+def _find_user_by_email(email):
+    from django.contrib.auth.models import User
+    user = User.objects.filter(email__iexact=email).order_by('id').first()
+    if user is None:
+        user = User.objects.filter(emailaddress__email__iexact=email)\
+            .order_by('id').first()
+    return user
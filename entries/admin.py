@@ -1,10 +1,17 @@
 from django.contrib import admin
 
-from .models import Entry
+from .models import Entry, StaffNotification
 
 
 class EntryAdmin(admin.ModelAdmin):
 
     list_filter = ("entry_year", "status")
 
+
+class StaffNotificationAdmin(admin.ModelAdmin):
+
+    list_display = ("created", "recipient", "category", "subject", "sent")
+    list_filter = ("category", "recipient")
+
 admin.site.register(Entry, EntryAdmin)
+admin.site.register(StaffNotification, StaffNotificationAdmin)
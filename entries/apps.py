@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class EntriesConfig(AppConfig):
     name = 'entries'
+
+    def ready(self):
+        import entries.signals
+        from entries.schedule import get_schedule
+        get_schedule()
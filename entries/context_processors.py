@@ -1,10 +1,15 @@
-from datetime import datetime
-
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 
 from entries.models import CATEGORY_CHOICES_DICT, LATE_ENTRY_CATEGORY_CHOICES
-from entries.utils import all_entries_open, final_datetime, late_categories_entries_open
+from entries.schedule import get_schedule, get_schedule_phase
+
 
+LATE_CATEGORY_NAMES = set(dict(LATE_ENTRY_CATEGORY_CHOICES).values())
+EARLY_CATEGORY_NAMES = \
+    set(CATEGORY_CHOICES_DICT.values()) - LATE_CATEGORY_NAMES
+LATE_CATEGORIES = ', '.join(LATE_CATEGORY_NAMES)
+EARLY_CATEGORIES = ', '.join(EARLY_CATEGORY_NAMES)
 
 
 def pp_email(request):
@@ -12,23 +17,18 @@ def pp_email(request):
 
 
 def entries(request):
-    entries_open, open_date, late_close_date = late_categories_entries_open()
-    _, _, close_date = all_entries_open()
-    final_date, final_times = final_datetime()
-
-    late_category_names = set(dict(LATE_ENTRY_CATEGORY_CHOICES).values())
-    all_category_names = set(dict(CATEGORY_CHOICES_DICT).values())
-    early_category_names = all_category_names - late_category_names
-    late_categories = ', '.join(late_category_names)
-    early_categories = ', '.join(early_category_names)
+    # dates are parsed once by the schedule; whether entries are open depends
+    # on the current time, so is only checked if a template uses it
+    schedule = get_schedule()
     return {
-        'entries_open': entries_open,
-        'entries_open_date': open_date,
-        'entries_close_date': close_date,
-        'late_entries_close_date': late_close_date,
-        'early_categories': early_categories,
-        'late_categories': late_categories,
-        'final_date': final_date,
-        'final_times': final_times
+        'entries_open': SimpleLazyObject(
+            lambda: get_schedule_phase(request).late_categories_entries_open
+        ),
+        'entries_open_date': schedule.open_date,
+        'entries_close_date': schedule.close_date,
+        'late_entries_close_date': schedule.late_close_date,
+        'early_categories': EARLY_CATEGORIES,
+        'late_categories': LATE_CATEGORIES,
+        'final_date': schedule.final_date,
+        'final_times': schedule.final_times
     }
-
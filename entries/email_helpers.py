@@ -5,6 +5,8 @@ from django.template.loader import get_template
 
 from activitylog.models import ActivityLog
 
+from .models import StaffNotification, use_notification_digest
+
 
 def send_pp_email(
         request,
@@ -46,6 +48,28 @@ def send_pp_email(
         send_support_email(e, __name__)
 
 
+def send_staff_notification(
+        request, subject, ctx, template_txt, template_html, recipient,
+        category, critical=False
+):
+    """
+    Email a notification to the studio or support address, or hold it to be
+    sent in the next digest
+    """
+    if not use_notification_digest(critical):
+        return send_pp_email(
+            request, subject, ctx, template_txt, template_html,
+            to_list=[recipient]
+        )
+    if request:
+        host = 'https://{}'.format(request.META.get('HTTP_HOST'))
+        ctx.update({'host': host})
+    StaffNotification.add(
+        [recipient], category, subject, get_template(template_txt).render(ctx)
+    )
+    return 'OK'
+
+
 def send_support_email(e, module_name=""):
     try:
         send_mail('{} An error occurred!'.format(
@@ -3,10 +3,11 @@ from django.conf import settings
 
 from allauth.account.models import EmailAddress
 
+from accounts.utils import normalise_email
+
 from .models import Entry, CATEGORY_CHOICES_DICT, CATEGORY_CHOICES_ORDER, LATE_ENTRY_CATEGORY_CHOICES, VALID_CATEGORIES
-from .utils import (
-    check_partner_email, all_entries_open, late_categories_entries_open
-)
+from .schedule import get_schedule_phase
+from .utils import check_partner_email
 
 
 class EntryFormMixin(object):
@@ -42,11 +43,11 @@ class EntryFormMixin(object):
     def clean_partner_email(self):
         partner_email = self.cleaned_data.get('partner_email')
         if partner_email:
-            emailaddresses = EmailAddress.objects.filter(user=self.user)\
-                .values_list('email', flat=True)
-
-            if partner_email in emailaddresses or \
-                            partner_email == self.user.email:
+            if normalise_email(partner_email) == \
+                    normalise_email(self.user.email) or \
+                    EmailAddress.objects.filter(
+                        user=self.user, email__iexact=partner_email
+                    ).exists():
                 # make sure partner email is different from current user
                 self.add_error(
                     'partner_email',
@@ -61,6 +62,8 @@ class EntryCreateUpdateForm(EntryFormMixin, forms.ModelForm):
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user')
         initial_data = kwargs.pop('initial_data')
+        schedule_phase = kwargs.pop('schedule_phase', None) or \
+            get_schedule_phase()
         kwargs['initial'] = initial_data
         super(EntryCreateUpdateForm, self).__init__(*args, **kwargs)
 
@@ -71,8 +74,8 @@ class EntryCreateUpdateForm(EntryFormMixin, forms.ModelForm):
             required=False,
         )
 
-        all_open, _, _ = all_entries_open()
-        late_open, _, _ = late_categories_entries_open()
+        all_open = schedule_phase.all_entries_open
+        late_open = schedule_phase.late_categories_entries_open
 
         # only list the current category (for editing saved entries) and
         # categories not yet entered
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from accounts.utils import find_user_by_email
+from activitylog.models import ActivityLog
+
+from ...models import Entry
+
+
+class Command(BaseCommand):
+    help = 'Link doubles entries to their partner\'s user account, using the ' \
+           'partner email'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Re-resolve partners for all doubles entries, not just those '
+                 'without a linked partner'
+        )
+
+    def handle(self, *args, **options):
+        entries = Entry.objects.filter(category='DOU')\
+            .exclude(partner_email__isnull=True).exclude(partner_email='')
+        if not options['all']:
+            entries = entries.filter(partner__isnull=True)
+
+        entries_by_email = {}
+        for entry_id, email in entries.values_list('id', 'partner_email'):
+            entries_by_email.setdefault(email, []).append(entry_id)
+
+        linked = 0
+        for email, entry_ids in entries_by_email.items():
+            partner = find_user_by_email(email)
+            if partner:
+                linked += Entry.objects.filter(id__in=entry_ids)\
+                    .update(partner=partner)
+
+        msg = 'Doubles partners linked for {} of {} entries'.format(
+            linked, sum(len(ids) for ids in entries_by_email.values())
+        )
+        self.stdout.write(msg)
+        ActivityLog.objects.create(log=msg)
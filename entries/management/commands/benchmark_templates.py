@@ -0,0 +1,96 @@
+import timeit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+
+from ...models import Entry
+
+
+EMAIL_TEMPLATES = [
+    'entries/email/entry_submitted.txt',
+    'entries/email/entry_submitted.html',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare template rendering times for the user entries page and ' \
+           'entry emails with and without the cached template loader'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            help='User to render the entries page for; defaults to the first '
+                 'user'
+        )
+        parser.add_argument(
+            '--iterations', type=int, default=100,
+            help='Number of times to render each template (default 100)'
+        )
+
+    def handle(self, *args, **options):
+        username = options.get('username')
+        users = User.objects.order_by('id')
+        user = users.filter(username=username).first() if username \
+            else users.first()
+        if user is None:
+            raise CommandError('No user found to render the entries page for')
+
+        request = RequestFactory().get('/entries/myentries/')
+        request.user = user
+        request.META['HTTP_HOST'] = 'localhost'
+        entries = Entry.objects.filter(
+            user=user, entry_year=settings.CURRENT_ENTRY_YEAR
+        )
+        page_context = {
+            'entries_list': entries,
+            'entries': [{'instance': entry} for entry in entries],
+        }
+        entry = entries.first()
+        email_context = {
+            'host': 'https://localhost',
+            'entry': entry,
+            'category': entry.get_category_display() if entry else '',
+        }
+
+        iterations = options['iterations']
+        for label, loaders in [
+            ('uncached', settings.TEMPLATE_LOADERS),
+            (
+                'cached',
+                [(settings.TEMPLATE_CACHE_LOADER, settings.TEMPLATE_LOADERS)]
+            ),
+        ]:
+            engine = self.get_engine(loaders)
+
+            def render_page():
+                engine.get_template('entries/user_entries.html').render(
+                    page_context, request
+                )
+
+            def render_email():
+                for template_name in EMAIL_TEMPLATES:
+                    engine.get_template(template_name).render(email_context)
+
+            for name, render in [
+                ('user entries page', render_page), ('entry email', render_email)
+            ]:
+                total = timeit.timeit(render, number=iterations)
+                self.stdout.write(
+                    '{} {}: {:.2f}ms per render ({} renders, {:.2f}s)'.format(
+                        label, name, total * 1000 / iterations, iterations,
+                        total
+                    )
+                )
+
+    @staticmethod
+    def get_engine(loaders):
+        template_settings = settings.TEMPLATES[0]
+        return DjangoTemplates({
+            'NAME': 'benchmark',
+            'DIRS': template_settings['DIRS'],
+            'APP_DIRS': False,
+            'OPTIONS': dict(template_settings['OPTIONS'], loaders=loaders),
+        })
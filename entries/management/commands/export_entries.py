@@ -8,6 +8,7 @@ from django.core.mail.message import EmailMessage
 from django.utils.encoding import smart_str
 
 from entries.models import Entry, CATEGORY_CHOICES_DICT
+from entries.utils import partition_by_category
 
 
 logger = logging.getLogger(__name__)
@@ -24,7 +25,8 @@ class Command(BaseCommand):
         )
         parser.add_argument(
             'category',
-            choices=CATEGORY_CHOICES_DICT.keys(), help='Category to export'
+            choices=['all', *CATEGORY_CHOICES_DICT.keys()],
+            help='Category to export, or "all" to export all categories'
         )
         parser.add_argument(
             '--save', action='store_true',
@@ -37,18 +39,32 @@ class Command(BaseCommand):
         outputfile = options.get('file')
         save = options.get('save')
 
+        category_name = 'all categories' if category == 'all' \
+            else CATEGORY_CHOICES_DICT[category]
+        # include the doubles partner column if doubles entries are exported
+        show_partner = category in ['all', 'DOU']
+
         if not outputfile:
             outputfile = os.path.join(
                 os.getcwd(),
                 'submitted_{}.csv'.format(
-                    CATEGORY_CHOICES_DICT[category].lower()
+                    'all' if category == 'all' else category_name.lower()
                 )
             )
 
-        entries = Entry.objects.filter(
-            category=category, entry_year=settings.CURRENT_ENTRY_YEAR,
+        entries = Entry.objects.select_related('user').filter(
+            entry_year=settings.CURRENT_ENTRY_YEAR,
             status='submitted', withdrawn=False, video_entry_paid=True
         )
+        if category == 'all':
+            partitioned_entries = partition_by_category(entries)
+        else:
+            partitioned_entries = [
+                (category, list(entries.filter(category=category)))
+            ]
+        entry_count = sum(
+            len(cat_entries) for _, cat_entries in partitioned_entries
+        )
         with open(outputfile, 'wt') as out:
             wr = csv.writer(out)
             header_row = [
@@ -59,34 +75,41 @@ class Command(BaseCommand):
                 smart_str(u"Status"),
                 smart_str(u"Video URL"),
             ]
-            if category == 'DOU':
+            if show_partner:
                 header_row.insert(3, smart_str(u"Doubles Partner"))
             wr.writerow(header_row)
 
-            for obj in entries:
-                entry_data = [
-                    smart_str(obj.pk),
-                    smart_str(' '.join([obj.user.first_name, obj.user.last_name])),
-                    smart_str(obj.stage_name),
-                    smart_str(CATEGORY_CHOICES_DICT[obj.category]),
-                    smart_str(obj.status),
-                    smart_str(obj.video_url),
-                    smart_str('Yes' if obj.video_entry_paid else 'No'),
-                ]
-                if category == 'DOU':
-                    entry_data.insert(3, smart_str(obj.partner_name))
-                wr.writerow(entry_data)
+            for _, cat_entries in partitioned_entries:
+                for obj in cat_entries:
+                    entry_data = [
+                        smart_str(obj.pk),
+                        smart_str(
+                            ' '.join([obj.user.first_name, obj.user.last_name])
+                        ),
+                        smart_str(obj.stage_name),
+                        smart_str(CATEGORY_CHOICES_DICT[obj.category]),
+                        smart_str(obj.status),
+                        smart_str(obj.video_url),
+                        smart_str('Yes' if obj.video_entry_paid else 'No'),
+                    ]
+                    if show_partner:
+                        entry_data.insert(
+                            3, smart_str(
+                                obj.partner_name if obj.category == 'DOU'
+                                else ''
+                            )
+                        )
+                    wr.writerow(entry_data)
 
         with open(outputfile, 'rb') as file:
             filename = os.path.split(outputfile)[1]
             msg = EmailMessage(
                 '{} submitted entries for {}'.format(
-                    settings.ACCOUNT_EMAIL_SUBJECT_PREFIX,
-                    CATEGORY_CHOICES_DICT[category]
+                    settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, category_name
                 ),
                 'Submitted entry data attached. '
                 '{} entr{}.'.format(
-                    entries.count(), 'y' if entries.count() == 1 else 'ies'),
+                    entry_count, 'y' if entry_count == 1 else 'ies'),
                 settings.DEFAULT_FROM_EMAIL,
                 to=[settings.SUPPORT_EMAIL],
                 attachments=[(filename, file.read(), 'bytes/bytes')]
@@ -97,13 +120,13 @@ class Command(BaseCommand):
             os.unlink(outputfile)
             self.stdout.write(
                 '{} entry records written to {}; file deleted'.format(
-                    entries.count(), outputfile
+                    entry_count, outputfile
                 )
             )
 
         else:
             self.stdout.write(
                 '{} entry records written to {}'.format(
-                    entries.count(), outputfile
+                    entry_count, outputfile
                 )
             )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from activitylog.models import ActivityLog
+
+from ...models import EntryCounter, YEAR_CHOICES
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalised entry counters from the entries table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--year', choices=dict(YEAR_CHOICES).keys(),
+            help='Entry year to rebuild; if not provided, all years are rebuilt'
+        )
+
+    def handle(self, *args, **options):
+        entry_year = options.get('year')
+        EntryCounter.rebuild(entry_year)
+        msg = 'Entry counters rebuilt for {}'.format(
+            'entry year {}'.format(entry_year) if entry_year else 'all years'
+        )
+        self.stdout.write(msg)
+        ActivityLog.objects.create(log=msg)
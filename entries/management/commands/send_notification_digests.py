@@ -0,0 +1,118 @@
+"""
+Email each studio/support address a digest of the notifications held for it
+since the last digest.
+Run periodically (e.g. hourly) from cron.
+"""
+import logging
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.message import EmailMultiAlternatives
+from django.core.management.base import BaseCommand
+from django.template.loader import get_template
+from django.utils import timezone
+
+from activitylog.models import ActivityLog
+
+from ...models import NOTIFICATION_CATEGORIES, StaffNotification
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Email digests of held studio and support notifications'
+
+    def handle(self, *args, **options):
+        recipients = StaffNotification.objects.filter(sent__isnull=True)\
+            .order_by('recipient').values_list('recipient', flat=True)\
+            .distinct()
+        digests = []
+        for recipient in recipients:
+            # claim the notifications so a concurrent run doesn't also send
+            # them; this run's claim is identified by its timestamp, and any
+            # claimed by another run in the meantime are left to that run
+            claimed_at = timezone.now()
+            StaffNotification.objects.filter(
+                recipient=recipient, sent__isnull=True
+            ).update(sent=claimed_at)
+            notifications = list(
+                StaffNotification.objects.filter(
+                    recipient=recipient, sent=claimed_at
+                ).order_by('id')
+            )
+            if notifications:
+                digests.append((claimed_at, notifications))
+
+        if not digests:
+            self.stdout.write('No notifications to send')
+            return
+
+        sent_to = []
+        failed = []
+        notification_count = 0
+        connection = get_connection()
+        try:
+            connection.open()
+            for claimed_at, notifications in digests:
+                recipient = notifications[0].recipient
+                try:
+                    connection.send_messages(
+                        [self.build_digest(recipient, notifications)]
+                    )
+                except Exception as e:
+                    logger.error(
+                        'Error sending notification digest to {}: {}'.format(
+                            recipient, e
+                        )
+                    )
+                    # release this digest's notifications for the next run
+                    StaffNotification.objects.filter(
+                        recipient=recipient, sent=claimed_at
+                    ).update(sent=None)
+                    failed.append(recipient)
+                else:
+                    sent_to.append(recipient)
+                    notification_count += len(notifications)
+        finally:
+            connection.close()
+
+        msg = 'Notification digests sent to {} ({} notifications)'.format(
+            ', '.join(sent_to) or 'no one', notification_count
+        )
+        if failed:
+            msg += '; failed to send to {}'.format(', '.join(failed))
+        self.stdout.write(msg)
+        ActivityLog.objects.create(log='CRON: {}'.format(msg))
+
+    def build_digest(self, recipient, notifications):
+        grouped = OrderedDict(
+            (label, []) for _, label in NOTIFICATION_CATEGORIES
+        )
+        for notification in notifications:
+            grouped[notification.get_category_display()].append(notification)
+        ctx = {
+            'count': len(notifications),
+            'since': notifications[0].created,
+            'categories': [
+                (label, category_notifications)
+                for label, category_notifications in grouped.items()
+                if category_notifications
+            ],
+        }
+        msg = EmailMultiAlternatives(
+            '{} {} notification{}'.format(
+                settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, len(notifications),
+                '' if len(notifications) == 1 else 's'
+            ),
+            get_template('entries/email/notification_digest.txt').render(ctx),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[recipient]
+        )
+        msg.attach_alternative(
+            get_template('entries/email/notification_digest.html').render(ctx),
+            'text/html'
+        )
+        return msg
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.3 on 2026-10-19 18:33
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+COUNTER_FIELDS = (
+    'entry_year', 'category', 'status', 'withdrawn', 'video_entry_paid',
+    'selected_entry_paid'
+)
+
+
+def populate_counters(apps, schema_editor):
+    Entry = apps.get_model('entries', 'Entry')
+    EntryCounter = apps.get_model('entries', 'EntryCounter')
+    grouped_counts = Entry.objects.order_by().values(*COUNTER_FIELDS)\
+        .annotate(entry_count=Count('id'))
+    EntryCounter.objects.bulk_create([
+        EntryCounter(count=row.pop('entry_count'), **row)
+        for row in grouped_counts
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0005_auto_20191017_1547'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_year', models.CharField(choices=[('2017', '2017'), ('2018', '2018'), ('2019', '2019'), ('2020', '2020'), ('2021', '2021'), ('2022', '2022'), ('2023', '2023'), ('2024', '2024'), ('2025', '2025'), ('2026', '2026'), ('2027', '2027'), ('2028', '2028'), ('2029', '2029'), ('2030', '2030')], max_length=4)),
+                ('category', models.CharField(choices=[('BEG', 'Beginner'), ('INT', 'Intermediate'), ('ADV', 'Advanced'), ('SMP', 'Semi-Professional'), ('PRO', 'Professional'), ('MEN', 'Mens'), ('DOU', 'Doubles')], max_length=3)),
+                ('status', models.CharField(choices=[('in_progress', 'In Progress'), ('submitted', 'Submitted'), ('selected', 'Selected'), ('selected_confirmed', 'Selected - confirmed'), ('rejected', 'Rejected')], max_length=20)),
+                ('withdrawn', models.BooleanField()),
+                ('video_entry_paid', models.BooleanField()),
+                ('selected_entry_paid', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('entry_year', 'category', 'status', 'withdrawn', 'video_entry_paid', 'selected_entry_paid')},
+            },
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.3 on 2026-10-19 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('entries', '0006_entrycounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='partner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='partner_entries', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
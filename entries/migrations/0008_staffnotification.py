@@ -0,0 +1,29 @@
+# Generated by Django 3.0.3 on 2026-10-19 19:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0007_entry_partner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaffNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.EmailField(max_length=254)),
+                ('category', models.CharField(choices=[('withdrawal', 'Entry withdrawals'), ('refund', 'Refunds'), ('payment_problem', 'Payment problems')], max_length=20)),
+                ('subject', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'index_together': {('sent', 'recipient')},
+            },
+        ),
+    ]
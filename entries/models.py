@@ -1,11 +1,18 @@
 import shortuuid
+import uuid
+
+from collections import defaultdict
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count, F
 from django.utils.functional import cached_property
 from django.utils import timezone
 
+from accounts.utils import email_hash, find_user_by_email
+
 
 STATUS_CHOICES = (
     ('in_progress', 'In Progress'),
@@ -87,6 +94,118 @@ YEAR_CHOICES = (
 )
 
 
+def entry_stats_cache_key(entry_year):
+    return 'entry_stats_{}'.format(entry_year)
+
+
+ENTRIES_VERSION_CACHE_KEY = 'entries_version'
+
+
+def user_entries_version_cache_key(user_id):
+    return 'user_{}_entries_version'.format(user_id)
+
+
+def get_entries_version(user_id=None):
+    """
+    Return a token that changes whenever entries change; for all entries, or
+    for one user's entries if user_id is given.  Returns None if the cache
+    is unavailable, as there is then no way to tell whether entries changed.
+    """
+    key = user_entries_version_cache_key(user_id) if user_id \
+        else ENTRIES_VERSION_CACHE_KEY
+    try:
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            version = cache.get(key)
+    except Exception:
+        return None
+    return version
+
+
+def bump_entries_version(*user_ids):
+    """
+    Record that entries have changed, for all entries and for the given users
+    """
+    version = uuid.uuid4().hex
+    versions = {ENTRIES_VERSION_CACHE_KEY: version}
+    versions.update({
+        user_entries_version_cache_key(user_id): version
+        for user_id in user_ids
+    })
+    cache.set_many(versions, None)
+
+
+def partner_check_cache_key(email):
+    return 'partner_check_{}'.format(email_hash(email))
+
+
+COUNTER_FIELDS = (
+    'entry_year', 'category', 'status', 'withdrawn', 'video_entry_paid',
+    'selected_entry_paid'
+)
+
+
+class EntryQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        # bulk updates bypass Entry.save, so update the entries versions for
+        # the affected users and move the updated entries between counters
+        user_ids = set(
+            self.order_by().values_list('user_id', flat=True).distinct()
+        )
+        counter_updates = {
+            field: value for field, value in kwargs.items()
+            if field in COUNTER_FIELDS
+        }
+        if not counter_updates:
+            # the counters don't depend on the updated fields, so there's
+            # nothing to count before the update
+            rows = super(EntryQuerySet, self).update(**kwargs)
+        elif any(
+            hasattr(value, 'resolve_expression')
+            for value in counter_updates.values()
+        ):
+            # the new values depend on each row; recount the years the
+            # entries were in and the years they have moved to
+            with transaction.atomic(using=self.db):
+                entry_ids = list(self.values_list('id', flat=True))
+                entries = Entry.objects.filter(id__in=entry_ids).order_by()
+                entry_years = set(
+                    entries.values_list('entry_year', flat=True).distinct()
+                )
+                rows = super(EntryQuerySet, self).update(**kwargs)
+                if 'entry_year' in counter_updates:
+                    entry_years |= set(
+                        entries.values_list('entry_year', flat=True)
+                        .distinct()
+                    )
+                for entry_year in entry_years:
+                    EntryCounter.rebuild(entry_year)
+        else:
+            if 'entry_year' in counter_updates:
+                counter_updates['entry_year'] = \
+                    str(counter_updates['entry_year'])
+            with transaction.atomic(using=self.db):
+                grouped_counts = self.order_by().values(*COUNTER_FIELDS)\
+                    .annotate(entry_count=Count('id'))
+                deltas = defaultdict(int)
+                for row in grouped_counts:
+                    entry_count = row.pop('entry_count')
+                    row['entry_year'] = str(row['entry_year'])
+                    new_key = dict(row, **counter_updates)
+                    if new_key != row:
+                        deltas[tuple(sorted(row.items()))] -= entry_count
+                        deltas[tuple(sorted(new_key.items()))] += entry_count
+                rows = super(EntryQuerySet, self).update(**kwargs)
+                for counter_key, delta in deltas.items():
+                    if delta:
+                        EntryCounter.adjust(dict(counter_key), delta)
+        if user_ids:
+            bump_entries_version(*user_ids)
+        return rows
+
+
 class Entry(models.Model):
     entry_ref = models.CharField(max_length=22)
     entry_year = models.CharField(
@@ -125,6 +244,12 @@ class Entry(models.Model):
                   'and waiver information has been received for your partner '
                   'also.'
     )
+    # the partner's user account, resolved from partner_email when the entry
+    # is saved and kept up to date when users change their email
+    partner = models.ForeignKey(
+        User, related_name='partner_entries', null=True, blank=True,
+        on_delete=models.SET_NULL
+    )
 
     # payment
     video_entry_paid = models.BooleanField(default=False)
@@ -138,6 +263,8 @@ class Entry(models.Model):
     notified_date = models.DateTimeField(null=True, blank=True)
     reminder_sent = models.BooleanField(default=False)
 
+    objects = EntryQuerySet.as_manager()
+
     class Meta:
         unique_together = ('entry_year', 'user', 'category')
         verbose_name_plural = 'entries'
@@ -152,6 +279,33 @@ class Entry(models.Model):
             wd=' (withdrawn)' if self.withdrawn else ''
         )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Entry, cls).from_db(db, field_names, values)
+        # record the counter key as loaded so save can move the entry
+        # between counters without re-reading it
+        if all(field in instance.__dict__ for field in COUNTER_FIELDS):
+            instance._counter_key = instance.counter_key
+        # and the partner email, so the partner is only looked up if it changes
+        if 'partner_email' in instance.__dict__ and \
+                'category' in instance.__dict__:
+            instance._partner_email = instance.doubles_partner_email
+        return instance
+
+    @property
+    def doubles_partner_email(self):
+        return self.partner_email if self.category == 'DOU' else None
+
+    def resolve_partner(self):
+        partner_email = self.doubles_partner_email
+        self.partner = find_user_by_email(partner_email)
+
+    @property
+    def counter_key(self):
+        key = {field: getattr(self, field) for field in COUNTER_FIELDS}
+        key['entry_year'] = str(key['entry_year'])
+        return key
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
         if not self.id:
@@ -163,6 +317,152 @@ class Entry(models.Model):
         if self.notified and not self.notified_date:
             self.notified_date = timezone.now()
 
-        super(Entry, self).save(
-            force_insert, force_update, using, update_fields
+        partner_email = self.doubles_partner_email
+        if getattr(self, '_partner_email', '') != partner_email:
+            self.resolve_partner()
+            if update_fields is not None:
+                update_fields = set(update_fields) | {'partner'}
+
+        counter_fields = COUNTER_FIELDS if update_fields is None else [
+            field for field in COUNTER_FIELDS if field in update_fields
+        ]
+        if not counter_fields:
+            # the counters can't change
+            super(Entry, self).save(
+                force_insert, force_update, using, update_fields
+            )
+            self._partner_email = partner_email
+            bump_entries_version(self.user_id)
+            return
+
+        old_counter_key = getattr(self, '_counter_key', None)
+        if self.id and old_counter_key is None:
+            # loaded with deferred fields, or saved without being loaded
+            old_counter_key = Entry.objects.filter(id=self.id)\
+                .values(*COUNTER_FIELDS).first()
+
+        with transaction.atomic(using=using):
+            super(Entry, self).save(
+                force_insert, force_update, using, update_fields
+            )
+            new_counter_key = self.counter_key
+            if old_counter_key and update_fields is not None:
+                # only the fields saved have changed in the database
+                new_counter_key = dict(old_counter_key, **{
+                    field: new_counter_key[field] for field in counter_fields
+                })
+            if old_counter_key != new_counter_key:
+                if old_counter_key:
+                    EntryCounter.adjust(old_counter_key, -1)
+                EntryCounter.adjust(new_counter_key, 1)
+        self._counter_key = new_counter_key
+        self._partner_email = partner_email
+        bump_entries_version(self.user_id)
+
+
+class EntryCounter(models.Model):
+    """
+    Denormalised entry counts, one row per combination of the fields that
+    admin dashboards and summaries count by.  Kept up to date by Entry.save,
+    Entry.objects.update() and the Entry post_delete signal; the
+    rebuild_entry_counters management command reconciles any drift.
+    """
+    entry_year = models.CharField(choices=YEAR_CHOICES, max_length=4)
+    category = models.CharField(choices=CATEGORY_CHOICES, max_length=3)
+    status = models.CharField(choices=STATUS_CHOICES, max_length=20)
+    withdrawn = models.BooleanField()
+    video_entry_paid = models.BooleanField()
+    selected_entry_paid = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = COUNTER_FIELDS
+
+    def __str__(self):
+        return "{yr} - {cat} - {status}{wd} - {count}".format(
+            yr=self.entry_year,
+            cat=CATEGORY_CHOICES_DICT[self.category],
+            status=STATUS_CHOICES_DICT[self.status],
+            wd=' (withdrawn)' if self.withdrawn else '',
+            count=self.count
         )
+
+    @classmethod
+    def adjust(cls, counter_key, delta):
+        counter, _ = cls.objects.get_or_create(**counter_key)
+        cls.objects.filter(id=counter.id).update(count=F('count') + delta)
+        cache.delete(entry_stats_cache_key(counter_key['entry_year']))
+
+    @classmethod
+    def rebuild(cls, entry_year=None):
+        """
+        Recalculate counters from the Entry table for one entry year, or for
+        all years if no year is given
+        """
+        entries = Entry.objects.order_by()
+        counters = cls.objects.all()
+        if entry_year:
+            entries = entries.filter(entry_year=entry_year)
+            counters = counters.filter(entry_year=entry_year)
+        grouped_counts = entries.values(*COUNTER_FIELDS)\
+            .annotate(entry_count=Count('id'))
+        with transaction.atomic():
+            counters.delete()
+            cls.objects.bulk_create([
+                cls(
+                    count=row.pop('entry_count'),
+                    **row
+                ) for row in grouped_counts
+            ])
+        if entry_year:
+            cache.delete(entry_stats_cache_key(entry_year))
+        else:
+            cache.delete_many(
+                [entry_stats_cache_key(year) for year, _ in YEAR_CHOICES]
+            )
+
+
+NOTIFICATION_CATEGORIES = (
+    ('withdrawal', 'Entry withdrawals'),
+    ('refund', 'Refunds'),
+    ('payment_problem', 'Payment problems'),
+)
+
+
+class StaffNotification(models.Model):
+    """
+    A notification for the studio or support email address, held to be sent
+    with others in a digest by the send_notification_digests management
+    command
+    """
+    recipient = models.EmailField()
+    category = models.CharField(choices=NOTIFICATION_CATEGORIES, max_length=20)
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    created = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = ('sent', 'recipient')
+
+    def __str__(self):
+        return '{} - {} ({})'.format(
+            self.recipient, self.subject, self.category
+        )
+
+    @classmethod
+    def add(cls, recipients, category, subject, message):
+        cls.objects.bulk_create([
+            cls(
+                recipient=recipient, category=category, subject=subject,
+                message=message
+            ) for recipient in recipients
+        ])
+
+
+def use_notification_digest(critical=False):
+    """
+    Whether a staff notification should be held for the next digest rather
+    than sent now; critical notifications are always sent straight away
+    """
+    return settings.NOTIFICATION_DIGESTS and not critical
@@ -0,0 +1,130 @@
+"""
+Competition dates, parsed once from settings rather than on every call
+"""
+from datetime import datetime
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils import timezone
+
+
+SCHEDULE_SETTINGS = {
+    'CURRENT_ENTRY_YEAR', 'ENTRIES_OPEN_DATE', 'ENTRIES_CLOSE_DATE',
+    'LATE_CATEGORIES_ENTRIES_CLOSE_DATE', 'FINAL_DATE', 'FINAL_TIMES',
+}
+
+
+def parse_date(date_string):
+    return datetime.strptime(date_string, "%d/%m/%Y").replace(
+        tzinfo=timezone.utc
+    )
+
+
+def parse_close_date(date_string):
+    # entries close at the end of the close date
+    return parse_date(date_string).replace(
+        hour=23, minute=59, microsecond=999999
+    )
+
+
+OPEN = 'open'
+LATE_ONLY = 'late_only'
+CLOSED = 'closed'
+
+
+class SchedulePhase(object):
+    """
+    Whether entries are open at a fixed point in time
+    """
+
+    def __init__(self, schedule, now):
+        self.schedule = schedule
+        self.now = now
+        self.all_entries_open = \
+            schedule.open_date < now < schedule.close_date
+        self.late_categories_entries_open = \
+            schedule.open_date < now < schedule.late_close_date
+
+    @property
+    def entries_open(self):
+        return self.all_entries_open or self.late_categories_entries_open
+
+    @property
+    def phase(self):
+        if self.all_entries_open:
+            return OPEN
+        elif self.late_categories_entries_open:
+            return LATE_ONLY
+        return CLOSED
+
+
+class CompetitionSchedule(object):
+    """
+    Entry dates for an entry year.  Only the current entry year's dates are
+    configured in settings.
+    """
+
+    def __init__(
+            self, entry_year, open_date, close_date, late_close_date,
+            final_date, final_times
+    ):
+        self.entry_year = entry_year
+        self.open_date = parse_date(open_date)
+        self.close_date = parse_close_date(close_date)
+        self.late_close_date = parse_close_date(late_close_date)
+        self.final_date = parse_date(final_date).date()
+        self.final_times = final_times
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.CURRENT_ENTRY_YEAR, settings.ENTRIES_OPEN_DATE,
+            settings.ENTRIES_CLOSE_DATE,
+            settings.LATE_CATEGORIES_ENTRIES_CLOSE_DATE, settings.FINAL_DATE,
+            settings.FINAL_TIMES
+        )
+
+    def at(self, now=None):
+        return SchedulePhase(self, now or timezone.now())
+
+    def all_entries_open(self):
+        return self.at().all_entries_open
+
+    def late_categories_entries_open(self):
+        return self.at().late_categories_entries_open
+
+    def entries_open(self):
+        return self.at().entries_open
+
+
+_schedule = None
+
+
+def get_schedule():
+    global _schedule
+    if _schedule is None:
+        _schedule = CompetitionSchedule.from_settings()
+    return _schedule
+
+
+def get_schedule_phase(request=None):
+    """
+    Return the current schedule phase.  With a request, the phase is worked
+    out once and reused for the rest of the request, so views, forms and
+    templates rendered for it all agree on whether entries are open.
+    """
+    schedule = get_schedule()
+    if request is None:
+        return schedule.at()
+    phase = getattr(request, '_schedule_phase', None)
+    if phase is None or phase.schedule is not schedule:
+        phase = request._schedule_phase = schedule.at()
+    return phase
+
+
+@receiver(setting_changed)
+def reset_schedule(setting, **kwargs):
+    global _schedule
+    if setting in SCHEDULE_SETTINGS:
+        _schedule = None
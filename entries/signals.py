@@ -0,0 +1,69 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from allauth.account.models import EmailAddress
+
+from accounts.models import OnlineDisclaimer
+from entries.models import bump_entries_version, COUNTER_FIELDS, Entry, \
+    EntryCounter, partner_check_cache_key
+
+
+@receiver(pre_delete, sender=Entry)
+def record_entry_counter_key(sender, instance, **kwargs):
+    # the counter key as saved, for entries loaded with deferred fields
+    if getattr(instance, '_counter_key', None) is None:
+        instance._counter_key = Entry.objects.filter(id=instance.id)\
+            .values(*COUNTER_FIELDS).first()
+
+
+@receiver(post_delete, sender=Entry)
+def update_entry_counter_on_delete(sender, instance, **kwargs):
+    # decrement the counter the entry was saved in, which may differ from
+    # its current, unsaved values
+    if instance._counter_key:
+        EntryCounter.adjust(instance._counter_key, -1)
+    bump_entries_version(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=OnlineDisclaimer)
+@receiver(post_delete, sender=OnlineDisclaimer)
+def update_entries_version(sender, instance, update_fields=None, **kwargs):
+    # entries pages also show user details and disclaimer status, but not the
+    # last login, which is saved on every login
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    user_id = instance.id if sender == User else instance.user_id
+    bump_entries_version(user_id)
+
+
+@receiver(post_save, sender=User)
+def update_partner_entries(sender, instance, created, update_fields=None,
+                           **kwargs):
+    """
+    Keep doubles entries in step with their partner's email address: entries
+    naming this user as partner get the new email, and entries that gave this
+    email for an unregistered partner are linked to this user
+    """
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    if not created:
+        Entry.objects.filter(partner=instance)\
+            .exclude(partner_email__iexact=instance.email)\
+            .update(partner_email=instance.email)
+    if instance.email:
+        Entry.objects.filter(
+            category='DOU', partner__isnull=True,
+            partner_email__iexact=instance.email
+        ).update(partner=instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=EmailAddress)
+def clear_partner_check(sender, instance, **kwargs):
+    # a cached partner check for this email may say it isn't registered;
+    # checks for registered partners expire with their entries version
+    if instance.email:
+        cache.delete(partner_check_cache_key(instance.email))
@@ -10,6 +10,32 @@
  */
 var MILLS_TO_IGNORE = 500;
 
+/**
+   Returns the partner info box HTML for a partner check result: the error,
+   a warning if the partner has already entered Doubles, or whether the
+   partner is registered and has completed the waiver.
+ */
+var partnerCheckHtml = function(result)  {
+   var yesNo = function(value)  {
+      return value ? "<span class='success'>Yes</span>" : "<span class='fail'>No</span>";
+   };
+   var text;
+   if (result.error) {
+      text = result.error;
+   } else if (result.partner_already_entered) {
+      text = "<span class='fail'><strong>!!!</br>" +
+         "A user with this email address has already entered the Doubles category.  Only one entry should " +
+         "be submitted per doubles.  You will not be able to submit this entry form.  Please have your " +
+         "partner complete the entry form on his/her account.</strong></span>";
+   } else if (result.email) {
+      text = "<strong>Doubles partner registered:</strong> " + yesNo(result.partner) + "</br>" +
+         "<strong>Waiver completed:</strong> " + yesNo(result.partner_waiver);
+   } else {
+      text = "No partner email provided";
+   }
+   return "<div class='partner-info-box'><div class='partner-info-text'>" + text + "</div></div>";
+};
+
 /**
    Executes a toggle click. Triggered by clicks on the regular student yes/no links.
  */
@@ -18,21 +44,23 @@ var processCheckPartnerStatus = function()  {
    //In this scope, "this" is the button just clicked on.
    //The "this" in processResult is *not* the button just clicked
    //on.
-   var partner_email = $('#id_partner_email').val();
+   var partner_email = $.trim($('#id_partner_email').val());
 
    var processResult = function(
        result, status, jqXHR)  {
-      console.log("sf result='" + result + "', status='" + status + "', jqXHR='" + jqXHR + "', partner_email='" + partner_email + "'");
-      $('.partner_info').html(result);
+      $('.partner_info').html(partnerCheckHtml(result));
    }
 
    $.ajax(
        {
-          url: '/entries/myentries/check_partner/?email=' + partner_email,
-          dataType: 'html',
+          url: '/entries/myentries/check_partner/?email=' + encodeURIComponent(partner_email),
+          dataType: 'json',
           type : "GET", // http method
-          success: processResult
-          //Should also have a "fail" call as well.
+          success: processResult,
+          error: function(jqXHR)  {
+             // e.g. 429 if partner checks are being made too quickly
+             processResult(jqXHR.responseJSON || {error: "Partner check failed; please try again"});
+          }
        }
     );
 };
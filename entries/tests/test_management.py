@@ -1,3 +1,4 @@
+import csv
 import sys
 import os
 
@@ -15,7 +16,7 @@ from django.contrib.auth.models import Group, User
 from django.utils import timezone
 
 from activitylog.models import ActivityLog
-from ..models import Entry
+from ..models import Entry, EntryCounter, StaffNotification
 
 
 class ManagementCommandsTests(TestCase):
@@ -398,6 +399,25 @@ class ManagementCommandsTests(TestCase):
         # cleanup
         os.unlink(filepath)
 
+    def test_export_all_entries(self):
+        management.call_command('setup_test_data')
+        filepath = os.path.join(os.getcwd(), 'test_all.csv')
+        management.call_command(
+            'export_entries', 'all', file=filepath, save=True
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            mail.outbox[0].body, 'Submitted entry data attached. 4 entries.')
+        with open(filepath) as file:
+            rows = list(csv.reader(file))
+        os.unlink(filepath)
+        self.assertEqual(rows[0][3], 'Doubles Partner')
+        # rows are grouped by category, in category order
+        self.assertEqual(
+            [row[4] for row in rows[1:]],
+            ['Beginner', 'Intermediate', 'Intermediate', 'Doubles']
+        )
+
     def test_reminders_for_incomplete_entries(self):
         # with no entries
         management.call_command('email_entry_info_reminder')
@@ -441,3 +461,223 @@ class ManagementCommandsTests(TestCase):
                 )
             )
         )
+
+
+class RebuildEntryCountersTests(TestCase):
+
+    def test_rebuild_entry_counters(self):
+        baker.make(Entry, category='BEG', status='submitted', _quantity=2)
+        baker.make(
+            Entry, category='BEG', status='submitted', entry_year='2014'
+        )
+        EntryCounter.objects.update(count=0)
+        management.call_command('rebuild_entry_counters', stdout=StringIO())
+        self.assertEqual(
+            EntryCounter.objects.get(
+                entry_year=settings.CURRENT_ENTRY_YEAR
+            ).count, 2
+        )
+        self.assertEqual(
+            EntryCounter.objects.get(entry_year='2014').count, 1
+        )
+        self.assertEqual(
+            ActivityLog.objects.latest('id').log,
+            'Entry counters rebuilt for all years'
+        )
+
+    def test_rebuild_entry_counters_for_year(self):
+        baker.make(
+            Entry, category='BEG', status='submitted', entry_year='2018'
+        )
+        baker.make(
+            Entry, category='BEG', status='submitted', entry_year='2019'
+        )
+        EntryCounter.objects.update(count=0)
+        management.call_command(
+            'rebuild_entry_counters', year='2018', stdout=StringIO()
+        )
+        self.assertEqual(
+            EntryCounter.objects.get(entry_year='2018').count, 1
+        )
+        # other years are not rebuilt
+        self.assertEqual(
+            EntryCounter.objects.get(entry_year='2019').count, 0
+        )
+
+
+class BenchmarkTemplatesTests(TestCase):
+
+    def test_benchmark_templates(self):
+        user = baker.make(User)
+        baker.make(
+            Entry, user=user, entry_year=settings.CURRENT_ENTRY_YEAR,
+            category='BEG'
+        )
+        output = StringIO()
+        management.call_command(
+            'benchmark_templates', iterations=2, stdout=output
+        )
+        lines = output.getvalue().strip().split('\n')
+        self.assertEqual(len(lines), 4)
+        self.assertIn('uncached user entries page', lines[0])
+        self.assertIn('uncached entry email', lines[1])
+        self.assertIn('cached user entries page', lines[2])
+        self.assertIn('cached entry email', lines[3])
+
+    def test_benchmark_templates_no_user(self):
+        with self.assertRaises(management.CommandError):
+            management.call_command(
+                'benchmark_templates', iterations=1, stdout=StringIO()
+            )
+
+
+class BackfillEntryPartnersTests(TestCase):
+
+    def test_backfill_entry_partners(self):
+        partner = baker.make(User, email='partner@test.com')
+        entries = baker.make(
+            Entry, category='DOU', partner_email='partner@test.com',
+            _quantity=2
+        )
+        unregistered = baker.make(
+            Entry, category='DOU', partner_email='unknown@test.com'
+        )
+        Entry.objects.update(partner=None)
+
+        management.call_command('backfill_entry_partners', stdout=StringIO())
+        for entry in entries:
+            entry.refresh_from_db()
+            self.assertEqual(entry.partner, partner)
+        unregistered.refresh_from_db()
+        self.assertIsNone(unregistered.partner)
+        self.assertEqual(
+            ActivityLog.objects.latest('id').log,
+            'Doubles partners linked for 2 of 3 entries'
+        )
+
+    def test_backfill_all_entry_partners(self):
+        partner = baker.make(User, email='partner@test.com')
+        other_user = baker.make(User)
+        entry = baker.make(
+            Entry, category='DOU', partner_email='partner@test.com'
+        )
+        Entry.objects.update(partner=other_user)
+
+        management.call_command('backfill_entry_partners', stdout=StringIO())
+        entry.refresh_from_db()
+        self.assertEqual(entry.partner, other_user)
+
+        management.call_command(
+            'backfill_entry_partners', all=True, stdout=StringIO()
+        )
+        entry.refresh_from_db()
+        self.assertEqual(entry.partner, partner)
+
+
+class SendNotificationDigestsTests(TestCase):
+
+    def test_one_digest_per_recipient(self):
+        StaffNotification.add(
+            ['studio@test.com'], 'withdrawal', 'Entry withdrawn',
+            'Entry 1 withdrawn'
+        )
+        StaffNotification.add(
+            ['studio@test.com'], 'withdrawal', 'Entry withdrawn',
+            'Entry 2 withdrawn'
+        )
+        StaffNotification.add(
+            ['support@test.com'], 'refund', 'Refund processed',
+            'Refund for entry 3'
+        )
+        StaffNotification.add(
+            ['studio@test.com'], 'payment_problem', 'Payment pending',
+            'Payment for entry 4 is pending'
+        )
+        output = StringIO()
+        management.call_command('send_notification_digests', stdout=output)
+
+        self.assertEqual(len(mail.outbox), 2)
+        studio_email, support_email = sorted(
+            mail.outbox, key=lambda email: email.to
+        )
+        self.assertEqual(studio_email.to, ['studio@test.com'])
+        self.assertEqual(
+            studio_email.subject,
+            '{} 3 notifications'.format(settings.ACCOUNT_EMAIL_SUBJECT_PREFIX)
+        )
+        for text in [
+            'ENTRY WITHDRAWALS (2)', 'Entry 1 withdrawn', 'Entry 2 withdrawn',
+            'PAYMENT PROBLEMS (1)', 'Payment for entry 4 is pending'
+        ]:
+            self.assertIn(text, studio_email.body)
+        self.assertNotIn('REFUNDS', studio_email.body)
+        self.assertEqual(support_email.to, ['support@test.com'])
+        self.assertIn('Refund for entry 3', support_email.body)
+
+        self.assertFalse(
+            StaffNotification.objects.filter(sent__isnull=True).exists()
+        )
+        self.assertIn(
+            'Notification digests sent to studio@test.com, support@test.com '
+            '(4 notifications)', output.getvalue()
+        )
+
+        # already sent
+        management.call_command(
+            'send_notification_digests', stdout=StringIO()
+        )
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_no_notifications(self):
+        output = StringIO()
+        management.call_command('send_notification_digests', stdout=output)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertIn('No notifications to send', output.getvalue())
+
+    @patch('entries.management.commands.send_notification_digests.get_connection')
+    def test_notifications_kept_if_sending_fails(self, mock_get_connection):
+        def send_messages(messages):
+            if messages[0].to == ['studio@test.com']:
+                raise Exception('Error sending email')
+            return 1
+        mock_get_connection.return_value.send_messages.side_effect = \
+            send_messages
+        StaffNotification.add(
+            ['studio@test.com', 'support@test.com'], 'withdrawal',
+            'Entry withdrawn', 'Entry 1 withdrawn'
+        )
+        output = StringIO()
+        management.call_command('send_notification_digests', stdout=output)
+        # only the failed digest is kept for the next run
+        self.assertIsNone(
+            StaffNotification.objects.get(recipient='studio@test.com').sent
+        )
+        self.assertIsNotNone(
+            StaffNotification.objects.get(recipient='support@test.com').sent
+        )
+        self.assertIn(
+            'Notification digests sent to support@test.com (1 notifications); '
+            'failed to send to studio@test.com', output.getvalue()
+        )
+
+    def test_notifications_claimed_by_another_run_left_alone(self):
+        StaffNotification.add(
+            ['studio@test.com'], 'withdrawal', 'Entry withdrawn',
+            'Entry 1 withdrawn'
+        )
+        claimed_at = timezone.now() - timedelta(seconds=10)
+        StaffNotification.objects.update(sent=claimed_at)
+        StaffNotification.add(
+            ['studio@test.com'], 'withdrawal', 'Entry withdrawn',
+            'Entry 2 withdrawn'
+        )
+        management.call_command(
+            'send_notification_digests', stdout=StringIO()
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Entry 2 withdrawn', mail.outbox[0].body)
+        self.assertNotIn('Entry 1 withdrawn', mail.outbox[0].body)
+        self.assertEqual(
+            StaffNotification.objects.get(message='Entry 1 withdrawn').sent,
+            claimed_at
+        )
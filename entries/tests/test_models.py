@@ -3,11 +3,12 @@ from unittest.mock import patch
 from model_bakery import baker
 
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.test import TestCase
 from django.utils import timezone
 
 from .helpers import TestSetupMixin
-from ..models import Entry
+from ..models import Entry, EntryCounter
 
 
 class EntryModelTests(TestSetupMixin, TestCase):
@@ -40,3 +41,169 @@ class EntryModelTests(TestSetupMixin, TestCase):
         entry.save()
         self.assertEqual(entry.date_submitted, mock_now)
 
+
+class EntryCounterTests(TestSetupMixin, TestCase):
+
+    def get_count(self, **kwargs):
+        return sum(
+            EntryCounter.objects.filter(**kwargs).values_list('count', flat=True)
+        )
+
+    def test_counter_incremented_on_create(self):
+        baker.make(Entry, category='INT', status='submitted', _quantity=2)
+        self.assertEqual(
+            self.get_count(category='INT', status='submitted'), 2
+        )
+
+    def test_counter_moved_on_save(self):
+        entry = baker.make(Entry, category='INT', status='submitted')
+        entry.status = 'selected'
+        entry.save()
+        self.assertEqual(self.get_count(status='submitted'), 0)
+        self.assertEqual(self.get_count(status='selected'), 1)
+
+        # reloaded entries also move counters
+        entry = Entry.objects.get(id=entry.id)
+        entry.withdrawn = True
+        entry.save()
+        self.assertEqual(self.get_count(status='selected', withdrawn=False), 0)
+        self.assertEqual(self.get_count(status='selected', withdrawn=True), 1)
+
+    def test_counter_decremented_on_delete(self):
+        entry = baker.make(Entry, category='INT', status='submitted')
+        baker.make(Entry, category='INT', status='submitted')
+        entry.delete()
+        self.assertEqual(self.get_count(category='INT'), 1)
+        Entry.objects.all().delete()
+        self.assertEqual(self.get_count(category='INT'), 0)
+
+    def test_counter_decremented_on_delete_with_unsaved_changes(self):
+        entry = baker.make(Entry, category='INT', status='submitted')
+        entry.status = 'selected'
+        entry.delete()
+        self.assertEqual(self.get_count(status='submitted'), 0)
+        self.assertEqual(self.get_count(status='selected'), 0)
+
+        entry = baker.make(Entry, category='INT', status='submitted')
+        Entry.objects.only('id', 'user').get(id=entry.id).delete()
+        self.assertEqual(self.get_count(status='submitted'), 0)
+
+    def test_counters_not_changed_if_counter_fields_not_saved(self):
+        entry = baker.make(Entry, category='INT', status='submitted')
+        entry.status = 'selected'
+        with self.assertNumQueries(1):
+            entry.save(update_fields=['song'])
+        self.assertEqual(self.get_count(status='submitted'), 1)
+        self.assertEqual(self.get_count(status='selected'), 0)
+
+        entry.save(update_fields=['status'])
+        self.assertEqual(self.get_count(status='submitted'), 0)
+        self.assertEqual(self.get_count(status='selected'), 1)
+
+    def test_counter_updated_on_bulk_update(self):
+        baker.make(Entry, category='INT', status='submitted', _quantity=3)
+        Entry.objects.filter(category='INT').update(video_entry_paid=True)
+        self.assertEqual(self.get_count(video_entry_paid=False), 0)
+        self.assertEqual(self.get_count(video_entry_paid=True), 3)
+
+    def test_bulk_update_of_other_fields_does_not_count_entries(self):
+        baker.make(Entry, category='INT', status='submitted', _quantity=3)
+        with patch.object(EntryCounter, 'adjust') as mock_adjust:
+            # the users to bump the entries version for, and the update
+            with self.assertNumQueries(2) as captured:
+                Entry.objects.filter(category='INT').update(song='Song')
+            mock_adjust.assert_not_called()
+        self.assertFalse(
+            [
+                query for query in captured.captured_queries
+                if 'COUNT(' in query['sql']
+            ]
+        )
+        self.assertEqual(self.get_count(category='INT', status='submitted'), 3)
+
+    def test_bulk_update_adjusts_counters_without_rebuild(self):
+        baker.make(Entry, category='INT', status='submitted', _quantity=3)
+        baker.make(Entry, category='BEG', status='selected', _quantity=2)
+        baker.make(Entry, category='ADV', status='submitted', entry_year='2014')
+        with patch.object(EntryCounter, 'rebuild') as mock_rebuild:
+            Entry.objects.filter(entry_year=settings.CURRENT_ENTRY_YEAR)\
+                .update(status='selected')
+            mock_rebuild.assert_not_called()
+        self.assertEqual(
+            self.get_count(
+                entry_year=settings.CURRENT_ENTRY_YEAR, status='submitted'
+            ), 0
+        )
+        self.assertEqual(self.get_count(category='INT', status='selected'), 3)
+        self.assertEqual(self.get_count(category='BEG', status='selected'), 2)
+        self.assertEqual(self.get_count(entry_year='2014', status='submitted'), 1)
+
+        Entry.objects.filter(category='INT').update(entry_year=2014)
+        self.assertEqual(self.get_count(entry_year='2014', category='INT'), 3)
+        self.assertEqual(
+            self.get_count(
+                entry_year=settings.CURRENT_ENTRY_YEAR, category='INT'
+            ), 0
+        )
+
+    def test_rebuild(self):
+        baker.make(Entry, category='INT', status='submitted', _quantity=3)
+        EntryCounter.objects.update(count=10)
+        EntryCounter.rebuild(settings.CURRENT_ENTRY_YEAR)
+        self.assertEqual(self.get_count(category='INT'), 3)
+
+
+class EntryPartnerTests(TestCase):
+
+    def setUp(self):
+        self.partner = baker.make(User, email='partner@test.com')
+
+    def test_partner_resolved_on_save(self):
+        entry = baker.make(
+            Entry, category='DOU', partner_email='partner@test.com'
+        )
+        self.assertEqual(entry.partner, self.partner)
+
+    def test_partner_not_set_for_other_categories(self):
+        entry = baker.make(
+            Entry, category='BEG', partner_email='partner@test.com'
+        )
+        self.assertIsNone(entry.partner)
+
+    def test_partner_only_looked_up_when_email_changes(self):
+        entry = baker.make(
+            Entry, category='DOU', partner_email='partner@test.com'
+        )
+        entry = Entry.objects.get(id=entry.id)
+        entry.stage_name = 'Foo'
+        with patch.object(Entry, 'resolve_partner') as mock_resolve:
+            entry.save()
+            mock_resolve.assert_not_called()
+
+        new_partner = baker.make(User, email='new_partner@test.com')
+        entry.partner_email = 'new_partner@test.com'
+        entry.save()
+        self.assertEqual(Entry.objects.get(id=entry.id).partner, new_partner)
+
+        entry.partner_email = 'unknown@test.com'
+        entry.save()
+        self.assertIsNone(Entry.objects.get(id=entry.id).partner)
+
+    def test_partner_email_kept_in_sync(self):
+        entry = baker.make(
+            Entry, category='DOU', partner_email='partner@test.com'
+        )
+        self.partner.email = 'changed@test.com'
+        self.partner.save()
+        entry.refresh_from_db()
+        self.assertEqual(entry.partner, self.partner)
+        self.assertEqual(entry.partner_email, 'changed@test.com')
+
+    def test_partner_linked_when_partner_registers(self):
+        entry = baker.make(
+            Entry, category='DOU', partner_email='newuser@test.com'
+        )
+        self.assertIsNone(entry.partner)
+        new_user = baker.make(User, email='newuser@test.com')
+        entry.refresh_from_db()
+        self.assertEqual(entry.partner, new_user)
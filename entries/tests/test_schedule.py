@@ -0,0 +1,96 @@
+from datetime import date, datetime
+from unittest.mock import patch
+
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from ..context_processors import entries
+from ..schedule import CLOSED, LATE_ONLY, OPEN, CompetitionSchedule, \
+    get_schedule, get_schedule_phase
+
+
+@override_settings(
+    ENTRIES_OPEN_DATE="01/01/2016",
+    ENTRIES_CLOSE_DATE="01/02/2016",
+    LATE_CATEGORIES_ENTRIES_CLOSE_DATE="01/03/2016",
+    FINAL_DATE="01/06/2016",
+    FINAL_TIMES="10am - 6pm"
+)
+class CompetitionScheduleTests(TestCase):
+
+    def test_dates_parsed_from_settings(self):
+        schedule = get_schedule()
+        self.assertEqual(
+            schedule.open_date, datetime(2016, 1, 1, tzinfo=timezone.utc)
+        )
+        self.assertEqual(
+            schedule.close_date,
+            datetime(2016, 2, 1, 23, 59, 0, 999999, tzinfo=timezone.utc)
+        )
+        self.assertEqual(
+            schedule.late_close_date,
+            datetime(2016, 3, 1, 23, 59, 0, 999999, tzinfo=timezone.utc)
+        )
+        self.assertEqual(schedule.final_date, date(2016, 6, 1))
+        self.assertEqual(schedule.final_times, "10am - 6pm")
+
+    def test_schedule_is_reused(self):
+        self.assertIs(get_schedule(), get_schedule())
+
+    def test_schedule_rebuilt_when_settings_change(self):
+        schedule = get_schedule()
+        with override_settings(ENTRIES_CLOSE_DATE="15/02/2016"):
+            self.assertNotEqual(get_schedule(), schedule)
+            self.assertEqual(get_schedule().close_date.day, 15)
+        self.assertEqual(get_schedule().close_date.day, 1)
+
+    @patch('entries.schedule.timezone.now')
+    def test_entries_open(self, mock_now):
+        schedule = get_schedule()
+        mock_now.return_value = datetime(2016, 1, 15, tzinfo=timezone.utc)
+        self.assertTrue(schedule.all_entries_open())
+        self.assertTrue(schedule.late_categories_entries_open())
+        self.assertTrue(schedule.entries_open())
+
+        mock_now.return_value = datetime(2016, 2, 15, tzinfo=timezone.utc)
+        self.assertFalse(schedule.all_entries_open())
+        self.assertTrue(schedule.late_categories_entries_open())
+        self.assertTrue(schedule.entries_open())
+
+        mock_now.return_value = datetime(2016, 3, 15, tzinfo=timezone.utc)
+        self.assertFalse(schedule.entries_open())
+
+    @patch.object(CompetitionSchedule, 'at')
+    def test_context_processor_entries_open_is_lazy(self, mock_at):
+        mock_at.return_value.late_categories_entries_open = True
+        context = entries(RequestFactory().get('/'))
+        mock_at.assert_not_called()
+        self.assertTrue(context['entries_open'])
+        self.assertTrue(context['entries_open'])
+        self.assertEqual(mock_at.call_count, 1)
+
+    @patch('entries.schedule.timezone.now')
+    def test_phase(self, mock_now):
+        schedule = get_schedule()
+        for now, phase in [
+            (datetime(2015, 12, 1, tzinfo=timezone.utc), CLOSED),
+            (datetime(2016, 1, 15, tzinfo=timezone.utc), OPEN),
+            (datetime(2016, 2, 15, tzinfo=timezone.utc), LATE_ONLY),
+            (datetime(2016, 3, 15, tzinfo=timezone.utc), CLOSED),
+        ]:
+            mock_now.return_value = now
+            self.assertEqual(schedule.at().phase, phase)
+
+    @patch('entries.schedule.timezone.now')
+    def test_phase_reused_for_request(self, mock_now):
+        mock_now.return_value = datetime(2016, 1, 15, tzinfo=timezone.utc)
+        request = RequestFactory().get('/')
+        phase = get_schedule_phase(request)
+        self.assertEqual(phase.phase, OPEN)
+
+        mock_now.return_value = datetime(2016, 3, 15, tzinfo=timezone.utc)
+        self.assertIs(get_schedule_phase(request), phase)
+        # a new request gets the current phase
+        self.assertEqual(
+            get_schedule_phase(RequestFactory().get('/')).phase, CLOSED
+        )
@@ -0,0 +1,129 @@
+from model_bakery import baker
+
+from django.core.cache import cache
+from django.db.models import CharField, Value
+from django.test import TestCase
+
+from ..models import Entry
+from ..utils import get_entry_stats, iter_by_category, \
+    partition_by_category
+
+
+class EntryStatsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_stats_by_category(self):
+        baker.make(Entry, category='BEG', status='in_progress')
+        baker.make(Entry, category='BEG', status='submitted')
+        baker.make(
+            Entry, category='BEG', status='submitted', video_entry_paid=True
+        )
+        baker.make(
+            Entry, category='BEG', status='selected', video_entry_paid=True
+        )
+        baker.make(
+            Entry, category='INT', status='selected_confirmed',
+            video_entry_paid=True, selected_entry_paid=True
+        )
+        baker.make(
+            Entry, category='INT', status='rejected', video_entry_paid=True
+        )
+        baker.make(Entry, category='INT', status='submitted', withdrawn=True)
+        # other years are not counted
+        baker.make(Entry, category='INT', status='submitted', entry_year='2014')
+
+        stats = get_entry_stats()
+        self.assertEqual(
+            [category for category, _ in stats['categories']], ['BEG', 'INT']
+        )
+        beg_stats = dict(stats['categories'])['BEG']
+        self.assertEqual(beg_stats['in_progress'], 1)
+        self.assertEqual(beg_stats['submitted'], 3)
+        self.assertEqual(beg_stats['video_entry_paid'], 2)
+        self.assertEqual(beg_stats['selected'], 1)
+        self.assertEqual(beg_stats['selected_confirmed'], 0)
+
+        int_stats = dict(stats['categories'])['INT']
+        self.assertEqual(int_stats['submitted'], 2)
+        self.assertEqual(int_stats['selected'], 1)
+        self.assertEqual(int_stats['selected_confirmed'], 1)
+        self.assertEqual(int_stats['selected_entry_paid'], 1)
+        self.assertEqual(int_stats['rejected'], 1)
+        self.assertEqual(int_stats['withdrawn'], 1)
+
+        self.assertEqual(stats['totals']['submitted'], 5)
+        self.assertEqual(stats['totals']['withdrawn'], 1)
+
+    def test_stats_cached(self):
+        baker.make(Entry, category='BEG', status='submitted')
+        get_entry_stats()
+        with self.assertNumQueries(0):
+            stats = get_entry_stats()
+        self.assertEqual(stats['totals']['submitted'], 1)
+
+    def test_stats_cache_cleared_on_entry_save_and_delete(self):
+        entry = baker.make(Entry, category='BEG', status='submitted')
+        self.assertEqual(get_entry_stats()['totals']['submitted'], 1)
+
+        entry.status = 'selected'
+        entry.save()
+        stats = get_entry_stats()
+        self.assertEqual(stats['totals']['selected'], 1)
+
+        entry.delete()
+        self.assertEqual(get_entry_stats()['categories'], [])
+
+    def test_stats_cache_cleared_for_old_and_new_year(self):
+        entry = baker.make(Entry, category='BEG', entry_year='2014')
+        self.assertEqual(get_entry_stats('2014')['totals']['in_progress'], 1)
+        self.assertEqual(get_entry_stats('2015')['categories'], [])
+
+        entry.entry_year = '2015'
+        entry.save()
+        self.assertEqual(get_entry_stats('2014')['categories'], [])
+        self.assertEqual(get_entry_stats('2015')['totals']['in_progress'], 1)
+
+        Entry.objects.filter(id=entry.id).update(entry_year='2014')
+        self.assertEqual(get_entry_stats('2014')['totals']['in_progress'], 1)
+        self.assertEqual(get_entry_stats('2015')['categories'], [])
+
+        Entry.objects.filter(id=entry.id).update(
+            entry_year=Value('2015', output_field=CharField())
+        )
+        self.assertEqual(get_entry_stats('2014')['categories'], [])
+        self.assertEqual(get_entry_stats('2015')['totals']['in_progress'], 1)
+
+
+class PartitionByCategoryTests(TestCase):
+
+    def test_partition_in_single_query(self):
+        baker.make(Entry, category='DOU', _quantity=2)
+        baker.make(Entry, category='BEG', _quantity=3)
+        baker.make(Entry, category='ADV')
+        with self.assertNumQueries(1):
+            partitioned = partition_by_category(Entry.objects.all())
+        # categories in CATEGORY_CHOICES order; empty categories omitted
+        self.assertEqual(
+            [category for category, _ in partitioned], ['BEG', 'ADV', 'DOU']
+        )
+        self.assertEqual(
+            [len(entries) for _, entries in partitioned], [3, 1, 2]
+        )
+        for category, entries in partitioned:
+            self.assertTrue(all(entry.category == category for entry in entries))
+
+    def test_iter_by_category(self):
+        baker.make(Entry, category='DOU', _quantity=2)
+        baker.make(Entry, category='BEG', _quantity=3)
+        baker.make(Entry, category='ADV')
+        with self.assertNumQueries(1):
+            grouped = [
+                (category, list(entries))
+                for category, entries in iter_by_category(Entry.objects.all())
+            ]
+        self.assertEqual(
+            [category for category, _ in grouped], ['BEG', 'ADV', 'DOU']
+        )
+        self.assertEqual([len(entries) for _, entries in grouped], [3, 1, 2])
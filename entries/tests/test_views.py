@@ -1,5 +1,7 @@
 import os
 
+from unittest.mock import patch
+
 from model_bakery import baker
 
 from django.conf import settings
@@ -14,7 +16,8 @@ from accounts.models import OnlineDisclaimer
 from accounts.utils import has_active_data_privacy_agreement
 
 from .helpers import format_content, TestSetupMixin, TestSetupLoginRequiredMixin
-from ..models import Entry, STATUS_CHOICES_DICT
+from ..models import Entry, get_entries_version, StaffNotification, \
+    STATUS_CHOICES_DICT
 from ..views import pdf_view
 
 from payments.models import PaypalEntryTransaction
@@ -195,6 +198,80 @@ class EntryListViewTests(TestSetupLoginRequiredMixin, TestCase):
         )
 
 
+class EntryListViewETagTests(TestSetupMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.url = reverse('entries:user_entries')
+
+    def setUp(self):
+        cache.clear()
+        self.entry = baker.make(Entry, user=self.user, status='in_progress')
+        self.client.login(username=self.user.username, password='test')
+
+    def test_etag_and_not_modified(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+        self.assertIn('no-cache', resp['Cache-Control'])
+
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.templates, [])
+
+    def test_entry_change_updates_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.entry.status = 'submitted'
+        self.entry.save()
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+
+        etag = resp['ETag']
+        Entry.objects.filter(id=self.entry.id).update(video_entry_paid=True)
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_other_users_entries_do_not_change_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        other_entry = baker.make(Entry, user=self.user_no_disclaimer)
+        other_entry.status = 'submitted'
+        other_entry.save()
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+    def test_no_etag_with_messages_waiting(self):
+        # deleting an entry adds a message for the entries page
+        self.client.post(
+            reverse('entries:delete_entry', args=[self.entry.entry_ref])
+        )
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.has_header('ETag'))
+        # once the message has been shown, the ETag is set again
+        self.assertTrue(self.client.get(self.url).has_header('ETag'))
+
+    def test_no_etag_if_cache_unavailable(self):
+        # memcached clients return None for every key when the server is down
+        with patch('entries.models.cache') as mock_cache:
+            mock_cache.get.return_value = None
+            resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(resp.has_header('ETag'))
+
+    def test_login_does_not_change_entries_version(self):
+        version = get_entries_version(self.user.id)
+        self.client.logout()
+        self.client.login(username=self.user.username, password='test')
+        self.assertEqual(get_entries_version(self.user.id), version)
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(get_entries_version(self.user.id), version)
+        self.user.first_name = 'New'
+        self.user.save()
+        self.assertNotEqual(get_entries_version(self.user.id), version)
+
+
 @override_settings(
         ENTRIES_OPEN_DATE="01/01/2016",
         ENTRIES_CLOSE_DATE="01/01/2200",
@@ -615,6 +692,7 @@ class EntryWithdrawViewTests(TestSetupLoginRequiredMixin, TestCase):
         self.assertEqual(entry.status, 'selected_confirmed')
         self.assertTrue(entry.withdrawn)
 
+    @override_settings(NOTIFICATION_DIGESTS=False)
     def test_emails(self):
         """
         Email sent to PP if status is selected or selected_confirmed; email to
@@ -671,6 +749,28 @@ class EntryWithdrawViewTests(TestSetupLoginRequiredMixin, TestCase):
             '{} Entry withdrawn'.format(settings.ACCOUNT_EMAIL_SUBJECT_PREFIX)
         )
 
+    @override_settings(NOTIFICATION_DIGESTS=True)
+    def test_studio_notification_held_for_digest(self):
+        self.client.login(username=self.user.username, password='test')
+        entry = baker.make(
+            Entry, user=self.user, category='ADV', status='selected_confirmed'
+        )
+        self.client.post(
+            reverse('entries:withdraw_entry', args=(entry.entry_ref,)),
+            {'id': entry.id}
+        )
+        # user is emailed straight away
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [entry.user.email])
+
+        notification = StaffNotification.objects.get()
+        self.assertEqual(notification.recipient, settings.DEFAULT_STUDIO_EMAIL)
+        self.assertEqual(notification.category, 'withdrawal')
+        self.assertEqual(notification.subject, 'Entry withdrawn')
+        self.assertIn(
+            'has been withdrawn AFTER SELECTED', notification.message
+        )
+
 
 class VideoPaymentViewTests(TestSetupLoginRequiredMixin, TestCase):
 
@@ -782,6 +882,7 @@ class DoublePartnerCheckTests(TestSetupMixin, TestCase):
         baker.make(Entry, user=cls.user_already_other, category='BEG')
 
     def setUp(self):
+        cache.clear()
         self.client.login(username=self.user.username, password='test')
 
     def get_url(self, email):
@@ -789,64 +890,81 @@ class DoublePartnerCheckTests(TestSetupMixin, TestCase):
 
     def test_partner_exists_and_has_disclaimer(self):
         resp = self.client.post(self.get_url(self.user_with_disclaimer.email))
-        self.assertIn(
-            'Doubles partner registered: Yes',
-            format_content(str(resp.content)),
-        )
-        self.assertIn(
-            'Waiver completed: Yes',
-            format_content(str(resp.content)),
+        self.assertEqual(
+            resp.json(),
+            {
+                'email': self.user_with_disclaimer.email, 'partner': True,
+                'partner_waiver': True, 'partner_already_entered': False,
+                'ok': True
+            }
         )
 
     def test_partner_exists_no_disclaimer(self):
         resp = self.client.get(self.get_url(self.user_no_disclaimer.email))
-        self.assertIn(
-            'Doubles partner registered: Yes',
-            format_content(str(resp.content)),
-        )
-        self.assertIn(
-            'Waiver completed: No',
-            format_content(str(resp.content)),
-        )
+        self.assertTrue(resp.json()['partner'])
+        self.assertFalse(resp.json()['partner_waiver'])
+        self.assertFalse(resp.json()['ok'])
 
     def test_partner_does_not_exist(self):
         resp = self.client.get(self.get_url('nonuser@test.com'))
-        self.assertIn(
-            'Doubles partner registered: No',
-            format_content(str(resp.content)),
-        )
-        self.assertIn(
-            'Waiver completed: No',
-            format_content(str(resp.content)),
-        )
+        self.assertFalse(resp.json()['partner'])
+        self.assertFalse(resp.json()['partner_waiver'])
+        self.assertFalse(resp.json()['ok'])
 
     def test_partner_no_email_provided(self):
         resp = self.client.get(self.get_url(''))
-        self.assertIn(
-            'No partner email provided',
-            format_content(str(resp.content)),
-        )
+        self.assertEqual(resp.json(), {'email': ''})
 
     def test_partner_already_entered_doubles(self):
         resp = self.client.get(self.get_url(self.user_already_doubles.email))
-        self.assertIn(
-            '!!! A user with this email address has already entered the '
-            'Doubles category. Only one entry should be submitted per doubles. '
-            'You will not be able to submit this entry form. Please have your '
-            'partner complete the entry form on his/her account.',
-            format_content(str(resp.content)),
-        )
+        self.assertTrue(resp.json()['partner_already_entered'])
+        self.assertFalse(resp.json()['ok'])
 
     def test_partner_already_entered_other_category(self):
         resp = self.client.get(self.get_url(self.user_already_other.email))
-        self.assertIn(
-            'Doubles partner registered: Yes',
-            format_content(str(resp.content)),
-        )
-        self.assertIn(
-            'Waiver completed: Yes',
-            format_content(str(resp.content)),
-        )
+        self.assertTrue(resp.json()['partner'])
+        self.assertTrue(resp.json()['partner_waiver'])
+        self.assertFalse(resp.json()['partner_already_entered'])
+        self.assertTrue(resp.json()['ok'])
+
+    def test_partner_check_cached(self):
+        email = self.user_with_disclaimer.email
+        self.client.get(self.get_url(email))
+        # cached for the normalised email
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.get_url(email.upper()))
+        self.assertTrue(resp.json()['ok'])
+
+    def test_partner_check_cache_invalidated(self):
+        partner = baker.make(User, email='partner@test.com')
+        resp = self.client.get(self.get_url('Partner@test.com'))
+        self.assertFalse(resp.json()['partner_waiver'])
+
+        # partner completes their disclaimer
+        baker.make(OnlineDisclaimer, user=partner)
+        resp = self.client.get(self.get_url('Partner@test.com'))
+        self.assertTrue(resp.json()['ok'])
+
+        # partner enters doubles
+        baker.make(Entry, user=partner, category='DOU')
+        resp = self.client.get(self.get_url('Partner@test.com'))
+        self.assertTrue(resp.json()['partner_already_entered'])
+
+    def test_unknown_partner_check_cleared_when_registered(self):
+        resp = self.client.get(self.get_url('new@test.com'))
+        self.assertFalse(resp.json()['partner'])
+        baker.make(User, email='New@test.com')
+        resp = self.client.get(self.get_url('new@test.com'))
+        self.assertTrue(resp.json()['partner'])
+
+    @override_settings(PARTNER_CHECK_RATE_LIMIT=2)
+    def test_partner_check_rate_limited(self):
+        for _ in range(2):
+            resp = self.client.get(self.get_url('nonuser@test.com'))
+            self.assertEqual(resp.status_code, 200)
+        resp = self.client.get(self.get_url('nonuser@test.com'))
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn('error', resp.json())
 
 
 class EntryConfirmViewTests(TestSetupLoginRequiredMixin, TestCase):
@@ -1,20 +1,24 @@
-from datetime import datetime
+from itertools import groupby
+from operator import attrgetter
+
 from django.conf import settings
-from django.contrib.auth.models import User
-from django.utils import timezone
+from django.core.cache import cache
+from django.db.models import Case, IntegerField, Value, When
 
 from accounts.models import has_disclaimer
+from accounts.utils import find_user_by_email
 
-from .models import Entry
+from .models import Entry, EntryCounter, CATEGORY_CHOICES, \
+    CATEGORY_CHOICES_ORDER, entry_stats_cache_key, get_entries_version, \
+    partner_check_cache_key
 
 
 def check_partner_email(email):
-    ok = False
-    try:
-        partner = User.objects.get(email=email)
-    except User.DoesNotExist:
-        partner = None
+    return _check_partner(find_user_by_email(email))
+
 
+def _check_partner(partner):
+    ok = False
     result = {'partner': bool(partner)}
 
     if partner:
@@ -33,31 +37,155 @@ def check_partner_email(email):
     return result, ok
 
 
-def is_open(open_date, close_date):
-    open_date = datetime.strptime(open_date, "%d/%m/%Y")
-    open_date = open_date.replace(tzinfo=timezone.utc)
-    close_date = datetime.strptime(close_date, "%d/%m/%Y")
-    close_date = close_date.replace(
-        hour=23, minute=59, microsecond=999999, tzinfo=timezone.utc
+def get_partner_check(email):
+    """
+    Cached check_partner_email, for the check partner button.  A result for a
+    registered partner is only reused while that partner's entries version is
+    unchanged, i.e. until they (or their disclaimer or entries) are updated;
+    results for unknown emails are cleared when a user registers the email.
+    """
+    key = partner_check_cache_key(email)
+    cached = cache.get(key)
+    if cached is not None:
+        partner_id, version, result, ok = cached
+        if partner_id is None or version == get_entries_version(partner_id):
+            return result, ok
+
+    partner = find_user_by_email(email)
+    # read the version before running the checks, so a change made while
+    # they run isn't missed
+    version = get_entries_version(partner.id) if partner else None
+    result, ok = _check_partner(partner)
+    cache.set(
+        key, (partner.id if partner else None, version, result, ok),
+        settings.PARTNER_CHECK_CACHE_TIMEOUT
     )
-    return open_date < timezone.now() < close_date, open_date, close_date
-
-
-def all_entries_open():
-    return is_open(settings.ENTRIES_OPEN_DATE, settings.ENTRIES_CLOSE_DATE)
-
-
-def final_datetime():
-    final_date = datetime.strptime(settings.FINAL_DATE, "%d/%m/%Y").date
-    final_times = settings.FINAL_TIMES
-    return final_date, final_times
+    return result, ok
 
 
-def late_categories_entries_open():
-    return is_open(
-        settings.ENTRIES_OPEN_DATE, settings.LATE_CATEGORIES_ENTRIES_CLOSE_DATE
+def partner_check_rate_limited(request):
+    """
+    Count a partner check for this session (or user/IP if there is no
+    session yet); return True if the session has made more than
+    PARTNER_CHECK_RATE_LIMIT checks in the current window
+    """
+    client = request.session.session_key or (
+        'user_{}'.format(request.user.id) if request.user.is_authenticated
+        else request.META.get('REMOTE_ADDR')
     )
-
-
-def entries_open():
-    return all_entries_open()[0] or late_categories_entries_open()[0]
+    key = 'partner_check_rate_{}'.format(client)
+    cache.add(key, 0, settings.PARTNER_CHECK_RATE_WINDOW)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # expired between add and incr
+        cache.set(key, 1, settings.PARTNER_CHECK_RATE_WINDOW)
+        count = 1
+    return count > settings.PARTNER_CHECK_RATE_LIMIT
+
+
+ENTRY_STATS_FIELDS = (
+    'in_progress', 'submitted', 'video_entry_paid', 'selected',
+    'selected_confirmed', 'selected_entry_paid', 'rejected', 'withdrawn'
+)
+
+
+def _count_entry_stats(grouped_counts):
+    """
+    Roll up EntryCounter rows into per-category statistics
+    """
+    stats = {
+        category: dict.fromkeys(ENTRY_STATS_FIELDS, 0)
+        for category, _ in CATEGORY_CHOICES
+    }
+    for row in grouped_counts:
+        cat_stats = stats[row['category']]
+        count = row['count']
+        if row['withdrawn']:
+            cat_stats['withdrawn'] += count
+            continue
+        if row['status'] == 'in_progress':
+            cat_stats['in_progress'] += count
+            continue
+        cat_stats['submitted'] += count
+        if row['video_entry_paid']:
+            cat_stats['video_entry_paid'] += count
+        if row['status'] in ['selected', 'selected_confirmed']:
+            cat_stats['selected'] += count
+        if row['status'] == 'selected_confirmed':
+            cat_stats['selected_confirmed'] += count
+            if row['selected_entry_paid']:
+                cat_stats['selected_entry_paid'] += count
+        elif row['status'] == 'rejected':
+            cat_stats['rejected'] += count
+    return stats
+
+
+def get_entry_stats(entry_year=None):
+    """
+    Return per-category entry counts for an entry year, as a list of
+    (category, stats dict) tuples in category display order plus a totals
+    dict.  Counts are read from the EntryCounter table and cached until the
+    counters for the year change.
+    """
+    entry_year = str(entry_year or settings.CURRENT_ENTRY_YEAR)
+    cache_key = entry_stats_cache_key(entry_year)
+    stats = cache.get(cache_key)
+    if stats is None:
+        counters = EntryCounter.objects.filter(
+            entry_year=entry_year, count__gt=0
+        ).values(
+            'category', 'status', 'video_entry_paid', 'selected_entry_paid',
+            'withdrawn', 'count'
+        )
+        stats = _count_entry_stats(counters)
+        cache.set(cache_key, stats, timeout=86400)
+
+    categories = sorted(
+        [cat for cat, cat_stats in stats.items() if any(cat_stats.values())],
+        key=lambda cat: CATEGORY_CHOICES_ORDER[cat]
+    )
+    totals = {
+        field: sum(stats[cat][field] for cat in categories)
+        for field in ENTRY_STATS_FIELDS
+    }
+    return {
+        'categories': [(cat, stats[cat]) for cat in categories],
+        'totals': totals,
+    }
+
+
+def partition_by_category(entries):
+    """
+    Evaluate an entries queryset in a single query and split it into
+    (category, list of entries) pairs in CATEGORY_CHOICES order, omitting
+    categories with no entries.  Any existing ordering is kept within each
+    category.
+    """
+    entries = entries.order_by('category', *entries.query.order_by)
+    grouped = {
+        category: list(cat_entries)
+        for category, cat_entries in groupby(entries, key=attrgetter('category'))
+    }
+    return [
+        (category, grouped[category])
+        for category, _ in CATEGORY_CHOICES if category in grouped
+    ]
+
+
+def iter_by_category(entries):
+    """
+    Like partition_by_category, but stream the entries from the database
+    rather than loading them all; yields (category, iterator of entries)
+    pairs, and each category's entries must be consumed before moving on to
+    the next category.
+    """
+    category_order = Case(
+        *[
+            When(category=category, then=Value(i))
+            for i, (category, _) in enumerate(CATEGORY_CHOICES)
+        ],
+        output_field=IntegerField()
+    )
+    entries = entries.order_by(category_order, *entries.query.order_by)
+    return groupby(entries.iterator(), key=attrgetter('category'))
@@ -4,9 +4,12 @@ from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.urls import reverse
-from django.http import FileResponse, Http404
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_object_or_404, HttpResponse, HttpResponseRedirect, render
 from django.template.response import TemplateResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views import generic
 
 from braces.views import LoginRequiredMixin
@@ -17,11 +20,12 @@ from payments.forms import PayPalPaymentsListForm, PayPalPaymentsEntryForm
 from payments.models import create_entry_paypal_transaction
 
 from .forms import EntryCreateUpdateForm, SelectedEntryUpdateForm
-from .email_helpers import send_pp_email
+from .email_helpers import send_pp_email, send_staff_notification
 from .models import CATEGORY_CHOICES_DICT, Entry, VIDEO_ENTRY_FEES, \
     SELECTED_ENTRY_FEES, WITHDRAWAL_FEE
-from .utils import check_partner_email, entries_open
-from .views_utils import DataPolicyAgreementRequiredMixin
+from .schedule import get_schedule_phase
+from .utils import get_partner_check, partner_check_rate_limited
+from .views_utils import DataPolicyAgreementRequiredMixin, user_entries_etag
 
 """
 Enter Now link --> Entry form page
@@ -78,6 +82,8 @@ def pdf_view(filepath):
         raise Http404()
 
 
+@method_decorator(cache_control(private=True, no_cache=True), name='get')
+@method_decorator(condition(etag_func=user_entries_etag), name='get')
 class EntryListView(LoginRequiredMixin, generic.ListView):
     model = Entry
     context_object_name = 'entries_list'
@@ -223,7 +229,10 @@ class EntryMixin:
 
     def get_form_kwargs(self):
         kwargs = super(EntryMixin, self).get_form_kwargs()
-        kwargs.update({'user': self.request.user})
+        kwargs.update({
+            'user': self.request.user,
+            'schedule_phase': get_schedule_phase(self.request),
+        })
         initial_data = self.request.session.get('form_data', {})
         if initial_data:
             del self.request.session['form_data']
@@ -244,7 +253,8 @@ class EntryCreateView(
     success_message = 'Your entry has been {}'
 
     def dispatch(self, request, *args, **kwargs):
-        is_open = entries_open() or request.user.is_superuser
+        is_open = get_schedule_phase(request).entries_open or \
+            request.user.is_superuser
         if not is_open:
             return HttpResponseRedirect(reverse('permission_denied'))
         return super(EntryMixin, self).dispatch(request, *args, **kwargs)
@@ -400,11 +410,11 @@ class EntryWithdrawView(LoginRequiredMixin, generic.UpdateView):
                 'category': CATEGORY_CHOICES_DICT[entry.category],
                 'status_at_withdrawal': 'selected'
             }
-            send_pp_email(
+            send_staff_notification(
                 self.request, 'Entry withdrawn', ctx,
                 'entries/email/entry_withdrawn_after_selection_to_pp.txt',
                 'entries/email/entry_withdrawn_after_selection_to_pp.html',
-                to_list=[settings.DEFAULT_STUDIO_EMAIL]
+                settings.DEFAULT_STUDIO_EMAIL, 'withdrawal'
             )
 
         ActivityLog.objects.create(
@@ -463,15 +473,24 @@ def entry_video_payment(request, ref):
 
 
 def check_partner(request):
-    email = request.GET.get('email')
-    context = {'check': True, 'email': email}
+    if partner_check_rate_limited(request):
+        return JsonResponse(
+            {'error': 'Too many partner checks; please try again shortly'},
+            status=429
+        )
+    email = request.GET.get('email', '').strip()
+    result = {'email': email}
     if email:
-        partner_check_dict, _ = check_partner_email(email)
-        context.update(**partner_check_dict)
-
-    return render(
-        request, 'entries/includes/partner_check.txt', context
-    )
+        checks, ok = get_partner_check(email)
+        result.update({
+            'partner': checks['partner'],
+            'partner_waiver': checks.get('partner_waiver', False),
+            'partner_already_entered': checks.get(
+                'partner_already_entered', False
+            ),
+            'ok': ok,
+        })
+    return JsonResponse(result)
 
 
 class EntryConfirmView(
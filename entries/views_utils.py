@@ -1,9 +1,16 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
 from django.urls import reverse
 from django.shortcuts import HttpResponseRedirect
 
-from accounts.models import DataPrivacyPolicy
+from accounts.models import DataPrivacyPolicy, has_disclaimer
 from accounts.utils import has_active_data_privacy_agreement
 
+from .models import get_entries_version
+from .schedule import get_schedule_phase
+
 
 class DataPolicyAgreementRequiredMixin(object):
 
@@ -14,4 +21,54 @@ class DataPolicyAgreementRequiredMixin(object):
             return HttpResponseRedirect(
                 reverse('accounts:data_privacy_review') + '?next=' + request.path
             )
-        return super().dispatch(request, *args, **kwargs)
\ No newline at end of file
+        return super().dispatch(request, *args, **kwargs)
+
+
+def make_etag(*parts):
+    return hashlib.md5(
+        ':'.join(str(part) for part in parts).encode('utf-8')
+    ).hexdigest()
+
+
+def _etag_request_parts(request):
+    # messages are shown once, so pages with messages waiting are always
+    # rendered; the rest also varies with the csrf token and the cookie
+    # policy banner
+    if len(messages.get_messages(request)):
+        return None
+    return (
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+        request.COOKIES.get('cookielaw_accepted'),
+    )
+
+
+def user_entries_etag(request, *args, **kwargs):
+    """
+    ETag for the user's entries page, so repeat requests get a 304 unless
+    the user's entries (or what else the page shows) have changed
+    """
+    request_parts = _etag_request_parts(request)
+    version = get_entries_version(request.user.id)
+    if request_parts is None or version is None:
+        return None
+    return make_etag(
+        request.user.id, request.user.is_superuser,
+        version, has_disclaimer(request.user),
+        get_schedule_phase(request).phase, settings.CURRENT_ENTRY_YEAR,
+        *request_parts
+    )
+
+
+def entries_admin_etag(request, *args, **kwargs):
+    """
+    ETag for ppadmin entries lists; the list depends on all entries and on
+    the filters and page in the querystring
+    """
+    request_parts = _etag_request_parts(request)
+    version = get_entries_version()
+    if request_parts is None or version is None:
+        return None
+    return make_etag(
+        request.user.id, version, request.get_full_path(),
+        settings.CURRENT_ENTRY_YEAR, *request_parts
+    )
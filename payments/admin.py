@@ -1,26 +1,37 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.models import User
-from payments.models import PaypalEntryTransaction
+from payments.models import IPNJob, PaypalEntryTransaction
 
 from paypal.standard.ipn.models import PayPalIPN
 from paypal.standard.ipn.admin import PayPalIPNAdmin
 
 
 class UserFilter(admin.SimpleListFilter):
-
+    """
+    Filter by user, chosen with the admin's user autocomplete rather than a
+    list of every user
+    """
     title = 'User'
     parameter_name = 'user'
+    template = 'admin/payments/user_autocomplete_filter.html'
 
     def lookups(self, request, model_admin):
-        qs = User.objects.all().order_by('first_name')
-        return [
-            (
-                user.id,
-                "{} {} ({})".format(
-                    user.first_name, user.last_name, user.username
-                )
-             ) for user in qs
+        # only the selected user, to show in the autocomplete box
+        if self.value() and str(self.value()).isdigit():
+            return [
+                (
+                    user.id,
+                    "{} {} ({})".format(
+                        user.first_name, user.last_name, user.username
+                    )
+                ) for user in User.objects.filter(id=self.value())
             ]
+        return []
+
+    def has_output(self):
+        return True
 
     def queryset(self, request, queryset):
         if self.value():
@@ -35,7 +46,25 @@ class PaypalEntryTransactionAdmin(admin.ModelAdmin):
     readonly_fields = ('id', 'get_user', 'invoice_id',
                        'get_entry_id')
     list_filter = (UserFilter,)
-    list_select_related = ('entry',)
+    list_select_related = ('entry__user',)
+
+    @property
+    def media(self):
+        # the same scripts as the admin's autocomplete widgets
+        extra = '' if settings.DEBUG else '.min'
+        return super().media + forms.Media(
+            js=[
+                'admin/js/vendor/jquery/jquery{}.js'.format(extra),
+                'admin/js/vendor/select2/select2.full{}.js'.format(extra),
+                'admin/js/jquery.init.js',
+                'admin/js/autocomplete.js',
+                'payments/js/user_filter.js',
+            ],
+            css={'screen': [
+                'admin/css/vendor/select2/select2{}.css'.format(extra),
+                'admin/css/autocomplete.css',
+            ]},
+        )
 
     def get_entry_id(self, obj):
         if obj.entry:
@@ -66,6 +95,18 @@ class PayPalAdmin(PayPalIPNAdmin):
     buyer.admin_order_field = 'first_name'
 
 
+class IPNJobAdmin(admin.ModelAdmin):
+
+    list_display = (
+        'id', 'txn_id', 'payment_status', 'valid', 'state', 'created',
+        'processed'
+    )
+    list_filter = ('state', 'valid')
+    search_fields = ('txn_id',)
+    readonly_fields = ('ipn',)
+
+
 admin.site.register(PaypalEntryTransaction, PaypalEntryTransactionAdmin)
+admin.site.register(IPNJob, IPNJobAdmin)
 admin.site.unregister(PayPalIPN)
 admin.site.register(PayPalIPN, PayPalAdmin)
@@ -0,0 +1,104 @@
+"""
+Apply IPNs recorded while settings.PAYPAL_DEFER_IPN_PROCESSING is on, and send
+their emails in batches.  Run frequently (e.g. every minute) from cron.
+"""
+import logging
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from payments.models import IPNJob
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Process pending PayPal IPN jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IPN_JOB_BATCH_SIZE,
+            help='Number of jobs to process over one mail connection'
+        )
+
+    def handle(self, *args, **options):
+        self.requeue_stale_jobs()
+
+        batch_size = options['batch_size']
+        processed = 0
+        # jobs put back to retry aren't tried again in this run
+        retry_ids = []
+        while True:
+            job_ids = list(
+                IPNJob.objects.filter(state='pending').exclude(id__in=retry_ids)
+                .order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not job_ids:
+                break
+            # one connection for the whole batch
+            connection = get_connection()
+            connection.open()
+            try:
+                for job_id in job_ids:
+                    # claim the job so a concurrent worker doesn't also
+                    # process it
+                    claimed = IPNJob.objects.filter(
+                        id=job_id, state='pending'
+                    ).update(state='running', started=timezone.now())
+                    if not claimed:
+                        continue
+                    job = IPNJob.objects.select_related('ipn').get(id=job_id)
+                    if self.process_job(job, connection):
+                        processed += 1
+                    else:
+                        retry_ids.append(job_id)
+            finally:
+                connection.close()
+
+        if processed:
+            self.stdout.write('{} IPN job{} processed'.format(
+                processed, '' if processed == 1 else 's'
+            ))
+
+    def process_job(self, job, connection):
+        """
+        Apply the job and send its emails; if the emails can't be sent, the
+        job is rolled back and left to be processed again on the next run
+        """
+        outbox = []
+        try:
+            with transaction.atomic():
+                job.process(outbox)
+                if outbox:
+                    connection.send_messages(outbox)
+        except Exception as e:
+            logger.error(
+                'Error sending emails for IPN job {} ({}): {}'.format(
+                    job.id, ', '.join(email.subject for email in outbox), e
+                )
+            )
+            IPNJob.objects.filter(id=job.id).update(
+                state='pending', error=str(e)
+            )
+            return False
+        return True
+
+    def requeue_stale_jobs(self):
+        # a job's changes are only committed with its state, so a job left
+        # running by a worker that stopped can safely be processed again
+        stale_before = timezone.now() - timedelta(
+            seconds=settings.IPN_JOB_STALE_SECONDS
+        )
+        requeued = IPNJob.objects.filter(
+            state='running', started__lt=stale_before
+        ).update(state='pending')
+        if requeued:
+            self.stdout.write('{} stale IPN job{} requeued'.format(
+                requeued, '' if requeued == 1 else 's'
+            ))
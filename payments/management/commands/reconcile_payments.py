@@ -0,0 +1,153 @@
+"""
+Compare entry payment flags with the PayPal IPNs and transactions for an entry
+year, and optionally mark entries paid by PayPal as paid.
+
+Entries marked as paid without a PayPal payment are only reported by default,
+as staff mark entries paid by other means as paid in the admin; use
+--unmark-unpaid to also clear those flags.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from paypal.standard.models import ST_PP_COMPLETED, ST_PP_REFUNDED
+from paypal.standard.ipn.models import PayPalIPN
+
+from activitylog.models import ActivityLog
+from entries.models import Entry, YEAR_CHOICES
+from payments.models import PaypalEntryTransaction
+
+
+PAID_FIELDS = {
+    'video': 'video_entry_paid',
+    'selected': 'selected_entry_paid',
+    'withdrawal': 'withdrawal_fee_paid',
+}
+
+# IPN custom field, as set on the paypal forms: "<payment type> <entry id>"
+CUSTOM_RE = r'^(video|selected|withdrawal) [0-9]+$'
+
+
+class Command(BaseCommand):
+    help = 'Report (and optionally fix) entry payment flags that do not ' \
+           'match PayPal'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--year', choices=dict(YEAR_CHOICES).keys(),
+            help='Entry year to reconcile; defaults to the current year'
+        )
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Mark entries with a completed (and not refunded) PayPal '
+                 'payment as paid'
+        )
+        parser.add_argument(
+            '--unmark-unpaid', action='store_true',
+            help='With --fix, also mark entries without a completed PayPal '
+                 'payment as unpaid; this includes entries marked as paid by '
+                 'hand for payments made outside PayPal'
+        )
+
+    def handle(self, *args, **options):
+        entry_year = options.get('year') or settings.CURRENT_ENTRY_YEAR
+        entries = {
+            entry['id']: entry for entry in Entry.objects.filter(
+                entry_year=entry_year
+            ).values('id', 'entry_ref', 'user__username', *PAID_FIELDS.values())
+        }
+        paid, completed_txn_ids = self.get_paypal_payments(entries)
+        recorded_txn_ids = self.get_recorded_transactions(entry_year)
+
+        # [(entry, payment type, problem)] and the flag changes that fix them
+        mismatches = []
+        fixes = defaultdict(lambda: defaultdict(list))
+        for entry_id, entry in entries.items():
+            for payment_type, field in PAID_FIELDS.items():
+                key = (entry_id, payment_type)
+                is_paid = paid.get(key, False)
+                if is_paid and not entry[field]:
+                    mismatches.append(
+                        (entry, payment_type, 'paid but not marked as paid')
+                    )
+                    fixes[field][True].append(entry_id)
+                elif entry[field] and not is_paid:
+                    mismatches.append(
+                        (entry, payment_type,
+                         'marked as paid without a completed PayPal payment')
+                    )
+                    fixes[field][False].append(entry_id)
+                missing = completed_txn_ids[key] - recorded_txn_ids[key]
+                if missing:
+                    mismatches.append(
+                        (entry, payment_type,
+                         'PayPal transaction {} not recorded on a payment '
+                         'transaction'.format(', '.join(sorted(missing))))
+                    )
+
+        for entry, payment_type, problem in mismatches:
+            self.stdout.write('Entry {} ({}, {}) {}: {}'.format(
+                entry['id'], entry['entry_ref'], entry['user__username'],
+                payment_type, problem
+            ))
+        self.stdout.write(
+            '{} payment mismatch{} found for entry year {}'.format(
+                len(mismatches), '' if len(mismatches) == 1 else 'es',
+                entry_year
+            )
+        )
+
+        if options['fix']:
+            if not options['unmark_unpaid']:
+                for values in fixes.values():
+                    values.pop(False, None)
+            self.fix(fixes, entry_year)
+
+    @staticmethod
+    def get_paypal_payments(entries):
+        """
+        Return whether each (entry id, payment type) is paid according to
+        PayPal (its latest completed/refunded IPN is completed), and the
+        transaction ids of its completed IPNs
+        """
+        ipns = PayPalIPN.objects.filter(
+            flag=False, payment_status__in=[ST_PP_COMPLETED, ST_PP_REFUNDED],
+            custom__regex=CUSTOM_RE
+        ).order_by('created_at', 'id').values(
+            'custom', 'txn_id', 'payment_status'
+        )
+        paid = {}
+        completed_txn_ids = defaultdict(set)
+        for ipn in ipns:
+            payment_type, entry_id = ipn['custom'].split()
+            key = (int(entry_id), payment_type)
+            if key[0] not in entries:
+                continue
+            paid[key] = ipn['payment_status'] == ST_PP_COMPLETED
+            if paid[key]:
+                completed_txn_ids[key].add(ipn['txn_id'])
+        return paid, completed_txn_ids
+
+    @staticmethod
+    def get_recorded_transactions(entry_year):
+        recorded = defaultdict(set)
+        transactions = PaypalEntryTransaction.objects.filter(
+            entry__entry_year=entry_year, transaction_id__isnull=False
+        ).values_list('entry_id', 'payment_type', 'transaction_id')
+        for entry_id, payment_type, transaction_id in transactions:
+            recorded[(entry_id, payment_type)].add(transaction_id)
+        return recorded
+
+    def fix(self, fixes, entry_year):
+        updated = 0
+        for field, values in fixes.items():
+            for value, entry_ids in values.items():
+                updated += Entry.objects.filter(id__in=entry_ids)\
+                    .update(**{field: value})
+        if not updated:
+            return
+        msg = '{} entry payment flag{} updated to match PayPal for entry ' \
+              'year {}'.format(updated, '' if updated == 1 else 's', entry_year)
+        self.stdout.write(msg)
+        ActivityLog.objects.create(log=msg)
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.3 on 2026-10-19 19:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0007_entry_partner'),
+        ('payments', '0003_auto_20180423_1717'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaypalInvoiceCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_type', models.CharField(choices=[('video', 'video'), ('selected', 'selected'), ('withdrawal', 'withdrawal')], max_length=255)),
+                ('value', models.PositiveIntegerField(default=0)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='entries.Entry')),
+            ],
+            options={
+                'unique_together': {('entry', 'payment_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.3 on 2026-10-19 19:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ipn', '0008_auto_20181128_1032'),
+        ('payments', '0004_paypalinvoicecounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IPNJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valid', models.BooleanField()),
+                ('txn_id', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('payment_status', models.CharField(blank=True, max_length=255)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('duplicate', 'Duplicate'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('ipn', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='job', to='ipn.PayPalIPN')),
+            ],
+        ),
+    ]
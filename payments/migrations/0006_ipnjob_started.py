@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-19 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_ipnjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ipnjob',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
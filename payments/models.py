@@ -3,17 +3,20 @@
 import logging
 import random
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Q, Value, When
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, send_mail
 from django.utils import timezone
 from django.template.loader import get_template
 
 from paypal.standard.models import ST_PP_COMPLETED, ST_PP_REFUNDED, \
     ST_PP_PENDING
+from paypal.standard.ipn.models import PayPalIPN
 from paypal.standard.ipn.signals import valid_ipn_received, invalid_ipn_received
 
-from entries.models import Entry
+from entries.models import bump_entries_version, Entry, StaffNotification, \
+    use_notification_digest
 
 from activitylog.models import ActivityLog
 
@@ -21,31 +24,45 @@ from activitylog.models import ActivityLog
 logger = logging.getLogger(__name__)
 
 
+PAYMENT_TYPE_CHOICES = (
+    ('video', 'video'),
+    ('selected', 'selected'),
+    ('withdrawal', 'withdrawal')
+)
+
+
+def get_unpaid_transaction(entry, payment_type):
+    return PaypalEntryTransaction.objects.filter(
+        Q(transaction_id__isnull=True) | Q(transaction_id=''),
+        entry=entry, payment_type=payment_type
+    ).order_by('-invoice_id').first()
+
+
 def create_entry_paypal_transaction(user, entry, payment_type):
-    id_string = "{}-{}-inv#".format(entry.entry_ref, payment_type)
-    existing = PaypalEntryTransaction.objects.select_related('entry').filter(
-        payment_type=payment_type,
-        invoice_id__contains=id_string, entry=entry
-    ).order_by('-invoice_id')
-
-    if existing:
-        # PaypalEntryTransaction is created when the view is called, not when
-        # payment is made.  If there is no transaction id stored against it,
-        # we shouldn't need to make a new one
-        for transaction in existing:
-            if not transaction.transaction_id:
-                return transaction
-        existing_counter = existing[0].invoice_id[-3:]
-        counter = str(int(existing_counter) + 1).zfill(len(existing_counter))
-    else:
-        counter = '001'
+    # PaypalEntryTransaction is created when the view is called, not when
+    # payment is made.  If there is no transaction id stored against it,
+    # we shouldn't need to make a new one
+    unpaid = get_unpaid_transaction(entry, payment_type)
+    if unpaid:
+        return unpaid
+
+    with transaction.atomic():
+        # concurrent calls for the same entry and payment type wait here, so
+        # they can't both create a transaction or allocate the same invoice;
+        # check again once the lock is held, in case one of them just did
+        counter = PaypalInvoiceCounter.lock(entry, payment_type)
+        unpaid = get_unpaid_transaction(entry, payment_type)
+        if unpaid:
+            return unpaid
+
+        return PaypalEntryTransaction.objects.create(
+            invoice_id=invoice_id(entry, payment_type, counter.increment()),
+            entry=entry, payment_type=payment_type
+        )
 
-    invoice_id = id_string + counter
 
-    pbt = PaypalEntryTransaction.objects.create(
-        invoice_id=invoice_id, entry=entry, payment_type=payment_type
-    )
-    return pbt
+def invoice_id(entry, payment_type, number):
+    return "{}-{}-inv#{:03d}".format(entry.entry_ref, payment_type, number)
 
 
 class PayPalTransactionError(Exception):
@@ -58,12 +75,7 @@ class PaypalEntryTransaction(models.Model):
     )
     entry = models.ForeignKey(Entry, null=True, on_delete=models.SET_NULL)
     payment_type = models.CharField(
-        choices=(
-            ('video', 'video'),
-            ('selected', 'selected'),
-            ('withdrawal', 'withdrawal')
-        ),
-        max_length=255
+        choices=PAYMENT_TYPE_CHOICES, max_length=255
     )
     transaction_id = models.CharField(
         max_length=255, null=True, blank=True, unique=True
@@ -73,8 +85,205 @@ class PaypalEntryTransaction(models.Model):
         return self.invoice_id
 
 
+class PaypalInvoiceCounter(models.Model):
+    """
+    The last invoice number allocated for an entry and payment type.  The
+    row is locked while a number is allocated, so concurrent payment page
+    loads for the same entry get consecutive numbers, and loads for other
+    entries aren't held up.
+    """
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE)
+    payment_type = models.CharField(
+        choices=PAYMENT_TYPE_CHOICES, max_length=255
+    )
+    value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('entry', 'payment_type')
+
+    def __str__(self):
+        return '{} {}: {}'.format(
+            self.entry.entry_ref, self.payment_type, self.value
+        )
+
+    @classmethod
+    def lock(cls, entry, payment_type):
+        """
+        Return the counter for entry and payment_type, locked until the end
+        of the current transaction (which the caller must open)
+        """
+        if not cls.objects.filter(
+                entry=entry, payment_type=payment_type
+        ).exists():
+            # entries paid for before counters were introduced start from
+            # their highest existing invoice number
+            cls.objects.get_or_create(
+                entry=entry, payment_type=payment_type,
+                defaults={'value': cls._highest_invoice_number(
+                    entry, payment_type
+                )}
+            )
+        return cls.objects.select_for_update().get(
+            entry=entry, payment_type=payment_type
+        )
+
+    @classmethod
+    def next_value(cls, entry, payment_type):
+        """
+        Allocate and return the next invoice number for entry and
+        payment_type
+        """
+        with transaction.atomic():
+            return cls.lock(entry, payment_type).increment()
+
+    def increment(self):
+        # only call on a counter returned by lock()
+        self.value += 1
+        self.save(update_fields=['value'])
+        return self.value
+
+    @staticmethod
+    def _highest_invoice_number(entry, payment_type):
+        invoice_ids = PaypalEntryTransaction.objects.filter(
+            entry=entry, payment_type=payment_type
+        ).values_list('invoice_id', flat=True)
+        numbers = [
+            int(inv.rsplit('#', 1)[-1]) for inv in invoice_ids
+            if inv and inv.rsplit('#', 1)[-1].isdigit()
+        ]
+        return max(numbers, default=0)
+
+
+IPN_JOB_STATES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('duplicate', 'Duplicate'),
+    ('failed', 'Failed'),
+)
+
+
+class IPNJob(models.Model):
+    """
+    An IPN waiting to be applied to its entry.  With
+    settings.PAYPAL_DEFER_IPN_PROCESSING, the IPN signal handlers only create
+    a job, so PayPal's POST is acknowledged straight away; jobs are processed,
+    and their emails sent in batches, by the process_ipn_jobs management
+    command.
+    """
+    ipn = models.OneToOneField(
+        PayPalIPN, on_delete=models.CASCADE, related_name='job'
+    )
+    valid = models.BooleanField()
+    # copied from the IPN; a job for a txn_id and payment status that has
+    # already been processed (e.g. an IPN PayPal resent) is skipped
+    txn_id = models.CharField(max_length=255, blank=True, db_index=True)
+    payment_status = models.CharField(max_length=255, blank=True)
+    state = models.CharField(
+        choices=IPN_JOB_STATES, default='pending', max_length=10
+    )
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    processed = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return 'IPN job {} - txn {} ({})'.format(
+            self.id, self.txn_id, self.state
+        )
+
+    @classmethod
+    def enqueue(cls, ipn_obj, valid):
+        job, _ = cls.objects.get_or_create(
+            ipn=ipn_obj, defaults={
+                'valid': valid, 'txn_id': ipn_obj.txn_id or '',
+                'payment_status': ipn_obj.payment_status or '',
+            }
+        )
+        return job
+
+    def is_duplicate(self):
+        return bool(self.txn_id) and IPNJob.objects.filter(
+            txn_id=self.txn_id, payment_status=self.payment_status,
+            valid=self.valid, state='done'
+        ).exclude(id=self.id).exists()
+
+    def process(self, outbox):
+        """
+        Apply the IPN, adding any emails to outbox; the job should already
+        have been claimed (state 'running').  Run inside a transaction, so
+        that if the caller can't send the emails it can roll the job back.
+        """
+        with transaction.atomic():
+            if self.txn_id:
+                # lock the jobs for this transaction; a concurrent worker
+                # applying the same transaction waits here, then sees it as
+                # a duplicate
+                list(
+                    IPNJob.objects.select_for_update()
+                    .filter(txn_id=self.txn_id).order_by('id')
+                    .values_list('id', flat=True)
+                )
+            if self.is_duplicate():
+                self.state = 'duplicate'
+            else:
+                try:
+                    with transaction.atomic():
+                        if self.valid:
+                            process_payment_received(self.ipn, outbox)
+                        else:
+                            process_payment_not_received(self.ipn, outbox)
+                except Exception as e:
+                    logger.error('IPN job {} failed: {}'.format(self.id, e))
+                    self.state = 'failed'
+                    self.error = str(e)
+                else:
+                    self.state = 'done'
+            self.processed = timezone.now()
+            self.save()
+
+
+def send_notification(outbox, subject, message, from_email, recipient_list,
+                      html_message=None, fail_silently=False):
+    """
+    Send an email now, or if outbox (a list) is given, add it to be sent later
+    with other emails over a single connection
+    """
+    if outbox is None:
+        return send_mail(
+            subject, message, from_email, recipient_list,
+            html_message=html_message, fail_silently=fail_silently
+        )
+    email = EmailMultiAlternatives(
+        subject, message, from_email, recipient_list
+    )
+    if html_message:
+        email.attach_alternative(html_message, 'text/html')
+    outbox.append(email)
+
+
+def send_support_notification(
+        outbox, category, subject, message, html_message=None, critical=False
+):
+    """
+    Email a notification to the support address, or hold it to be sent in
+    the next digest; critical notifications (a completed payment that
+    couldn't be applied) are always sent straight away
+    """
+    if use_notification_digest(critical):
+        StaffNotification.add(
+            [settings.SUPPORT_EMAIL], category, subject, message
+        )
+    else:
+        send_notification(
+            outbox, subject, message, settings.DEFAULT_FROM_EMAIL,
+            [settings.SUPPORT_EMAIL], html_message=html_message,
+            fail_silently=False
+        )
+
+
 def send_processed_payment_emails(
-        payment_type_verbose, paypal_trans, user, obj, amount
+        payment_type_verbose, paypal_trans, user, obj, amount, outbox=None
 ):
     ctx = {
         'user': " ".join([user.first_name, user.last_name]),
@@ -87,7 +296,8 @@ def send_processed_payment_emails(
     }
 
     # send email to user
-    send_mail(
+    send_notification(
+        outbox,
         '{} Payment processed for {} for entry ref {}'.format(
             settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, payment_type_verbose,
             obj.entry_ref
@@ -102,7 +312,7 @@ def send_processed_payment_emails(
 
 
 def send_processed_refund_emails(
-        payment_type_verbose, paypal_trans, user, obj
+        payment_type_verbose, paypal_trans, user, obj, outbox=None
 ):
     ctx = {
         'user': " ".join([user.first_name, user.last_name]),
@@ -114,19 +324,18 @@ def send_processed_refund_emails(
     }
     # send email to studio only and to support for checking;
     # user will have received automated paypal payment
-    send_mail(
+    send_support_notification(
+        outbox, 'refund',
         '{} Payment refund processed for {} for entry ref {}'.format(
             settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, payment_type_verbose,
             obj.entry_ref),
         get_template(
             'payments/email/payment_refund_processed_to_studio.txt'
         ).render(ctx),
-        settings.DEFAULT_FROM_EMAIL,
-        [settings.SUPPORT_EMAIL],
         html_message=get_template(
             'payments/email/payment_refund_processed_to_studio.html'
-        ).render(ctx),
-        fail_silently=False)
+        ).render(ctx)
+    )
 
 
 def get_obj(ipn_obj):
@@ -141,34 +350,43 @@ def get_obj(ipn_obj):
     if payment_type not in ['video', 'selected', 'withdrawal']:
         raise PayPalTransactionError('Unknown payment type %s' % payment_type)
 
-    try:
-        obj = Entry.objects.select_related('user').get(id=entry_id)
-    except Entry.DoesNotExist:
-        raise PayPalTransactionError(
-            'Entry with id {} does not exist'.format(entry_id)
-        )
-
-    paypal_trans = PaypalEntryTransaction.objects.filter(
-        entry=obj, payment_type=payment_type
-    )
-    if not paypal_trans:
+    # the transactions for the entry, with the entry and user, in one query;
+    # there should only be one, but if there are more, the one matching the
+    # IPN invoice id (or else the latest) comes first
+    transactions = PaypalEntryTransaction.objects\
+        .select_related('entry__user')\
+        .filter(entry_id=entry_id, payment_type=payment_type)
+    if ipn_obj.invoice:
+        transactions = transactions.annotate(
+            invoice_match=Case(
+                When(invoice_id=ipn_obj.invoice, then=Value(True)),
+                default=Value(False), output_field=models.BooleanField()
+            )
+        ).order_by('-invoice_match', '-id')
+    else:
+        transactions = transactions.order_by('-id')
+    transactions = list(transactions[:2])
+
+    if transactions:
+        paypal_trans = transactions[0]
+        obj = paypal_trans.entry
+        if len(transactions) > 1 and ipn_obj.invoice \
+                and paypal_trans.invoice_id != ipn_obj.invoice:
+            raise PayPalTransactionError(
+                'No transaction with invoice id {} for entry {}'.format(
+                    ipn_obj.invoice, entry_id
+                )
+            )
+    else:
+        try:
+            obj = Entry.objects.select_related('user').get(id=entry_id)
+        except Entry.DoesNotExist:
+            raise PayPalTransactionError(
+                'Entry with id {} does not exist'.format(entry_id)
+            )
         paypal_trans = create_entry_paypal_transaction(
             user=obj.user, entry=obj, payment_type=payment_type
         )
-    elif paypal_trans.count() > 1:
-        # Unlikely we'll have 2 paypal trans created, since invoice_id is
-        # created and retrieved using entry_ref which is randomly generated,
-        # but just in case
-        if ipn_obj.invoice:
-            paypal_trans = PaypalEntryTransaction\
-                .objects.select_related('entry').get(
-                entry=obj, invoice_id=ipn_obj.invoice,
-                payment_type=payment_type
-            )
-        else:
-            paypal_trans = paypal_trans.latest('id')
-    else:  # we got one paypaltrans, as we should have
-        paypal_trans = paypal_trans[0]
 
     payment_type_verbose = {
         'video': 'video submission fee',
@@ -183,21 +401,25 @@ def get_obj(ipn_obj):
     }
 
 
-def payment_received(sender, **kwargs):
-    ipn_obj = sender
+def process_payment_received(ipn_obj, outbox=None):
+    """
+    Apply a valid IPN to its entry and transaction.  Emails are sent
+    straight away, or added to outbox (a list) to be sent in a batch.
+    """
 
     try:
         obj_dict = get_obj(ipn_obj)
     except PayPalTransactionError as e:
-        send_mail(
-        'WARNING! Error processing PayPal IPN',
-        'Valid Payment Notification received from PayPal but an error '
-        'occurred during processing.\n\nTransaction id {}\n\nThe flag info '
-        'was "{}"\n\nError raised: {}'.format(
-            ipn_obj.txn_id, ipn_obj.flag_info, e
-        ),
-        settings.DEFAULT_FROM_EMAIL, [settings.SUPPORT_EMAIL],
-        fail_silently=False)
+        send_support_notification(
+            outbox, 'payment_problem',
+            'WARNING! Error processing PayPal IPN',
+            'Valid Payment Notification received from PayPal but an error '
+            'occurred during processing.\n\nTransaction id {}\n\nThe flag '
+            'info was "{}"\n\nError raised: {}'.format(
+                ipn_obj.txn_id, ipn_obj.flag_info, e
+            ),
+            critical=True
+        )
         logger.error(
             'PaypalTransactionError: unknown object type for payment '
             '(ipn_obj transaction_id: {}, error: {})'.format(
@@ -237,7 +459,7 @@ def payment_received(sender, **kwargs):
                     )
             )
             send_processed_refund_emails(
-                payment_type_verbose, paypal_trans, obj.user, obj
+                payment_type_verbose, paypal_trans, obj.user, obj, outbox
             )
 
         elif ipn_obj.payment_status == ST_PP_PENDING:
@@ -276,6 +498,8 @@ def payment_received(sender, **kwargs):
             # second invoice number being generated
             paypal_trans.transaction_id = ipn_obj.txn_id
             paypal_trans.save()
+            # the entries page shows paypal buttons for unpaid transactions
+            bump_entries_version(obj.user_id)
 
             ActivityLog.objects.create(
                 log='{} for entry id {} for user {} paid by PayPal; paypal '
@@ -286,7 +510,7 @@ def payment_received(sender, **kwargs):
             )
             send_processed_payment_emails(
                 payment_type_verbose, paypal_trans, obj.user, obj,
-                str(ipn_obj.mc_gross)
+                str(ipn_obj.mc_gross), outbox
             )
 
             if not ipn_obj.invoice:
@@ -294,7 +518,8 @@ def payment_received(sender, **kwargs):
                 # everything should be ok but email to check
                 ipn_obj.invoice = paypal_trans.invoice_id
                 ipn_obj.save()
-                send_mail(
+                send_support_notification(
+                    outbox, 'payment_problem',
                     '{} No invoice number on paypal ipn for '
                     '{} for entry id {}'.format(
                         settings.ACCOUNT_EMAIL_SUBJECT_PREFIX,
@@ -304,10 +529,7 @@ def payment_received(sender, **kwargs):
                     'paypal transaction id {}.  No invoice number on paypal'
                     ' IPN.  Invoice number has been set to {}.'.format(
                         ipn_obj.txn_id, paypal_trans.invoice_id
-                    ),
-                    settings.DEFAULT_FROM_EMAIL,
-                    [settings.SUPPORT_EMAIL],
-                    fail_silently=False
+                    )
                 )
 
         else:  # any other status
@@ -336,7 +558,8 @@ def payment_received(sender, **kwargs):
                 )
         )
 
-        send_mail(
+        send_support_notification(
+            outbox, 'payment_problem',
             '{} There was some problem processing {} for '
             'entry id {}'.format(
                 settings.ACCOUNT_EMAIL_SUBJECT_PREFIX, payment_type_verbose,
@@ -347,26 +570,25 @@ def payment_received(sender, **kwargs):
             'raised was "{}"'.format(
                 ipn_obj.invoice, ipn_obj.txn_id, e
             ),
-            settings.DEFAULT_FROM_EMAIL,
-            [settings.SUPPORT_EMAIL],
-            fail_silently=False)
+            # the payment may have been taken without being applied
+            critical=ipn_obj.payment_status == ST_PP_COMPLETED
+        )
 
 
-def payment_not_received(sender, **kwargs):
-    ipn_obj = sender
+def process_payment_not_received(ipn_obj, outbox=None):
 
     try:
         obj_dict = get_obj(ipn_obj)
     except PayPalTransactionError as e:
-        send_mail(
+        send_support_notification(
+            outbox, 'payment_problem',
             'WARNING! Error processing Invalid Payment Notification from PayPal',
             'PayPal sent an invalid transaction notification while '
             'attempting to process payment;.\n\nThe flag '
             'info was "{}"\n\nAn additional error was raised: {}'.format(
                 ipn_obj.flag_info, e
-            ),
-            settings.DEFAULT_FROM_EMAIL, [settings.SUPPORT_EMAIL],
-            fail_silently=False)
+            )
+        )
         logger.error(
             'PaypalTransactionError: unknown object type for payment ('
             'transaction_id: {}, error: {})'.format(ipn_obj.txn_id, e)
@@ -384,15 +606,15 @@ def payment_not_received(sender, **kwargs):
                     payment_type_verbose, obj.id
                 )
             )
-            send_mail(
+            send_support_notification(
+                outbox, 'payment_problem',
                 'WARNING! Invalid Payment Notification received from PayPal',
                 'PayPal sent an invalid transaction notification while '
                 'attempting to process {} for entry id {}.\n\nThe flag '
                 'info was "{}"'.format(
                     payment_type_verbose, obj.id, ipn_obj.flag_info
-                ),
-                settings.DEFAULT_FROM_EMAIL, [settings.SUPPORT_EMAIL],
-                fail_silently=False)
+                )
+            )
 
     except Exception as e:
             # if anything else goes wrong, send a warning email
@@ -404,7 +626,8 @@ def payment_not_received(sender, **kwargs):
                     ipn_obj.txn_id, e
                 )
             )
-            send_mail(
+            send_support_notification(
+                outbox, 'payment_problem',
                 '{} There was some problem processing payment_not_received for '
                 '{} payment for entry id {}'.format(
                     settings.ACCOUNT_EMAIL_SUBJECT_PREFIX,
@@ -415,10 +638,22 @@ def payment_not_received(sender, **kwargs):
                 'raised was "{}".\n\nNOTE: this error occurred during '
                 'processing of the payment_not_received signal'.format(
                     ipn_obj.invoice, ipn_obj.txn_id, e
-                ),
-                settings.DEFAULT_FROM_EMAIL,
-                [settings.SUPPORT_EMAIL],
-                fail_silently=False)
+                )
+            )
+
+def payment_received(sender, **kwargs):
+    if settings.PAYPAL_DEFER_IPN_PROCESSING:
+        IPNJob.enqueue(sender, valid=True)
+    else:
+        process_payment_received(sender)
+
+
+def payment_not_received(sender, **kwargs):
+    if settings.PAYPAL_DEFER_IPN_PROCESSING:
+        IPNJob.enqueue(sender, valid=False)
+    else:
+        process_payment_not_received(sender)
+
 
 valid_ipn_received.connect(payment_received)
 invalid_ipn_received.connect(payment_not_received)
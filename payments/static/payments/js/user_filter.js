@@ -0,0 +1,20 @@
+/*
+  Reload the changelist filtered by the user chosen in the user autocomplete
+  filter (or unfiltered if it is cleared).
+*/
+(function($) {
+    'use strict';
+    $(document).on('change', '.user-autocomplete-filter', function() {
+        var parameter = $(this).data('parameter');
+        var params = new URLSearchParams(window.location.search);
+        var value = $(this).val();
+        if (value) {
+            params.set(parameter, value);
+        } else {
+            params.delete(parameter);
+        }
+        // back to the first page of results
+        params.delete('p');
+        window.location.search = params.toString();
+    });
+}(django.jQuery));
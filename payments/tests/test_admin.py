@@ -4,7 +4,10 @@ from model_bakery import baker
 
 from django.contrib.auth.models import User
 from django.contrib.admin.sites import AdminSite
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
 from paypal.standard.ipn.models import PayPalIPN
 
@@ -54,19 +57,44 @@ class PaymentsAdminFiltersTests(TestCase):
             baker.make(PaypalEntryTransaction, entry__user=user)
 
     def test_payments_user_filter_choices(self):
-        # test that user filter shows formatted choices ordered by first name
-
+        # users are found with the autocomplete; the only choice is the
+        # selected user, formatted with their name
         userfilter = admin.UserFilter(
             None, {}, PaypalEntryTransaction,
             admin.PaypalEntryTransactionAdmin
         )
+        self.assertEqual(userfilter.lookup_choices, [])
+        self.assertTrue(userfilter.has_output())
 
+        userfilter = admin.UserFilter(
+            None, {'user': str(self.user1.id)}, PaypalEntryTransaction,
+            admin.PaypalEntryTransactionAdmin
+        )
         self.assertEqual(
-            userfilter.lookup_choices,
-            [
-                (self.user1.id, 'Donald Duck (dd)'),
-                (self.user.id, 'Foo Bar (foob)')
-            ]
+            userfilter.lookup_choices, [(self.user1.id, 'Donald Duck (dd)')]
+        )
+
+    def test_changelist_queries_independent_of_user_count(self):
+        superuser = User.objects.create_superuser(
+            username='admin', email='admin@test.com', password='test'
+        )
+        self.client.force_login(superuser)
+        url = reverse('admin:payments_paypalentrytransaction_changelist')
+
+        def changelist_queries():
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            return len(queries)
+
+        initial_queries = changelist_queries()
+        baker.make(User, _quantity=20)
+        self.assertEqual(changelist_queries(), initial_queries)
+
+        resp = self.client.get(url + '?user={}'.format(self.user.id))
+        self.assertEqual(len(resp.context['cl'].result_list), 1)
+        self.assertIn(
+            reverse('admin:auth_user_autocomplete'), resp.content.decode()
         )
 
     def test_paypal_booking_user_filter(self):
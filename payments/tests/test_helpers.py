@@ -1,12 +1,17 @@
+import threading
+
 from datetime import datetime
 from model_bakery import baker
 
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, Client, \
+    skipUnlessDBFeature
 from django.utils import timezone
 
 from entries.models import Entry
-from ..models import create_entry_paypal_transaction, PaypalEntryTransaction
+from ..models import create_entry_paypal_transaction, \
+    PaypalEntryTransaction, PaypalInvoiceCounter
 
 
 class TestHelpers(TestCase):
@@ -28,7 +33,11 @@ class TestHelpers(TestCase):
         self.assertEqual(ppt.invoice_id, '{}-video-inv#001'.format(entry.entry_ref))
         self.assertEqual(PaypalEntryTransaction.objects.count(), 1)
 
-        duplicate_ppt = create_entry_paypal_transaction(user, entry, 'video')
+        # the existing transaction is found without locking the counter
+        with self.assertNumQueries(1):
+            duplicate_ppt = create_entry_paypal_transaction(
+                user, entry, 'video'
+            )
         self.assertEqual(PaypalEntryTransaction.objects.count(), 1)
         self.assertEqual(ppt, duplicate_ppt)
 
@@ -50,3 +59,75 @@ class TestHelpers(TestCase):
         new_ppt = create_entry_paypal_transaction(user, entry, 'video')
         self.assertEqual(PaypalEntryTransaction.objects.count(), 2)
         self.assertEqual(new_ppt.invoice_id, '{}-video-inv#002'.format(entry.entry_ref))
+
+    def test_counter_starts_from_existing_invoices(self):
+        # transactions created before invoice counters were added
+        user = baker.make(User)
+        entry = baker.make(Entry)
+        baker.make(
+            PaypalEntryTransaction, entry=entry, payment_type='video',
+            invoice_id='{}-video-inv#004'.format(entry.entry_ref),
+            transaction_id='123'
+        )
+        new_ppt = create_entry_paypal_transaction(user, entry, 'video')
+        self.assertEqual(
+            new_ppt.invoice_id, '{}-video-inv#005'.format(entry.entry_ref)
+        )
+
+    def test_counters_per_entry_and_payment_type(self):
+        entry = baker.make(Entry)
+        other_entry = baker.make(Entry)
+        self.assertEqual(PaypalInvoiceCounter.next_value(entry, 'video'), 1)
+        self.assertEqual(PaypalInvoiceCounter.next_value(entry, 'video'), 2)
+        self.assertEqual(
+            PaypalInvoiceCounter.next_value(entry, 'selected'), 1
+        )
+        self.assertEqual(
+            PaypalInvoiceCounter.next_value(other_entry, 'video'), 1
+        )
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class InvoiceCounterConcurrencyTests(TransactionTestCase):
+
+    def run_concurrently(self, func, threads=10):
+        errors = []
+        results = []
+        barrier = threading.Barrier(threads)
+
+        def run():
+            try:
+                barrier.wait()
+                results.append(func())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_concurrent_allocation(self):
+        entry = baker.make(Entry)
+        values = self.run_concurrently(
+            lambda: PaypalInvoiceCounter.next_value(entry, 'video')
+        )
+        self.assertEqual(sorted(values), list(range(1, 11)))
+
+    def test_concurrent_payment_page_loads(self):
+        user = baker.make(User)
+        entry = baker.make(Entry)
+        transactions = self.run_concurrently(
+            lambda: create_entry_paypal_transaction(user, entry, 'video')
+        )
+        # every load gets the same unpaid transaction
+        self.assertEqual(PaypalEntryTransaction.objects.count(), 1)
+        self.assertEqual(
+            {ppt.invoice_id for ppt in transactions},
+            {'{}-video-inv#001'.format(entry.entry_ref)}
+        )
@@ -0,0 +1,125 @@
+from io import StringIO
+from model_bakery import baker
+
+from django.conf import settings
+from django.core import management
+from django.test import TestCase
+
+from paypal.standard.ipn.models import PayPalIPN
+
+from activitylog.models import ActivityLog
+from entries.models import Entry
+from ..models import PaypalEntryTransaction
+
+
+class ReconcilePaymentsTests(TestCase):
+
+    def make_payment(self, entry, payment_type, txn_id,
+                     payment_status='Completed', record=True):
+        baker.make(
+            PayPalIPN, custom='{} {}'.format(payment_type, entry.id),
+            txn_id=txn_id, payment_status=payment_status, flag=False
+        )
+        if record and payment_status == 'Completed':
+            baker.make(
+                PaypalEntryTransaction, entry=entry, payment_type=payment_type,
+                invoice_id='inv-{}'.format(txn_id), transaction_id=txn_id
+            )
+
+    def reconcile(self, *args):
+        output = StringIO()
+        management.call_command('reconcile_payments', *args, stdout=output)
+        return output.getvalue()
+
+    def test_no_mismatches(self):
+        entry = baker.make(Entry, video_entry_paid=True)
+        self.make_payment(entry, 'video', 'txn1')
+        # refunded payment, flag not set
+        refunded = baker.make(Entry, video_entry_paid=False)
+        self.make_payment(refunded, 'video', 'txn2')
+        self.make_payment(refunded, 'video', 'txn3', 'Refunded')
+        # entry in another year is ignored
+        baker.make(Entry, entry_year='2018', selected_entry_paid=True)
+
+        output = self.reconcile()
+        self.assertIn(
+            '0 payment mismatches found for entry year {}'.format(
+                settings.CURRENT_ENTRY_YEAR
+            ),
+            output
+        )
+
+    def test_mismatches_reported(self):
+        unflagged = baker.make(Entry, video_entry_paid=False)
+        self.make_payment(unflagged, 'video', 'txn1')
+        flagged = baker.make(Entry, selected_entry_paid=True)
+        unrecorded = baker.make(Entry, video_entry_paid=True)
+        self.make_payment(unrecorded, 'video', 'txn2', record=False)
+
+        # entries, IPNs and transactions are each read in one query
+        with self.assertNumQueries(3):
+            output = self.reconcile()
+        self.assertIn(
+            'Entry {} ({}, {}) video: paid but not marked as paid'.format(
+                unflagged.id, unflagged.entry_ref, unflagged.user.username
+            ),
+            output
+        )
+        self.assertIn(
+            'Entry {} ({}, {}) selected: marked as paid without a completed '
+            'PayPal payment'.format(
+                flagged.id, flagged.entry_ref, flagged.user.username
+            ),
+            output
+        )
+        self.assertIn(
+            'Entry {} ({}, {}) video: PayPal transaction txn2 not recorded on '
+            'a payment transaction'.format(
+                unrecorded.id, unrecorded.entry_ref, unrecorded.user.username
+            ),
+            output
+        )
+        self.assertIn('3 payment mismatches found', output)
+
+        # not fixed without --fix
+        unflagged.refresh_from_db()
+        self.assertFalse(unflagged.video_entry_paid)
+
+    def test_fix(self):
+        unflagged = baker.make(Entry, video_entry_paid=False)
+        self.make_payment(unflagged, 'video', 'txn1')
+        # could have been marked as paid by hand for a payment outside PayPal
+        flagged = baker.make(Entry, selected_entry_paid=True)
+
+        output = self.reconcile('--fix')
+        self.assertIn(
+            '1 entry payment flag updated to match PayPal', output
+        )
+        unflagged.refresh_from_db()
+        flagged.refresh_from_db()
+        self.assertTrue(unflagged.video_entry_paid)
+        self.assertTrue(flagged.selected_entry_paid)
+        self.assertTrue(
+            ActivityLog.objects.filter(
+                log__startswith='1 entry payment flag updated'
+            ).exists()
+        )
+
+        # still reported
+        self.assertIn('1 payment mismatch found', self.reconcile())
+
+    def test_fix_unmark_unpaid(self):
+        unflagged = baker.make(Entry, video_entry_paid=False)
+        self.make_payment(unflagged, 'video', 'txn1')
+        flagged = baker.make(Entry, selected_entry_paid=True)
+
+        output = self.reconcile('--fix', '--unmark-unpaid')
+        self.assertIn(
+            '2 entry payment flags updated to match PayPal', output
+        )
+        unflagged.refresh_from_db()
+        flagged.refresh_from_db()
+        self.assertTrue(unflagged.video_entry_paid)
+        self.assertFalse(flagged.selected_entry_paid)
+
+        self.assertIn('0 payment mismatches found', self.reconcile())
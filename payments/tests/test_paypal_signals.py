@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 
+from datetime import timedelta
+from io import StringIO
+
 from model_bakery import baker
 from unittest.mock import Mock, patch
 
 from django.conf import settings
-from django.core import mail
+from django.core import mail, management
+from django.core.mail import get_connection
 from django.urls import reverse
 from django.test import TestCase, Client, override_settings
 from django.utils import timezone
@@ -14,9 +18,10 @@ from paypal.standard.ipn.models import PayPalIPN
 from six import b, text_type
 from six.moves.urllib.parse import urlencode
 
-from entries.models import Entry
+from entries.models import Entry, StaffNotification
 
-from ..models import create_entry_paypal_transaction, PaypalEntryTransaction
+from ..models import create_entry_paypal_transaction, get_obj, IPNJob, \
+    payment_received, PaypalEntryTransaction, PayPalTransactionError
 from ..models import logger as payment_models_logger
 
 
@@ -61,8 +66,7 @@ IPN_POST_PARAMS = {
 }
 
 
-@override_settings(DEFAULT_PAYPAL_EMAIL=TEST_RECEIVER_EMAIL)
-class PaypalSignalsTests(TestCase):
+class PaypalPostMixin(object):
 
     def paypal_post(self, params):
         """
@@ -81,6 +85,12 @@ class PaypalSignalsTests(TestCase):
             post_data, content_type='application/x-www-form-urlencoded'
         )
 
+
+@override_settings(
+    DEFAULT_PAYPAL_EMAIL=TEST_RECEIVER_EMAIL, NOTIFICATION_DIGESTS=False
+)
+class PaypalSignalsTests(PaypalPostMixin, TestCase):
+
     def test_paypal_notify_url_with_no_data(self):
         self.assertFalse(PayPalIPN.objects.exists())
         resp = self.paypal_post(
@@ -979,3 +989,294 @@ class PaypalSignalsTests(TestCase):
             ),
             support_email.body
         )
+
+
+@override_settings(DEFAULT_PAYPAL_EMAIL=TEST_RECEIVER_EMAIL)
+class IPNQueryCountTests(TestCase):
+    """
+    Queries run to process each type of IPN, once the IPN has been saved.
+    get_obj used to fetch the entry and then its transactions separately (2
+    queries, 3 if there were duplicate transactions); it now fetches the
+    transaction with its entry and user in a single query.
+    """
+
+    def entry_queries(self, queries):
+        # queries that select the entry on its own, rather than through the
+        # transaction
+        return [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "entries_entry"' in query['sql']
+        ]
+
+    def make_ipn(self, entry, payment_status, invoice_id):
+        return baker.make(
+            PayPalIPN, custom='video {}'.format(entry.id),
+            invoice=invoice_id, txn_id='test_txn_id',
+            business=TEST_RECEIVER_EMAIL, payment_status=payment_status,
+            mc_gross=7
+        )
+
+    def setUp(self):
+        self.entry = baker.make(
+            Entry, category='BEG', user__email='test@test.com'
+        )
+        self.pptrans = create_entry_paypal_transaction(
+            self.entry.user, self.entry, 'video'
+        )
+
+    def test_get_obj_single_query(self):
+        ipn = self.make_ipn(self.entry, 'Completed', self.pptrans.invoice_id)
+        # was 2: the entry, then its transactions
+        with self.assertNumQueries(1):
+            obj_dict = get_obj(ipn)
+            self.assertEqual(obj_dict['obj'].user, self.entry.user)
+        self.assertEqual(obj_dict['paypal_trans'], self.pptrans)
+
+    def test_get_obj_with_duplicate_trans_single_query(self):
+        pptrans1 = baker.make(
+            PaypalEntryTransaction, entry=self.entry, payment_type='video',
+            invoice_id='other'
+        )
+        ipn = self.make_ipn(self.entry, 'Completed', self.pptrans.invoice_id)
+        # was 3: the entry, its transactions and the one matching the invoice
+        with self.assertNumQueries(1):
+            self.assertEqual(get_obj(ipn)['paypal_trans'], self.pptrans)
+
+        # latest if there's no invoice id
+        ipn = self.make_ipn(self.entry, 'Completed', '')
+        with self.assertNumQueries(1):
+            self.assertEqual(get_obj(ipn)['paypal_trans'], pptrans1)
+
+        # error if there are several and none match the invoice id
+        ipn = self.make_ipn(self.entry, 'Completed', 'unknown')
+        with self.assertRaises(PayPalTransactionError):
+            get_obj(ipn)
+
+    @override_settings(NOTIFICATION_DIGESTS=True)
+    def test_payment_received_query_counts(self):
+        # after get_obj's single query, completed and refunded IPNs save the
+        # entry (updating its counters), the transaction and an activity log;
+        # refunds also hold a notification for the support digest; pending
+        # IPNs only log and hold a notification.  Each total was one higher
+        # when get_obj queried the entry separately.
+        for payment_status, queries in [
+            ('Completed', 13), ('Refunded', 10), ('Pending', 3)
+        ]:
+            ipn = self.make_ipn(
+                self.entry, payment_status, self.pptrans.invoice_id
+            )
+            with self.assertNumQueries(queries) as captured:
+                payment_received(ipn)
+            self.assertEqual(self.entry_queries(captured.captured_queries), [])
+
+
+@override_settings(
+    DEFAULT_PAYPAL_EMAIL=TEST_RECEIVER_EMAIL, NOTIFICATION_DIGESTS=True
+)
+class SupportNotificationDigestTests(TestCase):
+    """
+    Refunds and IPN problems are held for the support digest, unless a
+    completed payment couldn't be applied
+    """
+
+    def make_ipn(self, custom, payment_status, business=TEST_RECEIVER_EMAIL):
+        return baker.make(
+            PayPalIPN, custom=custom, invoice=self.pptrans.invoice_id,
+            txn_id='test_txn_id', business=business,
+            payment_status=payment_status, mc_gross=7
+        )
+
+    def setUp(self):
+        self.entry = baker.make(
+            Entry, category='BEG', user__email='test@test.com'
+        )
+        self.pptrans = create_entry_paypal_transaction(
+            self.entry.user, self.entry, 'video'
+        )
+
+    def test_refund_held_for_digest(self):
+        payment_received(
+            self.make_ipn('video {}'.format(self.entry.id), 'Refunded')
+        )
+        self.assertEqual(len(mail.outbox), 0)
+        notification = StaffNotification.objects.get()
+        self.assertEqual(notification.recipient, settings.SUPPORT_EMAIL)
+        self.assertEqual(notification.category, 'refund')
+        self.assertIn(
+            'Payment refund processed for video submission fee',
+            notification.subject
+        )
+        self.assertIsNone(notification.sent)
+
+    def test_pending_payment_held_for_digest(self):
+        payment_received(
+            self.make_ipn('video {}'.format(self.entry.id), 'Pending')
+        )
+        self.assertEqual(len(mail.outbox), 0)
+        notification = StaffNotification.objects.get()
+        self.assertEqual(notification.category, 'payment_problem')
+        self.assertIn('status PENDING', notification.message)
+
+    def test_completed_payment_problems_sent_immediately(self):
+        # unknown entry
+        payment_received(self.make_ipn('video 0', 'Completed'))
+        # wrong receiver email
+        payment_received(
+            self.make_ipn(
+                'video {}'.format(self.entry.id), 'Completed',
+                business='other@test.com'
+            )
+        )
+        self.assertFalse(StaffNotification.objects.exists())
+        self.assertEqual(len(mail.outbox), 2)
+        for email in mail.outbox:
+            self.assertEqual(email.to, [settings.SUPPORT_EMAIL])
+        self.assertEqual(
+            mail.outbox[0].subject, 'WARNING! Error processing PayPal IPN'
+        )
+        self.assertIn(
+            'There was some problem processing video submission fee',
+            mail.outbox[1].subject
+        )
+
+
+@override_settings(
+    DEFAULT_PAYPAL_EMAIL=TEST_RECEIVER_EMAIL, PAYPAL_DEFER_IPN_PROCESSING=True,
+    NOTIFICATION_DIGESTS=False
+)
+@patch('paypal.standard.ipn.models.PayPalIPN._postback')
+class DeferredIPNTests(PaypalPostMixin, TestCase):
+
+    def post_payment(self, entry, txn_id):
+        pptrans = create_entry_paypal_transaction(entry.user, entry, 'video')
+        params = dict(IPN_POST_PARAMS)
+        params.update({
+            'custom': b('video {}'.format(entry.id)),
+            'invoice': b(pptrans.invoice_id),
+            'txn_id': b(txn_id),
+        })
+        return self.paypal_post(params)
+
+    def test_ipn_recorded_not_processed(self, mock_postback):
+        mock_postback.return_value = b"VERIFIED"
+        entry = baker.make(Entry, user__email='test@test.com')
+        resp = self.post_payment(entry, 'txn1')
+        self.assertEqual(resp.status_code, 200)
+
+        job = IPNJob.objects.get()
+        self.assertTrue(job.valid)
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.txn_id, 'txn1')
+        entry.refresh_from_db()
+        self.assertFalse(entry.video_entry_paid)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_process_ipn_jobs(self, mock_postback):
+        mock_postback.return_value = b"VERIFIED"
+        entries = baker.make(Entry, user__email='test@test.com', _quantity=5)
+        for i, entry in enumerate(entries):
+            self.post_payment(entry, 'txn{}'.format(i))
+        self.assertEqual(IPNJob.objects.filter(state='pending').count(), 5)
+
+        with patch(
+                'payments.management.commands.process_ipn_jobs.get_connection',
+                wraps=get_connection
+        ) as mock_get_connection:
+            management.call_command('process_ipn_jobs', batch_size=2)
+        # emails are sent over one connection per batch
+        self.assertEqual(mock_get_connection.call_count, 3)
+        self.assertEqual(IPNJob.objects.filter(state='done').count(), 5)
+        for entry in entries:
+            entry.refresh_from_db()
+            self.assertTrue(entry.video_entry_paid)
+            self.assertEqual(
+                PaypalEntryTransaction.objects.get(entry=entry).transaction_id,
+                'txn{}'.format(entries.index(entry))
+            )
+        # one email to each user
+        self.assertEqual(len(mail.outbox), 5)
+
+        # nothing left to do
+        management.call_command('process_ipn_jobs')
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_resent_ipn_processed_once(self, mock_postback):
+        mock_postback.return_value = b"VERIFIED"
+        entry = baker.make(Entry, user__email='test@test.com')
+        self.post_payment(entry, 'txn1')
+        management.call_command('process_ipn_jobs')
+        self.assertEqual(len(mail.outbox), 1)
+
+        # PayPal sends the same IPN again
+        ipn = PayPalIPN.objects.get()
+        ipn.pk = None
+        ipn.save()
+        IPNJob.enqueue(ipn, valid=True)
+        management.call_command('process_ipn_jobs')
+        self.assertEqual(
+            IPNJob.objects.get(ipn=ipn).state, 'duplicate'
+        )
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_invalid_ipn_job(self, mock_postback):
+        mock_postback.return_value = b"INVALID"
+        entry = baker.make(Entry, user__email='test@test.com')
+        self.post_payment(entry, 'txn1')
+        job = IPNJob.objects.get()
+        self.assertFalse(job.valid)
+        self.assertEqual(len(mail.outbox), 0)
+
+        management.call_command('process_ipn_jobs')
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(
+            mail.outbox[0].subject,
+            'WARNING! Invalid Payment Notification received from PayPal'
+        )
+
+    def test_job_retried_if_emails_not_sent(self, mock_postback):
+        mock_postback.return_value = b"VERIFIED"
+        entry = baker.make(Entry, user__email='test@test.com')
+        self.post_payment(entry, 'txn1')
+
+        with patch(
+                'payments.management.commands.process_ipn_jobs.get_connection'
+        ) as mock_get_connection:
+            mock_get_connection.return_value.send_messages.side_effect = \
+                Exception('Error sending email')
+            management.call_command('process_ipn_jobs', stdout=StringIO())
+        # the payment isn't applied, and the job is left to retry
+        job = IPNJob.objects.get()
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.error, 'Error sending email')
+        entry.refresh_from_db()
+        self.assertFalse(entry.video_entry_paid)
+
+        management.call_command('process_ipn_jobs', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'done')
+        entry.refresh_from_db()
+        self.assertTrue(entry.video_entry_paid)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_stale_running_job_requeued(self, mock_postback):
+        mock_postback.return_value = b"VERIFIED"
+        entry = baker.make(Entry, user__email='test@test.com')
+        self.post_payment(entry, 'txn1')
+        IPNJob.objects.update(state='running', started=timezone.now())
+        management.call_command('process_ipn_jobs', stdout=StringIO())
+        # still being processed by another worker
+        self.assertEqual(IPNJob.objects.get().state, 'running')
+
+        IPNJob.objects.update(
+            started=timezone.now() - timedelta(
+                seconds=settings.IPN_JOB_STALE_SECONDS + 1
+            )
+        )
+        output = StringIO()
+        management.call_command('process_ipn_jobs', stdout=output)
+        self.assertIn('1 stale IPN job requeued', output.getvalue())
+        self.assertEqual(IPNJob.objects.get().state, 'done')
+        entry.refresh_from_db()
+        self.assertTrue(entry.video_entry_paid)
@@ -0,0 +1,241 @@
+"""
+Resilient access to the shared (memcached) cache
+
+Values are read from and written to the shared cache as usual, and also kept
+in a small in-process tier.  On a miss, only one caller recomputes the value:
+other threads in the same process wait for it, and other processes are held
+off by a short-lived lock key in the shared cache and wait briefly for the
+new value.  If the shared cache is unavailable (e.g. memcached has just
+restarted), a recent value from the in-process tier is returned instead of
+going to the database.
+
+Timeouts are jittered so that keys set at the same time (e.g. user_<id>_is_staff
+for every user after a restart) don't all expire together.
+"""
+import random
+import threading
+import time
+
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+metrics = Counter()
+
+
+class LocalCache(object):
+    """
+    Bounded, thread-safe, in-process cache; the least recently used values
+    are discarded once max_entries is reached
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, set_after=None):
+        """
+        Return the value for key, or None if it is missing, expired or was
+        set before set_after
+        """
+        with self._lock:
+            try:
+                value, set_at, expires = self._data[key]
+            except KeyError:
+                return None
+            now = time.monotonic()
+            if expires < now:
+                del self._data[key]
+                return None
+            if set_after is not None and set_at < set_after:
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now, now + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+local_cache = LocalCache(settings.LOCAL_CACHE_MAX_ENTRIES)
+
+# keys are spread over a fixed set of locks, which guard the record of the
+# keys being recomputed in this process without keeping a lock for every key
+_key_locks = [threading.Lock() for _ in range(64)]
+# key: Event set when the thread recomputing the value finishes
+_in_flight = {}
+
+
+def _key_lock(key):
+    return _key_locks[hash(key) % len(_key_locks)]
+
+
+def jitter(timeout):
+    if timeout is None:
+        return None
+    spread = timeout * settings.CACHE_TIMEOUT_JITTER
+    return int(timeout + random.uniform(-spread, spread))
+
+
+def _local_timeout(timeout):
+    if timeout is None:
+        return settings.LOCAL_CACHE_TIMEOUT
+    return min(timeout, settings.LOCAL_CACHE_TIMEOUT)
+
+
+def _shared_get(key):
+    try:
+        return cache.get(key)
+    except Exception:
+        metrics['errors'] += 1
+        return None
+
+
+def set_value(key, value, timeout):
+    """
+    Set a value in both tiers; timeout is jittered for the shared cache
+    """
+    try:
+        cache.set(key, value, jitter(timeout))
+    except Exception:
+        metrics['errors'] += 1
+    local_cache.set(key, value, _local_timeout(timeout))
+
+
+def delete(key):
+    try:
+        cache.delete(key)
+    except Exception:
+        metrics['errors'] += 1
+    local_cache.delete(key)
+
+
+def get_or_set(key, compute, timeout):
+    """
+    Return the cached value for key, calling compute() to generate and cache
+    it on a miss.  compute() must not return None.
+    """
+    value = _shared_get(key)
+    if value is not None:
+        metrics['hits'] += 1
+        local_cache.set(key, value, _local_timeout(timeout))
+        return value
+
+    metrics['misses'] += 1
+    missed_at = time.monotonic()
+    with _key_lock(key):
+        # another thread in this process may have recomputed the value while
+        # we were waiting for the lock
+        value = local_cache.get(key, set_after=missed_at)
+        if value is not None:
+            metrics['coalesced'] += 1
+            return value
+        event = _in_flight.get(key)
+        recomputing = event is None
+        if recomputing:
+            event = _in_flight[key] = threading.Event()
+
+    if not recomputing:
+        # wait for the thread that is recomputing it, without holding the
+        # lock, which other keys share
+        event.wait(settings.CACHE_LOCK_WAIT)
+        value = local_cache.get(key, set_after=missed_at)
+        if value is not None:
+            metrics['coalesced'] += 1
+            return value
+        return _recompute(key, compute, timeout, missed_at)
+
+    try:
+        return _recompute(key, compute, timeout, missed_at)
+    finally:
+        with _key_lock(key):
+            del _in_flight[key]
+        event.set()
+
+
+def _recompute(key, compute, timeout, missed_at):
+    lock_key = '{}_lock'.format(key)
+    try:
+        locked = cache.add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT)
+    except Exception:
+        metrics['errors'] += 1
+        locked = False
+
+    if not locked:
+        if _shared_get(lock_key) is None:
+            # the lock wasn't added but nobody holds it, so the shared cache
+            # is unavailable (python-memcached returns 0/None rather than
+            # raising when the server is down); any recent local value will
+            # do
+            value = local_cache.get(key)
+            if value is not None:
+                metrics['fallback_hits'] += 1
+                return value
+        else:
+            value = _wait_for_value(key, missed_at)
+            if value is not None:
+                return value
+
+    try:
+        value = compute()
+        metrics['computed'] += 1
+        set_value(key, value, timeout)
+    finally:
+        if locked:
+            delete(lock_key)
+    return value
+
+
+def _wait_for_value(key, set_after):
+    """
+    The value is being recomputed by another process; return a local value
+    set after set_after if there is one, otherwise wait briefly for the other
+    process to finish
+    """
+    value = local_cache.get(key, set_after=set_after)
+    if value is not None:
+        metrics['fallback_hits'] += 1
+        return value
+    deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = _shared_get(key)
+        if value is not None:
+            metrics['coalesced'] += 1
+            local_cache.set(key, value, settings.LOCAL_CACHE_TIMEOUT)
+            return value
+    return None
+
+
+def get_metrics():
+    """
+    Cache counts for this process since it started
+    """
+    stats = {
+        name: metrics[name] for name in [
+            'hits', 'misses', 'computed', 'coalesced', 'fallback_hits',
+            'errors'
+        ]
+    }
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+    stats['local_entries'] = len(local_cache)
+    return stats
@@ -0,0 +1,36 @@
+import logging
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def log_active_middleware():
+    logger.info(
+        'Middleware profile "%s"; active middleware: %s',
+        settings.MIDDLEWARE_PROFILE, ', '.join(settings.MIDDLEWARE)
+    )
+
+
+class RequestTimingMiddleware(object):
+    """
+    Add the time taken to handle each request in a Server-Timing header, and
+    log requests that take longer than settings.SLOW_REQUEST_MS
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+        response['Server-Timing'] = 'total;dur={:.1f}'.format(duration_ms)
+        if duration_ms > settings.SLOW_REQUEST_MS:
+            logger.warning(
+                'Slow request: %s %s took %.0fms',
+                request.method, request.path, duration_ms
+            )
+        return response
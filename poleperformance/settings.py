@@ -62,7 +62,6 @@ INSTALLED_APPS = [
     'cookielaw',
     'allauth',
     'allauth.account',
-    'debug_toolbar',
     'crispy_forms',
     'django_extensions',
     'paypal.standard.ipn',
@@ -74,16 +73,49 @@ INSTALLED_APPS = [
     'ppadmin'
 ]
 
+# Middleware profiles
+# The middleware stack is assembled for the environment given by the
+# MIDDLEWARE_PROFILE env variable (production, staging, development or test).
+# Optional middleware, marked by the names below, is only included if
+# enabled for the profile; the active stack is logged when the wsgi
+# application starts.
+MIDDLEWARE_PROFILES = {
+    'production': set(),
+    'staging': {'timing'},
+    'development': {'timing', 'debug_toolbar'},
+    'test': set(),
+}
+if 'test' in sys.argv:
+    MIDDLEWARE_PROFILE = 'test'
+else:  # pragma: no cover
+    MIDDLEWARE_PROFILE = env(
+        'MIDDLEWARE_PROFILE', default='development' if DEBUG else 'production'
+    )
+ENABLED_MIDDLEWARE = MIDDLEWARE_PROFILES[MIDDLEWARE_PROFILE]
+if env('SHOW_DEBUG_TOOLBAR') and 'test' not in sys.argv:  # pragma: no cover
+    ENABLED_MIDDLEWARE = ENABLED_MIDDLEWARE | {'debug_toolbar'}
+DEBUG_TOOLBAR_ENABLED = 'debug_toolbar' in ENABLED_MIDDLEWARE
+
+ALL_MIDDLEWARE = [
+    (None, 'django.middleware.security.SecurityMiddleware'),
+    ('timing', 'poleperformance.middleware.RequestTimingMiddleware'),
+    (None, 'django.contrib.sessions.middleware.SessionMiddleware'),
+    (None, 'django.middleware.common.CommonMiddleware'),
+    (None, 'django.middleware.csrf.CsrfViewMiddleware'),
+    (None, 'django.contrib.auth.middleware.AuthenticationMiddleware'),
+    ('debug_toolbar', 'debug_toolbar.middleware.DebugToolbarMiddleware'),
+    (None, 'django.contrib.messages.middleware.MessageMiddleware'),
+    (None, 'django.middleware.clickjacking.XFrameOptionsMiddleware'),
+]
 MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    middleware for name, middleware in ALL_MIDDLEWARE
+    if name is None or name in ENABLED_MIDDLEWARE
 ]
+if DEBUG_TOOLBAR_ENABLED:  # pragma: no cover
+    INSTALLED_APPS.append('debug_toolbar')
+
+# requests taking longer than this are logged by RequestTimingMiddleware
+SLOW_REQUEST_MS = env.int('SLOW_REQUEST_MS', default=1000)
 
 SITE_ID = 1
 
@@ -95,6 +127,20 @@ CACHES = {
     }
 }
 
+# poleperformance.caching: in-process fallback tier, timeout jitter (as a
+# fraction of the timeout) and locking for values recomputed on a cache miss
+LOCAL_CACHE_MAX_ENTRIES = 2000
+LOCAL_CACHE_TIMEOUT = 300
+CACHE_TIMEOUT_JITTER = 0.1
+CACHE_LOCK_TIMEOUT = 10
+CACHE_LOCK_WAIT = 0.5
+
+# entries.views.check_partner: results are cached per email, and each session
+# can make PARTNER_CHECK_RATE_LIMIT checks per PARTNER_CHECK_RATE_WINDOW seconds
+PARTNER_CHECK_CACHE_TIMEOUT = 300
+PARTNER_CHECK_RATE_LIMIT = 30
+PARTNER_CHECK_RATE_WINDOW = 60
+
 
 AUTHENTICATION_BACKENDS = (
     # Needed to login by username in Django admin, regardless of `allauth`
@@ -127,6 +173,19 @@ ACCOUNT_PRESERVE_USERNAME_CASING = False
 
 ROOT_URLCONF = 'poleperformance.urls'
 
+TEMPLATE_LOADERS = [
+    'apptemplates.Loader',
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+# Compiled templates are cached; with TEMPLATE_AUTO_RELOAD (on by default when
+# DEBUG is True), cached templates are re-read when their files are modified
+TEMPLATE_AUTO_RELOAD = env.bool('TEMPLATE_AUTO_RELOAD', default=DEBUG)
+if TEMPLATE_AUTO_RELOAD:  # pragma: no cover
+    TEMPLATE_CACHE_LOADER = 'poleperformance.template_loaders.AutoReloadLoader'
+else:
+    TEMPLATE_CACHE_LOADER = 'django.template.loaders.cached.Loader'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -142,9 +201,7 @@ TEMPLATES = [
                 'entries.context_processors.entries',
             ],
             'loaders': [
-                'apptemplates.Loader',
-                'django.template.loaders.filesystem.Loader',
-                'django.template.loaders.app_directories.Loader',
+                (TEMPLATE_CACHE_LOADER, TEMPLATE_LOADERS),
             ]
         },
     },
@@ -290,6 +347,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'poleperformance': {
+            'handlers': ['console', 'file_app', 'mail_admins'],
+            'level': 'INFO',
+            'propagate': False,
+        },
 
     },
 }
@@ -329,6 +391,15 @@ if env('USE_MAILCATCHER'):  # pragma: no cover
 # DJANGO-PAYPAL
 DEFAULT_PAYPAL_EMAIL = env('DEFAULT_PAYPAL_EMAIL')
 PAYPAL_TEST = env('PAYPAL_TEST')
+# if True, IPNs are only recorded when received, and applied (with emails
+# sent in batches) by the process_ipn_jobs management command
+PAYPAL_DEFER_IPN_PROCESSING = env.bool(
+    'PAYPAL_DEFER_IPN_PROCESSING', default=False
+)
+IPN_JOB_BATCH_SIZE = 50
+# IPN jobs still running after this time were left by a worker that stopped,
+# and are processed again
+IPN_JOB_STALE_SECONDS = 60 * 10
 
 
 if 'test' in sys.argv:  # use local cache for tests
@@ -350,6 +421,7 @@ FINAL_DATE = env('FINAL_DATE')
 FINAL_TIMES = env('FINAL_TIMES')
 
 if env('SHOW_DEBUG_TOOLBAR') and 'test' not in sys.argv:  # pragma: no cover
+    # show the toolbar regardless of DEBUG and INTERNAL_IPS
     def show_toolbar(request):
         return True
     DEBUG_TOOLBAR_PATCH_SETTINGS = False
@@ -361,5 +433,38 @@ if env('SHOW_DEBUG_TOOLBAR') and 'test' not in sys.argv:  # pragma: no cover
 # Activitylogs
 EMPTY_JOB_TEXT = ['CRON: Auto warn/withdraw selected unconfirmed/unpaid run: no action required']
 
+# Background entry exports
+EXPORT_JOBS_ROOT = env('EXPORT_JOBS_ROOT', default=root('exports'))
+# identical export requests within this time reuse the existing file
+EXPORT_JOB_REUSE_SECONDS = 600
+# generated export files are deleted after this time
+EXPORT_JOB_EXPIRY_SECONDS = 60 * 60 * 24
+# jobs still running after this time are marked as failed
+EXPORT_JOB_STALE_SECONDS = 60 * 15
+
+# Notifications to the studio and support email addresses (withdrawals,
+# refunds and payment problems) are collected and sent in a periodic digest
+# by the send_notification_digests command; critical ones are always sent
+# immediately.  Only enable this once the command is scheduled (e.g. hourly)
+# in cron, otherwise held notifications are never sent.
+NOTIFICATION_DIGESTS = env.bool('NOTIFICATION_DIGESTS', default=False)
+
+# Bulk emails to users
+# bcc recipients per email
+BULK_EMAIL_BATCH_SIZE = 99
+# number of emails sent in parallel, each on its own mail server connection
+BULK_EMAIL_WORKERS = env.int('BULK_EMAIL_WORKERS', default=4)
+# overall sending rate, to stay within the mail provider's limits; 0 for no
+# limit
+BULK_EMAIL_MESSAGES_PER_MINUTE = env.int(
+    'BULK_EMAIL_MESSAGES_PER_MINUTE', default=60
+)
+# a running campaign with no progress for this long is assumed to have
+# stopped, and can be resumed
+EMAIL_CAMPAIGN_STALE_SECONDS = 60 * 10
+# stored recipient sets are deleted after this time, unless a campaign still
+# needs them
+RECIPIENT_SET_EXPIRY_SECONDS = 60 * 60 * 24 * 7
+
 S3_LOG_BACKUP_PATH = "s3://backups.polefitstarlet.co.uk/poleperformance_activitylogs"
 S3_LOG_BACKUP_ROOT_FILENAME = "poleperformance_activity_logs_backup"
@@ -0,0 +1,37 @@
+import os
+
+from django.template.loaders.cached import Loader as CachedLoader
+
+
+class AutoReloadLoader(CachedLoader):
+    """
+    Cached template loader for development.  Compiled templates are cached as
+    in production, but the cache is cleared if the file a template was
+    loaded from has been modified since it was cached.
+    """
+
+    def __init__(self, engine, loaders):
+        super().__init__(engine, loaders)
+        self.mtimes = {}
+
+    def get_template(self, template_name, skip=None):
+        template = super().get_template(template_name, skip)
+        filename = template.origin.name
+        mtime = self._get_mtime(filename)
+        cached_mtime = self.mtimes.setdefault(filename, mtime)
+        if mtime != cached_mtime:
+            self.reset()
+            self.mtimes[filename] = mtime
+            template = super().get_template(template_name, skip)
+        return template
+
+    def reset(self):
+        super().reset()
+        self.mtimes = {}
+
+    @staticmethod
+    def _get_mtime(filename):
+        try:
+            return os.stat(filename).st_mtime
+        except OSError:
+            return None
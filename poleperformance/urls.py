@@ -49,6 +49,6 @@ if settings.HEROKU:  # pragma: no cover
         settings.STATIC_URL, document_root=settings.STATIC_ROOT
     )
 
-if settings.DEBUG:  # pragma: no cover
+if settings.DEBUG_TOOLBAR_ENABLED:  # pragma: no cover
     import debug_toolbar
     urlpatterns.append(path('__debug__/', include(debug_toolbar.urls)))
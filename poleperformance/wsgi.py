@@ -14,3 +14,6 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "poleperformance.settings")
 
 application = get_wsgi_application()
+
+from poleperformance.middleware import log_active_middleware  # noqa: E402
+log_active_middleware()
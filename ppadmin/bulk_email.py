@@ -0,0 +1,244 @@
+"""
+Sending bulk emails to large numbers of users
+
+The message is rendered once and bcc'd to chunks of recipients.  Chunks are
+sent from a small pool of threads, each of which opens one connection to the
+mail server and reuses it for all of its chunks, and a shared rate limiter
+keeps the overall rate within settings.BULK_EMAIL_MESSAGES_PER_MINUTE (gmail
+rejects mail from accounts that send too quickly).
+"""
+import logging
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from math import ceil
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.message import EmailMultiAlternatives
+from django.template.loader import get_template
+from django.utils import timezone
+
+from activitylog.models import ActivityLog
+
+from .models import EmailCampaign
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to wait() so that no more than messages_per_minute
+    return in any minute; shared by all sending threads
+    """
+
+    def __init__(self, messages_per_minute):
+        self.interval = 60 / messages_per_minute if messages_per_minute else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            send_at = max(now, self._next)
+            self._next = send_at + self.interval
+        if send_at > now:
+            time.sleep(send_at - now)
+
+
+class BulkEmailSender(object):
+    """
+    Send one rendered message to chunks of bcc recipients.  on_chunk_sent, if
+    given, is called from the calling thread with each chunk's index and
+    whether it was sent, as it completes.
+    """
+
+    def __init__(
+            self, subject, body, html_body, from_email, reply_to=None,
+            first_cc=None, workers=None, messages_per_minute=None,
+            on_chunk_sent=None
+    ):
+        self.subject = subject
+        self.body = body
+        self.html_body = html_body
+        self.from_email = from_email
+        self.reply_to = reply_to or []
+        self.first_cc = first_cc or []
+        self.workers = workers or settings.BULK_EMAIL_WORKERS
+        self.limiter = RateLimiter(
+            settings.BULK_EMAIL_MESSAGES_PER_MINUTE
+            if messages_per_minute is None else messages_per_minute
+        )
+        self.on_chunk_sent = on_chunk_sent
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def get_connection(self):
+        """
+        The open mail connection for the current thread
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = get_connection()
+            connection.open()
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def build_message(self, bcc, cc=None):
+        msg = EmailMultiAlternatives(
+            self.subject, self.body, from_email=self.from_email, bcc=bcc,
+            cc=cc or [], reply_to=self.reply_to,
+            connection=self.get_connection()
+        )
+        msg.attach_alternative(self.html_body, 'text/html')
+        return msg
+
+    def send_chunk(self, index, bcc):
+        self.limiter.wait()
+        try:
+            msg = self.build_message(bcc, self.first_cc if index == 0 else [])
+            return msg.send(fail_silently=False) == 1
+        except Exception as e:
+            logger.error('Error sending bulk email chunk {}: {}'.format(
+                index, e
+            ))
+            # drop the connection, so the thread reconnects for its next chunk
+            self._local.connection = None
+            return False
+
+    def send(self, chunks):
+        """
+        Send to each list of addresses in chunks; returns the numbers of
+        sent and failed emails.  Chunks are read from chunks as the workers
+        are ready for them, so only a few are held in memory at once.
+        """
+        sent = failed = 0
+        chunks = enumerate(chunks)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {}
+
+                def submit_chunks():
+                    while len(futures) < self.workers * 2:
+                        try:
+                            index, chunk = next(chunks)
+                        except StopIteration:
+                            return
+                        futures[
+                            pool.submit(self.send_chunk, index, chunk)
+                        ] = index
+
+                submit_chunks()
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = futures.pop(future)
+                        ok = future.result()
+                        if ok:
+                            sent += 1
+                        else:
+                            failed += 1
+                        if self.on_chunk_sent:
+                            self.on_chunk_sent(index, ok)
+                    submit_chunks()
+        finally:
+            for connection in self._connections:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+        return sent, failed
+
+
+def send_campaign(campaign):
+    """
+    Send an EmailCampaign that has been claimed (i.e. is 'running') to the
+    recipients who haven't already been emailed.  Recipients are marked as
+    sent as each email completes; if the process stops, at most the emails
+    in progress (one per worker) are sent again when the campaign is resumed.
+    """
+    batch_size = settings.BULK_EMAIL_BATCH_SIZE
+    campaign.failed_emails = 0
+    resuming = False
+    try:
+        campaign.add_recipients(batch_size)
+        campaign.recipient_count = campaign.recipients.count()
+        unsent_count = campaign.recipients.exclude(state='sent').count()
+        resuming = unsent_count < campaign.recipient_count
+        campaign.email_count = campaign.sent_emails + ceil(
+            unsent_count / batch_size
+        )
+        campaign.save()
+
+        ctx = {
+            'host': campaign.host,
+            'subject': campaign.subject,
+            'message': campaign.message,
+            'number_of_emails': campaign.email_count,
+            'email_count': campaign.recipient_count,
+            'is_test': False,
+        }
+
+        chunk_ids = []
+
+        def chunks():
+            for batch in campaign.unsent_batches(batch_size):
+                chunk_ids.append([recipient_id for recipient_id, _ in batch])
+                yield [email for _, email in batch]
+
+        def checkpoint(index, ok):
+            now = timezone.now()
+            campaign.recipients.filter(id__in=chunk_ids[index]).update(
+                state='sent' if ok else 'failed', sent=now if ok else None
+            )
+            if ok:
+                campaign.sent_emails += 1
+            else:
+                campaign.failed_emails += 1
+            EmailCampaign.objects.filter(id=campaign.id).update(
+                sent_emails=campaign.sent_emails,
+                failed_emails=campaign.failed_emails,
+                checkpointed=now
+            )
+
+        sender = BulkEmailSender(
+            campaign.subject,
+            get_template('ppadmin/email/email_users.txt').render(ctx),
+            get_template('ppadmin/email/email_users.html').render(ctx),
+            from_email=campaign.from_address,
+            reply_to=[campaign.from_address],
+            # the from address is cc'd on the first email only
+            first_cc=[campaign.from_address]
+            if campaign.cc and not resuming else [],
+            on_chunk_sent=checkpoint
+        )
+        sender.send(chunks())
+    except Exception as e:
+        logger.error('Email campaign {} failed: {}'.format(campaign.id, e))
+        campaign.state = 'failed'
+        campaign.error = str(e)
+    else:
+        campaign.state = 'failed' if campaign.failed_emails else 'done'
+    campaign.completed = timezone.now()
+    campaign.save()
+
+    ActivityLog.objects.create(
+        log='Bulk email {} with subject "{}" by admin user {}{}: {} of {} '
+            'emails sent to {} users{}'.format(
+                campaign.id, campaign.subject,
+                campaign.created_by.username if campaign.created_by else '-',
+                ' (resumed)' if resuming else '',
+                campaign.sent_emails, campaign.email_count,
+                campaign.recipient_count,
+                '; {} failed'.format(campaign.failed_emails)
+                if campaign.failed_emails else ''
+            )
+    )
+    return campaign
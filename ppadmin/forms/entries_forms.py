@@ -67,6 +67,16 @@ class ExportEntriesForm(forms.Form):
         initial='selected_confirmed'
     )
 
+    file_format = forms.ChoiceField(
+        widget=forms.Select(attrs={'class': 'filter-dropdown'}),
+        choices=(
+            ('xlsx', 'Excel (.xlsx)'),
+            ('xls', 'Excel 97-2003 (.xls, max 65,536 rows per sheet)'),
+        ),
+        initial='xlsx',
+        required=False
+    )
+
     include_choices = (
         ('name', 'Name'),
         ('stage_name', 'Stage Name'),
@@ -93,6 +103,10 @@ class ExportEntriesForm(forms.Form):
         required=True
     )
 
+    def clean_file_format(self):
+        # default to the legacy format for requests that don't specify one
+        return self.cleaned_data['file_format'] or 'xls'
+
     def clean(self):
         entries = Entry.objects.filter(
             withdrawn=False, entry_year=settings.CURRENT_ENTRY_YEAR
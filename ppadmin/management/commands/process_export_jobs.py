@@ -0,0 +1,108 @@
+"""
+Generate files for pending entry export jobs, fail jobs whose worker has
+stopped and delete expired ones.
+Run frequently (e.g. every minute) from cron.
+"""
+import logging
+import os
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ppadmin.models import ExportJob
+from ppadmin.spreadsheets import SPREADSHEET_WRITERS
+from ppadmin.views.entries_views import get_export_entries, write_export
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Generate files for pending entry export jobs'
+
+    def handle(self, *args, **options):
+        os.makedirs(settings.EXPORT_JOBS_ROOT, exist_ok=True)
+        self.fail_stale_jobs()
+
+        for job in ExportJob.objects.filter(state='pending').order_by('id'):
+            # claim the job so a concurrent worker doesn't also process it
+            started = timezone.now()
+            claimed = ExportJob.objects.filter(id=job.id, state='pending')\
+                .update(state='running', started=started)
+            if not claimed:
+                continue
+            job.started = started
+            self.process_job(job)
+
+        self.expire_jobs()
+
+    def fail_stale_jobs(self):
+        stale_count = ExportJob.objects.filter(
+            state='running', started__lt=ExportJob.stale_before()
+        ).update(
+            state='failed', completed=timezone.now(),
+            error='Export job stopped before it completed'
+        )
+        if stale_count:
+            self.stdout.write('{} stale export job{} failed'.format(
+                stale_count, '' if stale_count == 1 else 's'
+            ))
+
+    def process_job(self, job):
+        writer_class = SPREADSHEET_WRITERS[job.file_format]
+        filename = 'export_{}.{}'.format(job.id, writer_class.extension)
+        filepath = os.path.join(settings.EXPORT_JOBS_ROOT, filename)
+        try:
+            entries = get_export_entries(
+                job.category, job.status, job.entry_year
+            )
+            with open(filepath, 'wb') as output:
+                write_export(
+                    writer_class(output), job.category, entries,
+                    job.column_names
+                )
+        except Exception as e:
+            logger.error('Export job {} failed: {}'.format(job.id, e))
+            job.state = 'failed'
+            job.error = str(e)
+        else:
+            job.state = 'done'
+            job.filename = filename
+        job.completed = timezone.now()
+        # only if the job is still ours; if it took too long, another run
+        # may have failed it and a replacement may have been requested
+        finished = ExportJob.objects.filter(
+            id=job.id, state='running', started=job.started
+        ).update(
+            state=job.state, filename=job.filename, error=job.error,
+            completed=job.completed
+        )
+        if not finished or job.state == 'failed':
+            if os.path.exists(filepath):
+                os.unlink(filepath)
+        if not finished:
+            self.stdout.write(
+                'Export job {}: discarded, as it was failed while '
+                'running'.format(job.id)
+            )
+            return
+        self.stdout.write('Export job {}: {}'.format(job.id, job.state))
+
+    def expire_jobs(self):
+        expire_before = timezone.now() - timedelta(
+            seconds=settings.EXPORT_JOB_EXPIRY_SECONDS
+        )
+        expired_jobs = ExportJob.objects.filter(
+            state='done', completed__lt=expire_before
+        )
+        for job in expired_jobs:
+            if os.path.exists(job.filepath):
+                os.unlink(job.filepath)
+        expired_count = expired_jobs.update(state='expired')
+        if expired_count:
+            self.stdout.write('{} export job{} expired'.format(
+                expired_count, '' if expired_count == 1 else 's'
+            ))
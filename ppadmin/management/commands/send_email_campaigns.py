@@ -0,0 +1,55 @@
+"""
+Send pending bulk email campaigns, resume campaigns whose sending process
+has stopped and delete expired recipient sets.
+Run frequently (e.g. every minute) from cron.
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ppadmin.bulk_email import send_campaign
+from ppadmin.models import EmailCampaign, RecipientSet
+
+
+class Command(BaseCommand):
+    help = 'Send pending bulk email campaigns'
+
+    def handle(self, *args, **options):
+        for campaign in EmailCampaign.objects.filter(state='running'):
+            if campaign.resume():
+                self.stdout.write(
+                    'Email campaign {}: resuming stopped campaign'.format(
+                        campaign.id
+                    )
+                )
+
+        for campaign in EmailCampaign.objects.filter(state='pending')\
+                .select_related('recipient_set', 'created_by').order_by('id'):
+            # claim the campaign so a concurrent worker doesn't also send it;
+            # resetting started and checkpointed means a worker holding an
+            # earlier, stale copy of the campaign can no longer resume it
+            started = timezone.now()
+            claimed = EmailCampaign.objects.filter(
+                id=campaign.id, state='pending'
+            ).update(state='running', started=started, checkpointed=None)
+            if not claimed:
+                continue
+            campaign.state = 'running'
+            campaign.started = started
+            campaign.checkpointed = None
+            send_campaign(campaign)
+            self.stdout.write(
+                'Email campaign {}: {} ({} of {} emails sent)'.format(
+                    campaign.id, campaign.state, campaign.sent_emails,
+                    campaign.email_count
+                )
+            )
+
+        self.expire_recipient_sets()
+
+    def expire_recipient_sets(self):
+        _, deleted = RecipientSet.expired().delete()
+        expired_count = deleted.get('ppadmin.RecipientSet', 0)
+        if expired_count:
+            self.stdout.write('{} recipient set{} deleted'.format(
+                expired_count, '' if expired_count == 1 else 's'
+            ))
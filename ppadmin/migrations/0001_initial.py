@@ -0,0 +1,38 @@
+# Generated by Django 3.0.3 on 2026-10-19 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_year', models.CharField(max_length=4)),
+                ('category', models.CharField(max_length=3)),
+                ('status', models.CharField(max_length=20)),
+                ('columns', models.CharField(max_length=255)),
+                ('file_format', models.CharField(max_length=4)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('expired', 'Expired')], default='pending', max_length=10)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'index_together': {('entry_year', 'category', 'status', 'columns', 'file_format')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.0.3 on 2026-10-19 19:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import ppadmin.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ppadmin', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipientSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(default=ppadmin.models._recipient_set_token, max_length=32, unique=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('from_filter', models.BooleanField(default=False)),
+                ('entry_year', models.CharField(blank=True, max_length=4)),
+                ('category', models.CharField(blank=True, max_length=3)),
+                ('status', models.CharField(blank=True, max_length=20)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('selected_users', models.ManyToManyField(blank=True, related_name='_recipientset_selected_users_+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.3 on 2026-10-19 19:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ppadmin', '0002_recipientset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailCampaign',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('message', models.TextField()),
+                ('from_address', models.EmailField(max_length=254)),
+                ('cc', models.BooleanField(default=False)),
+                ('host', models.CharField(blank=True, max_length=255)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('recipient_count', models.PositiveIntegerField(default=0)),
+                ('email_count', models.PositiveIntegerField(default=0)),
+                ('sent_emails', models.PositiveIntegerField(default=0)),
+                ('failed_emails', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('recipient_set', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='ppadmin.RecipientSet')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-19 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppadmin', '0004_campaignrecipient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.3 on 2026-10-19 20:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ppadmin', '0005_exportjob_started'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailcampaign',
+            name='recipient_set',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='campaigns', to='ppadmin.RecipientSet'),
+        ),
+    ]
@@ -1 +1,353 @@
+import os
+import uuid
 
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.utils import timezone
+
+from entries.models import Entry
+
+
+EXPORT_JOB_STATES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+    ('expired', 'Expired'),
+)
+
+
+class ExportJob(models.Model):
+    """
+    A request to export entry data to a spreadsheet.  Jobs are generated
+    outside the request by the process_export_jobs management command and
+    the finished file is stored in settings.EXPORT_JOBS_ROOT.
+    """
+    requested_by = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    entry_year = models.CharField(max_length=4)
+    category = models.CharField(max_length=3)
+    status = models.CharField(max_length=20)
+    columns = models.CharField(max_length=255)
+    file_format = models.CharField(max_length=4)
+    state = models.CharField(
+        choices=EXPORT_JOB_STATES, default='pending', max_length=10
+    )
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    completed = models.DateTimeField(null=True, blank=True)
+    filename = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        index_together = (
+            'entry_year', 'category', 'status', 'columns', 'file_format'
+        )
+
+    def __str__(self):
+        return 'Export {} - {} - {} ({})'.format(
+            self.id, self.category, self.status, self.state
+        )
+
+    @property
+    def column_names(self):
+        return self.columns.split(',')
+
+    @property
+    def filepath(self):
+        if self.filename:
+            return os.path.join(settings.EXPORT_JOBS_ROOT, self.filename)
+
+    @staticmethod
+    def stale_before():
+        """
+        Jobs started before this time and still running are assumed to have
+        been abandoned by a worker that stopped
+        """
+        return timezone.now() - timedelta(
+            seconds=settings.EXPORT_JOB_STALE_SECONDS
+        )
+
+    @classmethod
+    def request_export(cls, user, category, status, column_names, file_format):
+        """
+        Return an export job for the requested data, reusing a job for an
+        identical request that is still in progress or was completed within
+        settings.EXPORT_JOB_REUSE_SECONDS.  Running jobs that have gone stale
+        (their worker has stopped) aren't reused.
+        """
+        job_data = {
+            'entry_year': settings.CURRENT_ENTRY_YEAR,
+            'category': category,
+            'status': status,
+            'columns': ','.join(column_names),
+            'file_format': file_format,
+        }
+        reuse_after = timezone.now() - timedelta(
+            seconds=settings.EXPORT_JOB_REUSE_SECONDS
+        )
+        existing = cls.objects.filter(**job_data).filter(
+            models.Q(state='pending') |
+            models.Q(state='running', started__gt=cls.stale_before()) |
+            models.Q(state='done', completed__gt=reuse_after)
+        ).order_by('-created').first()
+        if existing:
+            return existing, False
+        return cls.objects.create(requested_by=user, **job_data), True
+
+
+def filter_entries(queryset, cat_filter='all', status_filter='all_excl'):
+    """
+    Apply the ppadmin entries list category and status filters; by default
+    withdrawn and in progress entries are excluded
+    """
+    if cat_filter and cat_filter != 'all':
+        queryset = queryset.filter(category=cat_filter)
+    if status_filter == 'all_excl':
+        queryset = queryset.filter(withdrawn=False)\
+            .exclude(status='in_progress')
+    elif status_filter == 'withdrawn':
+        queryset = queryset.filter(withdrawn=True)
+    elif status_filter and status_filter != 'all':
+        queryset = queryset.filter(status=status_filter)
+    return queryset
+
+
+def _recipient_set_token():
+    return uuid.uuid4().hex
+
+
+class RecipientSet(models.Model):
+    """
+    The users a bulk email is for, stored so that the email form only needs
+    to post the token.  Either a selection of users, or the users with
+    current year entries matching the entries list filters.
+    """
+    token = models.CharField(
+        max_length=32, unique=True, default=_recipient_set_token
+    )
+    created_by = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    created = models.DateTimeField(default=timezone.now)
+    selected_users = models.ManyToManyField(User, blank=True, related_name='+')
+    from_filter = models.BooleanField(default=False)
+    entry_year = models.CharField(max_length=4, blank=True)
+    category = models.CharField(max_length=3, blank=True)
+    status = models.CharField(max_length=20, blank=True)
+
+    def __str__(self):
+        return 'Recipients {} ({})'.format(self.id, self.token)
+
+    @classmethod
+    def expired(cls):
+        """
+        Recipient sets older than settings.RECIPIENT_SET_EXPIRY_SECONDS,
+        except those for campaigns that haven't finished sending (done
+        campaigns have their own copy of the recipients)
+        """
+        return cls.objects.filter(
+            created__lt=timezone.now() - timedelta(
+                seconds=settings.RECIPIENT_SET_EXPIRY_SECONDS
+            )
+        ).exclude(campaigns__state__in=['pending', 'running', 'failed'])
+
+    @classmethod
+    def from_selection(cls, user, user_ids):
+        recipient_set = cls.objects.create(created_by=user)
+        recipient_set.selected_users.set(
+            User.objects.filter(id__in=user_ids).values_list('id', flat=True)
+        )
+        return recipient_set
+
+    @classmethod
+    def from_entries_filter(cls, user, cat_filter, status_filter):
+        return cls.objects.create(
+            created_by=user, from_filter=True,
+            entry_year=settings.CURRENT_ENTRY_YEAR,
+            category=cat_filter or 'all', status=status_filter or 'all_excl'
+        )
+
+    def get_users(self):
+        if self.from_filter:
+            entries = filter_entries(
+                Entry.objects.filter(entry_year=self.entry_year),
+                self.category, self.status
+            )
+            return User.objects.filter(id__in=entries.values('user_id'))
+        return self.selected_users.all()
+
+    def user_batches(self, batch_size):
+        """
+        Yield the recipients' (id, email) in lists of up to batch_size,
+        reading one batch at a time
+        """
+        users = self.get_users().order_by('id')
+        last_id = 0
+        while True:
+            batch = list(
+                users.filter(id__gt=last_id)
+                .values_list('id', 'email')[:batch_size]
+            )
+            if not batch:
+                return
+            last_id = batch[-1][0]
+            yield batch
+
+    def email_batches(self, batch_size):
+        """
+        Yield the recipients' email addresses in lists of up to batch_size
+        """
+        for batch in self.user_batches(batch_size):
+            yield [email for _, email in batch]
+
+
+EMAIL_CAMPAIGN_STATES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+
+class EmailCampaign(models.Model):
+    """
+    A bulk email to a set of recipients.  Campaigns are sent outside the
+    request by the send_email_campaigns management command.
+
+    The recipients are copied to CampaignRecipient when sending starts, and
+    marked as sent as each email completes, so a failed or interrupted
+    campaign can be resumed without emailing anyone twice.
+    """
+    created_by = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    # cleared when the recipient set expires, once the campaign is done
+    recipient_set = models.ForeignKey(
+        RecipientSet, null=True, on_delete=models.SET_NULL,
+        related_name='campaigns'
+    )
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    from_address = models.EmailField()
+    cc = models.BooleanField(default=False)
+    # scheme and host of the site the campaign was created from, for links in
+    # the email templates
+    host = models.CharField(max_length=255, blank=True)
+    state = models.CharField(
+        choices=EMAIL_CAMPAIGN_STATES, default='pending', max_length=10
+    )
+    created = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    completed = models.DateTimeField(null=True, blank=True)
+    recipient_count = models.PositiveIntegerField(default=0)
+    email_count = models.PositiveIntegerField(default=0)
+    sent_emails = models.PositiveIntegerField(default=0)
+    failed_emails = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # when recipients were last marked as sent
+    checkpointed = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Email {} - {} ({})'.format(self.id, self.subject, self.state)
+
+    def add_recipients(self, batch_size):
+        """
+        Copy the recipient set's users to the campaign, if this hasn't
+        already been done.  The copy is all or nothing, so a campaign that
+        stopped part way through copying is copied again when resumed.
+        """
+        if self.recipients.exists():
+            return
+        with transaction.atomic():
+            for batch in self.recipient_set.user_batches(batch_size):
+                CampaignRecipient.objects.bulk_create([
+                    CampaignRecipient(
+                        campaign=self, user_id=user_id, email=email
+                    ) for user_id, email in batch
+                ])
+
+    def unsent_batches(self, batch_size):
+        """
+        Yield (id, email) for the recipients who haven't been emailed yet,
+        in lists of up to batch_size
+        """
+        recipients = self.recipients.exclude(state='sent').order_by('id')
+        last_id = 0
+        while True:
+            batch = list(
+                recipients.filter(id__gt=last_id)
+                .values_list('id', 'email')[:batch_size]
+            )
+            if not batch:
+                return
+            last_id = batch[-1][0]
+            yield batch
+
+    @property
+    def can_resume(self):
+        """
+        Failed campaigns can be resumed, as can running campaigns that have
+        made no progress for settings.EMAIL_CAMPAIGN_STALE_SECONDS (i.e. the
+        process sending them has stopped)
+        """
+        if self.state == 'failed':
+            return True
+        if self.state == 'running':
+            last_progress = self.checkpointed or self.started or self.created
+            return last_progress < timezone.now() - timedelta(
+                seconds=settings.EMAIL_CAMPAIGN_STALE_SECONDS
+            )
+        return False
+
+    def resume(self):
+        """
+        Queue the campaign to send to its remaining recipients; returns
+        False if it can't be resumed
+        """
+        if not self.can_resume:
+            return False
+        # only if nothing has happened since this copy was loaded; a claim
+        # or checkpoint changes started or checkpointed
+        resumed = EmailCampaign.objects.filter(
+            id=self.id, state=self.state, started=self.started,
+            checkpointed=self.checkpointed
+        ).update(state='pending', error='')
+        if resumed:
+            self.state = 'pending'
+            self.error = ''
+        return bool(resumed)
+
+
+CAMPAIGN_RECIPIENT_STATES = (
+    ('pending', 'Pending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
+
+
+class CampaignRecipient(models.Model):
+    campaign = models.ForeignKey(
+        EmailCampaign, on_delete=models.CASCADE, related_name='recipients'
+    )
+    user = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='+'
+    )
+    email = models.EmailField()
+    state = models.CharField(
+        choices=CAMPAIGN_RECIPIENT_STATES, default='pending', max_length=10
+    )
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = ('campaign', 'state')
+
+    def __str__(self):
+        return '{} - {} ({})'.format(self.campaign_id, self.email, self.state)
@@ -0,0 +1,90 @@
+"""
+Spreadsheet writers for exporting entry data
+
+A writer is created with the file-like object the workbook will be saved to.
+Sheets are added and their rows written in order, then close() finishes the
+workbook.  Column widths are given in xlwt units (1/256 of the width of a
+character).
+"""
+import xlsxwriter
+import xlwt
+
+
+class XlsSpreadsheetWriter(object):
+    """
+    Legacy Excel 97-2003 format.  The whole workbook is held in memory until
+    it is saved, and each sheet is limited to 65,536 rows.
+    """
+    extension = 'xls'
+    content_type = 'application/ms-excel'
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.workbook = xlwt.Workbook(encoding='utf-8')
+        self.header_style = xlwt.XFStyle()
+        self.header_style.alignment.wrap = 1
+        self.header_style.font.bold = True
+        self.row_style = xlwt.XFStyle()
+        self.row_style.alignment.wrap = 1
+        self.worksheet = None
+        self.row_num = 0
+
+    def add_sheet(self, name, columns):
+        self.worksheet = self.workbook.add_sheet(name)
+        self.row_num = 0
+        for col_num, (header, width) in enumerate(columns):
+            self.worksheet.write(0, col_num, header, self.header_style)
+            self.worksheet.col(col_num).width = width
+
+    def write_row(self, row):
+        self.row_num += 1
+        for col_num, value in enumerate(row):
+            self.worksheet.write(self.row_num, col_num, value, self.row_style)
+
+    def close(self):
+        self.workbook.save(self.fileobj)
+
+
+class XlsxSpreadsheetWriter(object):
+    """
+    Excel 2007+ format, written with XlsxWriter's constant_memory mode: each
+    row is flushed to a temporary file once the next row is started, so
+    memory use does not grow with the number of rows exported.  Rows must be
+    written in order.
+    """
+    extension = 'xlsx'
+    content_type = \
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    def __init__(self, fileobj):
+        self.workbook = xlsxwriter.Workbook(
+            fileobj, {'constant_memory': True}
+        )
+        self.header_style = self.workbook.add_format(
+            {'bold': True, 'text_wrap': True}
+        )
+        self.row_style = self.workbook.add_format({'text_wrap': True})
+        self.worksheet = None
+        self.row_num = 0
+
+    def add_sheet(self, name, columns):
+        self.worksheet = self.workbook.add_worksheet(name)
+        self.row_num = 0
+        for col_num, (header, width) in enumerate(columns):
+            self.worksheet.set_column(col_num, col_num, width / 256)
+        self.worksheet.write_row(
+            0, 0, [header for header, _ in columns], self.header_style
+        )
+
+    def write_row(self, row):
+        self.row_num += 1
+        self.worksheet.write_row(self.row_num, 0, row, self.row_style)
+
+    def close(self):
+        self.workbook.close()
+
+
+SPREADSHEET_WRITERS = {
+    writer.extension: writer
+    for writer in [XlsxSpreadsheetWriter, XlsSpreadsheetWriter]
+}
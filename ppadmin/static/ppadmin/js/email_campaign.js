@@ -0,0 +1,31 @@
+/*
+  Poll the email campaign status until all emails have been sent.
+*/
+var POLL_INTERVAL_MILLS = 3000;
+
+var pollEmailCampaign = function() {
+    var $state = $('#email-campaign-state');
+    if (['pending', 'running'].indexOf($state.data('state')) === -1) {
+        return;
+    }
+    $.getJSON($state.data('status-url'), function(result) {
+        $state.data('state', result.state);
+        if (result.state === 'done') {
+            $state.text('Sent ' + result.sent_emails + ' of ' + result.email_count + ' emails.');
+        } else if (result.state === 'failed') {
+            $state.text(
+                'Sent ' + result.sent_emails + ' of ' + result.email_count +
+                ' emails; there was a problem sending ' + result.failed_emails + '.'
+            );
+        } else {
+            if (result.state === 'running') {
+                $state.text('Sending: ' + result.sent_emails + ' of ' + result.email_count + ' emails sent.');
+            }
+            setTimeout(pollEmailCampaign, POLL_INTERVAL_MILLS);
+        }
+    });
+};
+
+$(document).ready(function() {
+    setTimeout(pollEmailCampaign, POLL_INTERVAL_MILLS);
+});
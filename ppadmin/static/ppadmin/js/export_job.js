@@ -0,0 +1,26 @@
+/*
+  Poll the export job status until the export file is ready to download.
+*/
+var POLL_INTERVAL_MILLS = 3000;
+
+var pollExportJob = function() {
+    var $state = $('#export-job-state');
+    if (['pending', 'running'].indexOf($state.data('state')) === -1) {
+        return;
+    }
+    $.getJSON($state.data('status-url'), function(result) {
+        $state.data('state', result.state);
+        if (result.state === 'done') {
+            $state.text('Your export is ready.');
+            $('#export-job-download').attr('href', result.download_url).removeClass('hide');
+        } else if (result.state === 'failed') {
+            $state.text('There was a problem generating this export; please try again.');
+        } else {
+            setTimeout(pollExportJob, POLL_INTERVAL_MILLS);
+        }
+    });
+};
+
+$(document).ready(function() {
+    setTimeout(pollExportJob, POLL_INTERVAL_MILLS);
+});
@@ -0,0 +1,328 @@
+from io import StringIO
+from unittest.mock import patch
+
+from model_bakery import baker
+
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from ppadmin.bulk_email import BulkEmailSender, RateLimiter
+from activitylog.models import ActivityLog
+from ppadmin.models import CampaignRecipient, EmailCampaign, RecipientSet
+
+
+class RateLimiterTests(SimpleTestCase):
+
+    @patch('ppadmin.bulk_email.time.sleep')
+    @patch('ppadmin.bulk_email.time.monotonic')
+    def test_calls_are_spaced_out(self, mock_monotonic, mock_sleep):
+        mock_monotonic.return_value = 100
+        limiter = RateLimiter(30)
+        for _ in range(3):
+            limiter.wait()
+        # 30 per minute: the first goes immediately, then one every 2 seconds
+        self.assertEqual(
+            [call[0][0] for call in mock_sleep.call_args_list], [2, 4]
+        )
+
+    @patch('ppadmin.bulk_email.time.sleep')
+    def test_no_limit(self, mock_sleep):
+        limiter = RateLimiter(0)
+        for _ in range(3):
+            limiter.wait()
+        mock_sleep.assert_not_called()
+
+
+@override_settings(BULK_EMAIL_MESSAGES_PER_MINUTE=0)
+class BulkEmailSenderTests(SimpleTestCase):
+
+    def sender(self, **kwargs):
+        return BulkEmailSender(
+            'Subject', 'Message', '<p>Message</p>', 'from@test.com',
+            reply_to=['from@test.com'], first_cc=['from@test.com'], **kwargs
+        )
+
+    def test_send(self):
+        progress = []
+        sender = self.sender(
+            on_chunk_sent=lambda index, ok: progress.append((index, ok))
+        )
+        chunks = [
+            ['{}_{}@test.com'.format(i, j) for j in range(3)]
+            for i in range(5)
+        ]
+        self.assertEqual(sender.send(chunks), (5, 0))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(
+            sorted(email.bcc for email in mail.outbox), sorted(chunks)
+        )
+        self.assertEqual(
+            [email.cc for email in mail.outbox].count(['from@test.com']), 1
+        )
+        self.assertEqual(
+            sorted(progress), [(index, True) for index in range(5)]
+        )
+
+    def test_chunks_read_as_workers_are_ready(self):
+        progress = []
+        in_flight = []
+
+        def chunks():
+            for i in range(20):
+                # chunks read but not yet sent
+                in_flight.append(i - len(progress))
+                yield ['{}@test.com'.format(i)]
+
+        sender = self.sender(
+            workers=2,
+            on_chunk_sent=lambda index, ok: progress.append((index, ok))
+        )
+        self.assertEqual(sender.send(chunks()), (20, 0))
+        self.assertLessEqual(max(in_flight), 4)
+
+    @patch('ppadmin.bulk_email.get_connection')
+    def test_connections_reused_by_each_thread(self, mock_get_connection):
+        mock_get_connection.return_value.send_messages.return_value = 1
+        sender = self.sender(workers=2)
+        sender.send([['{}@test.com'.format(i)] for i in range(10)])
+        # at most one connection per worker thread, all closed at the end
+        self.assertLessEqual(mock_get_connection.call_count, 2)
+        self.assertEqual(
+            mock_get_connection.return_value.send_messages.call_count, 10
+        )
+        self.assertEqual(
+            mock_get_connection.return_value.close.call_count,
+            mock_get_connection.call_count
+        )
+
+    @patch('ppadmin.bulk_email.EmailMultiAlternatives.send')
+    def test_failed_chunks_counted(self, mock_send):
+        mock_send.side_effect = [1, Exception('Error sending email'), 1]
+        sender = self.sender(workers=1)
+        self.assertEqual(
+            sender.send([['a@test.com'], ['b@test.com'], ['c@test.com']]),
+            (2, 1)
+        )
+
+
+@override_settings(BULK_EMAIL_MESSAGES_PER_MINUTE=0)
+class SendEmailCampaignsTests(TestCase):
+
+    def setUp(self):
+        self.users = baker.make(User, email='user@test.com', _quantity=3)
+        self.recipient_set = RecipientSet.from_selection(
+            None, [user.id for user in self.users]
+        )
+
+    def test_sends_pending_campaigns_only(self):
+        pending = baker.make(
+            EmailCampaign, recipient_set=self.recipient_set,
+            from_address='from@test.com', subject='Pending'
+        )
+        baker.make(
+            EmailCampaign, recipient_set=self.recipient_set,
+            from_address='from@test.com', subject='Running', state='running'
+        )
+        output = StringIO()
+        call_command('send_email_campaigns', stdout=output)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Pending')
+        self.assertEqual(len(mail.outbox[0].bcc), 3)
+        pending.refresh_from_db()
+        self.assertEqual(pending.state, 'done')
+        self.assertIsNotNone(pending.completed)
+        self.assertIn(
+            'Email campaign {}: done (1 of 1 emails sent)'.format(pending.id),
+            output.getvalue()
+        )
+
+        # already sent
+        call_command('send_email_campaigns', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+    def test_expired_recipient_sets_deleted(self):
+        old = timezone.now() - timedelta(days=8)
+        done = baker.make(
+            EmailCampaign, recipient_set=self.recipient_set, state='done'
+        )
+        failed_set = RecipientSet.from_selection(None, [self.users[0].id])
+        baker.make(EmailCampaign, recipient_set=failed_set, state='failed')
+        unused_set = RecipientSet.from_selection(None, [self.users[0].id])
+        recent_set = RecipientSet.from_selection(None, [self.users[0].id])
+        RecipientSet.objects.exclude(id=recent_set.id).update(created=old)
+
+        output = StringIO()
+        call_command('send_email_campaigns', stdout=output)
+        self.assertIn('2 recipient sets deleted', output.getvalue())
+        # sets are kept while their campaign can still be resumed
+        self.assertEqual(
+            sorted(RecipientSet.objects.values_list('id', flat=True)),
+            [failed_set.id, recent_set.id]
+        )
+        self.assertFalse(RecipientSet.objects.filter(id=unused_set.id).exists())
+        done.refresh_from_db()
+        self.assertIsNone(done.recipient_set)
+
+
+@override_settings(
+    BULK_EMAIL_MESSAGES_PER_MINUTE=0, BULK_EMAIL_WORKERS=1,
+    BULK_EMAIL_BATCH_SIZE=2
+)
+class ResumeEmailCampaignTests(TestCase):
+
+    def setUp(self):
+        self.users = [
+            baker.make(User, email='user{}@test.com'.format(i))
+            for i in range(5)
+        ]
+        self.campaign = baker.make(
+            EmailCampaign,
+            recipient_set=RecipientSet.from_selection(
+                None, [user.id for user in self.users]
+            ),
+            from_address='from@test.com', subject='Test', cc=True
+        )
+
+    def send_campaigns(self):
+        call_command('send_email_campaigns', stdout=StringIO())
+        self.campaign.refresh_from_db()
+
+    @patch('ppadmin.bulk_email.EmailMultiAlternatives.send')
+    def test_resume_sends_to_remaining_recipients_only(self, mock_send):
+        # 3 emails of 2, 2 and 1 recipients; the second one fails
+        mock_send.side_effect = [1, Exception('Error sending email'), 1]
+        self.send_campaigns()
+        self.assertEqual(self.campaign.state, 'failed')
+        self.assertEqual(self.campaign.sent_emails, 2)
+        self.assertEqual(self.campaign.failed_emails, 1)
+        self.assertEqual(
+            list(
+                self.campaign.recipients.order_by('id')
+                .values_list('state', flat=True)
+            ),
+            ['sent', 'sent', 'failed', 'failed', 'sent']
+        )
+        self.assertTrue(self.campaign.can_resume)
+
+        mock_send.reset_mock(side_effect=True)
+        mock_send.return_value = 1
+        self.assertTrue(self.campaign.resume())
+        self.send_campaigns()
+
+        # only the failed email is sent again, without the cc
+        self.assertEqual(mock_send.call_count, 1)
+        self.assertEqual(self.campaign.state, 'done')
+        self.assertEqual(self.campaign.sent_emails, 3)
+        self.assertEqual(self.campaign.email_count, 3)
+        self.assertEqual(self.campaign.failed_emails, 0)
+        self.assertFalse(
+            self.campaign.recipients.exclude(state='sent').exists()
+        )
+        self.assertEqual(
+            ActivityLog.objects.latest('id').log,
+            'Bulk email {} with subject "Test" by admin user - (resumed): 3 '
+            'of 3 emails sent to 5 users'.format(self.campaign.id)
+        )
+
+    def test_resumed_campaign_emails_unsent_recipients(self):
+        # recipients were copied and the first email sent before the process
+        # sending the campaign stopped
+        self.campaign.add_recipients(2)
+        self.campaign.recipients.filter(
+            email__in=['user0@test.com', 'user1@test.com']
+        ).update(state='sent')
+        EmailCampaign.objects.filter(id=self.campaign.id).update(
+            state='running', sent_emails=1,
+            checkpointed=timezone.now() - timedelta(hours=1)
+        )
+        self.send_campaigns()
+
+        self.assertEqual(self.campaign.state, 'done')
+        self.assertEqual(
+            sorted(email for msg in mail.outbox for email in msg.bcc),
+            ['user2@test.com', 'user3@test.com', 'user4@test.com']
+        )
+        self.assertEqual(
+            [msg.cc for msg in mail.outbox], [[], []]
+        )
+        # recipients aren't copied again
+        self.assertEqual(CampaignRecipient.objects.count(), 5)
+
+    def test_can_resume(self):
+        self.assertFalse(self.campaign.can_resume)  # pending
+        self.campaign.state = 'done'
+        self.assertFalse(self.campaign.can_resume)
+        self.campaign.state = 'failed'
+        self.assertTrue(self.campaign.can_resume)
+
+        # running campaigns can only be resumed once they've stopped
+        # making progress
+        self.campaign.state = 'running'
+        self.campaign.checkpointed = timezone.now() - timedelta(seconds=60)
+        self.assertFalse(self.campaign.can_resume)
+        self.assertFalse(self.campaign.resume())
+        self.campaign.checkpointed = timezone.now() - timedelta(hours=1)
+        self.assertTrue(self.campaign.can_resume)
+
+    def test_stale_copy_cannot_resume_claimed_campaign(self):
+        EmailCampaign.objects.filter(id=self.campaign.id).update(
+            state='running', started=timezone.now() - timedelta(hours=2),
+            checkpointed=timezone.now() - timedelta(hours=1)
+        )
+        # another worker loaded the stopped campaign, and is about to resume
+        # it
+        stale_campaign = EmailCampaign.objects.get(id=self.campaign.id)
+        resumed_while_sending = []
+
+        def send_campaign(campaign):
+            resumed_while_sending.append(stale_campaign.resume())
+            campaign.state = 'done'
+            campaign.save()
+
+        with patch(
+            'ppadmin.management.commands.send_email_campaigns.send_campaign',
+            side_effect=send_campaign
+        ):
+            # this worker resumes and claims it
+            self.send_campaigns()
+        self.assertEqual(resumed_while_sending, [False])
+        self.assertEqual(self.campaign.state, 'done')
+
+    def test_interrupted_recipient_copy_is_redone(self):
+        bulk_create = CampaignRecipient.objects.bulk_create
+        calls = []
+
+        def stop_after_first_batch(objs):
+            calls.append(objs)
+            if len(calls) > 1:
+                raise Exception('Worker stopped')
+            return bulk_create(objs)
+
+        with patch.object(
+            CampaignRecipient.objects, 'bulk_create',
+            side_effect=stop_after_first_batch
+        ):
+            with self.assertRaises(Exception):
+                self.campaign.add_recipients(2)
+        # the first batch isn't kept
+        self.assertFalse(self.campaign.recipients.exists())
+
+        self.campaign.add_recipients(2)
+        self.assertEqual(self.campaign.recipients.count(), 5)
+
+    def test_recipients_fixed_when_sending_starts(self):
+        call_command('send_email_campaigns', stdout=StringIO())
+        new_user = baker.make(User, email='new@test.com')
+        self.campaign.recipient_set.selected_users.add(new_user)
+        self.campaign.add_recipients(2)
+        self.assertFalse(
+            self.campaign.recipients.filter(email='new@test.com').exists()
+        )
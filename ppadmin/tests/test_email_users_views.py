@@ -1,15 +1,20 @@
+from io import StringIO
 from unittest.mock import patch
 from model_bakery import baker
 
 from django.urls import reverse
 from django.core import mail
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import Group, User
 
 from .helpers import TestSetupStaffLoginRequiredMixin
 from activitylog.models import ActivityLog
+from entries.models import Entry
+from ppadmin.models import EmailCampaign, RecipientSet
 
 
+@override_settings(BULK_EMAIL_MESSAGES_PER_MINUTE=0)
 class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
 
     @classmethod
@@ -25,14 +30,13 @@ class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
                 email='Test{}@testuser.com'.format(i)
             )
 
-    def user_dict(self, user):
-        return {
-                'id': user.id,
-                'email': user.email,
-                'fullname': '{} {} ({})'.format(
-                    user.first_name, user.last_name, user.username
-                )
-            }
+    def send_campaigns(self):
+        call_command('send_email_campaigns', stdout=StringIO())
+
+    def recipients(self, users):
+        return RecipientSet.from_selection(
+            self.staff_user, [user.id for user in users]
+        ).token
 
     def test_users_in_context_on_post_from_entries_list(self):
         """
@@ -56,9 +60,98 @@ class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
         )
         self.assertEqual(len(resp.context_data['users_to_email']), 12)
         self.assertIsInstance(resp.context_data['users_to_email'][0], dict)
+        self.assertEqual(resp.context_data['recipient_count'], 12)
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(len(mail.outbox), 0)
 
+        # the selection is stored and referenced by token in the form
+        recipient_set = resp.context_data['recipient_set']
+        self.assertEqual(recipient_set.selected_users.count(), 12)
+        self.assertIn(
+            'name="recipients" value="{}"'.format(recipient_set.token),
+            resp.rendered_content
+        )
+
+    def test_post_filtered_entries_from_entries_list(self):
+        """
+        'email_filtered' stores the entries filter rather than a list of users;
+        users are found when the email is sent
+        """
+        users = User.objects.filter(first_name__startswith='Test')
+        baker.make(Entry, user=users[0], category='BEG', status='submitted')
+        baker.make(Entry, user=users[1], category='BEG', status='selected')
+        baker.make(Entry, user=users[2], category='INT', status='submitted')
+        baker.make(Entry, user=users[3], category='BEG', status='in_progress')
+        self.client.login(
+            username=self.staff_user.username, password='test'
+        )
+        resp = self.client.post(
+            self.url,
+            {
+                'cat_filter': 'BEG', 'status_filter': 'all_excl',
+                'email_filtered': ['Email all (filtered)']
+            }
+        )
+        recipient_set = resp.context_data['recipient_set']
+        self.assertTrue(recipient_set.from_filter)
+        self.assertEqual(recipient_set.selected_users.count(), 0)
+        self.assertEqual(resp.context_data['recipient_count'], 2)
+
+        resp = self.client.post(
+            self.url, {
+                'subject': 'Test email',
+                'message': 'Test message',
+                'from_address': 'test@test.com',
+                'recipients': recipient_set.token
+            }
+        )
+        self.send_campaigns()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            sorted(mail.outbox[0].bcc), sorted([users[0].email, users[1].email])
+        )
+
+    def test_unknown_recipients_token(self):
+        self.client.login(
+            username=self.staff_user.username, password='test'
+        )
+        resp = self.client.post(
+            self.url, {
+                'subject': 'Test email',
+                'message': 'Test message',
+                'from_address': 'test@test.com',
+                'recipients': 'unknown'
+            }
+        )
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_emails_sent_in_batches(self):
+        """
+        Recipients are read and emailed in batches of 99 bcc addresses
+        """
+        baker.make(User, email='user@test.com', _quantity=100)
+        self.client.login(
+            username=self.staff_user.username, password='test'
+        )
+        self.client.post(
+            self.url, {
+                'subject': 'Test email',
+                'message': 'Test message',
+                'from_address': 'test@test.com',
+                'cc': True,
+                'recipients': self.recipients(User.objects.all())
+            }
+        )
+        self.send_campaigns()
+        self.assertEqual(len(mail.outbox), 2)
+        emails = sorted(mail.outbox, key=lambda email: len(email.bcc))
+        self.assertEqual(len(emails[0].bcc), 13)
+        self.assertEqual(len(emails[1].bcc), 99)
+        # only the first email is cc'd to the from address
+        self.assertEqual(emails[0].cc, [])
+        self.assertEqual(emails[1].cc, ['test@test.com'])
+
     def test_emails_sent(self):
         self.client.login(
             username=self.staff_user.username, password='test'
@@ -68,12 +161,19 @@ class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
                 'subject': 'Test email',
                 'message': 'Test message',
                 'from_address': 'test@test.com',
-                'users_to_email': str([
-                    self.user_dict(user) for user in User.objects.all()
-                ])
+                'recipients': self.recipients(User.objects.all())
             }
         )
+        campaign = EmailCampaign.objects.get()
+        self.assertEqual(resp.status_code, 302)
+        self.assertIn(
+            reverse('ppadmin:email_campaign', args=[campaign.id]), resp.url
+        )
+        # sent outside the request
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(campaign.state, 'pending')
 
+        self.send_campaigns()
         # 1 email, 12 bccs
         self.assertEqual(len(mail.outbox), 1)
         email = mail.outbox[0]
@@ -89,10 +189,18 @@ class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
             email.subject, 'Test email'
         )
 
-        self.assertEqual(resp.status_code, 302)
-        self.assertIn(reverse('ppadmin:entries'), resp.url)
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.state, 'done')
+        self.assertEqual(campaign.recipient_count, 12)
+        self.assertEqual(campaign.sent_emails, 1)
+        # one summary log for the campaign
+        self.assertEqual(
+            ActivityLog.objects.latest('id').log,
+            'Bulk email {} with subject "Test email" by admin user '
+            'staff_user: 1 of 1 emails sent to 12 users'.format(campaign.id)
+        )
 
-    @patch('entries.email_helpers.EmailMultiAlternatives.send')
+    @patch('ppadmin.bulk_email.EmailMultiAlternatives.send')
     def test_email_errors(self, mock_send):
         mock_send.side_effect = Exception('Error sending email')
         self.client.login(
@@ -103,19 +211,20 @@ class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
                 'subject': 'Test email2',
                 'message': 'Test message',
                 'from_address': 'test@test.com',
-                'users_to_email': str([
-                    self.user_dict(user) for user in
-                    User.objects.all()
-                ])
+                'recipients': self.recipients(User.objects.all())
             }
         )
+        self.send_campaigns()
         self.assertEqual(len(mail.outbox), 0)
+        campaign = EmailCampaign.objects.get()
+        self.assertEqual(campaign.state, 'failed')
+        self.assertEqual(campaign.failed_emails, 1)
         log = ActivityLog.objects.latest('id')
         self.assertEqual(
             log.log,
-            'There was a problem with at least one email in the bulk email with'
-            ' subject "Test email2"'.format(
-                self.staff_user.username
+            'Bulk email {} with subject "Test email2" by admin user '
+            'staff_user: 0 of 1 emails sent to 12 users; 1 failed'.format(
+                campaign.id
             )
         )
 
@@ -129,9 +238,10 @@ class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
                 'message': 'Test message',
                 'from_address': 'test@test.com',
                 'cc': True,
-                'users_to_email': str([self.user_dict(self.user)])
+                'recipients': self.recipients([self.user])
             }
         )
+        self.send_campaigns()
 
         self.assertEqual(len(mail.outbox), 1)
         email = mail.outbox[0]
@@ -146,12 +256,59 @@ class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
                 'subject': 'Test email',
                 'message': 'Test message',
                 'from_address': 'test@test.com',
-                'users_to_email': str([self.user_dict(self.user)])
+                'recipients': self.recipients([self.user])
             }
         )
+        self.send_campaigns()
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].reply_to[0], 'test@test.com')
 
+    def test_send_test_email(self):
+        """
+        Test emails are sent immediately, to the from address only
+        """
+        self.client.login(
+            username=self.staff_user.username, password='test'
+        )
+        resp = self.client.post(
+            self.url, {
+                'subject': 'Test email',
+                'message': 'Test message',
+                'from_address': 'test@test.com',
+                'recipients': self.recipients(User.objects.all()),
+                'send_test': 'Send Test Email'
+            }
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(EmailCampaign.objects.exists())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].bcc, ['test@test.com'])
+        self.assertEqual(mail.outbox[0].subject, 'Test email [TEST EMAIL]')
+        self.assertIn('bcc\'d to 12 users in 1 batch email', mail.outbox[0].body)
+
+    def test_campaign_status(self):
+        campaign = baker.make(
+            EmailCampaign, recipient_set=baker.make(RecipientSet),
+            state='running', email_count=5, sent_emails=2
+        )
+        self.client.login(
+            username=self.staff_user.username, password='test'
+        )
+        resp = self.client.get(
+            reverse('ppadmin:email_campaign_status', args=[campaign.id])
+        )
+        self.assertEqual(
+            resp.json(),
+            {
+                'state': 'running', 'email_count': 5, 'sent_emails': 2,
+                'failed_emails': 0
+            }
+        )
+        resp = self.client.get(
+            reverse('ppadmin:email_campaign', args=[campaign.id])
+        )
+        self.assertIn('2 of 5 emails sent', resp.rendered_content)
+
     def test_with_form_errors(self):
         self.client.login(
             username=self.staff_user.username, password='test'
@@ -160,9 +317,37 @@ class EmailUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
             self.url, {
                 'subject': 'Test email',
                 'message': 'Test message',
-                'users_to_email': str([self.user_dict(self.user)])
+                'recipients': self.recipients([self.user])
             }
         )
 
         self.assertEqual(len(mail.outbox), 0)
         self.assertIn('Please correct errors in form', resp.rendered_content)
+
+    def test_resume_campaign(self):
+        campaign = baker.make(
+            EmailCampaign, recipient_set=baker.make(RecipientSet),
+            state='failed', subject='Test'
+        )
+        self.client.login(
+            username=self.staff_user.username, password='test'
+        )
+        url = reverse('ppadmin:resume_email_campaign', args=[campaign.id])
+        resp = self.client.get(
+            reverse('ppadmin:email_campaign', args=[campaign.id])
+        )
+        self.assertIn(url, resp.rendered_content)
+
+        resp = self.client.post(url)
+        self.assertEqual(
+            resp.url, reverse('ppadmin:email_campaign', args=[campaign.id])
+        )
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.state, 'pending')
+
+        # pending campaigns can't be resumed
+        resp = self.client.post(url, follow=True)
+        self.assertIn(
+            'This email can&#x27;t be resumed; it is pending',
+            resp.rendered_content
+        )
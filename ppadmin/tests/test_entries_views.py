@@ -17,6 +17,41 @@ class EntryListViewTests(TestSetupStaffLoginRequiredMixin, TestCase):
         super(EntryListViewTests, cls).setUpTestData()
         cls.url = reverse('ppadmin:entries')
 
+    def test_etag(self):
+        entry = baker.make(Entry, status='submitted')
+        self.client.login(username=self.staff_user.username, password='test')
+        # the first response sets the csrf cookie, which the ETag depends on
+        self.client.get(self.url)
+        etag = self.client.get(self.url)['ETag']
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        # filters change the ETag
+        resp = self.client.get(
+            self.url, {'cat_filter': 'BEG'}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(resp.status_code, 200)
+
+        # changes to any entry change the ETag
+        entry.status = 'selected'
+        entry.save()
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_email_filtered_button(self):
+        """
+        'Email all (filtered)' emails the users matching the category and
+        status filters, so isn't shown when the list is filtered to one user
+        """
+        entry = baker.make(Entry, status='submitted')
+        self.client.login(username=self.staff_user.username, password='test')
+        resp = self.client.get(self.url)
+        self.assertIn('name="email_filtered"', resp.rendered_content)
+
+        resp = self.client.get(self.url, {'user': entry.user.id})
+        self.assertNotIn('name="email_filtered"', resp.rendered_content)
+        self.assertIn('name="email_selected"', resp.rendered_content)
+
     def test_default_entries_displayed(self):
         """
         Default view shows current year only; excludes in progress and withdrawn
@@ -631,3 +666,24 @@ class NotifyUsersTests(TestSetupStaffLoginRequiredMixin, TestCase):
             resp.rendered_content
         )
 
+
+
+class EntryStatsDisplayTests(TestSetupStaffLoginRequiredMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super(EntryStatsDisplayTests, cls).setUpTestData()
+        cls.url = reverse('ppadmin:entries_selection')
+
+    def test_entry_stats_in_context(self):
+        baker.make(Entry, category='BEG', status='submitted', _quantity=2)
+        baker.make(Entry, category='INT', status='selected')
+        self.client.login(username=self.staff_user.username, password='test')
+        for url in [self.url, reverse('ppadmin:entries')]:
+            resp = self.client.get(url)
+            stats = dict(resp.context_data['entry_stats']['categories'])
+            self.assertEqual(stats['BEG']['submitted'], 2)
+            self.assertEqual(stats['INT']['selected'], 1)
+            self.assertEqual(
+                resp.context_data['entry_stats']['totals']['submitted'], 3
+            )
@@ -1,21 +1,46 @@
 import os
+import re
+import tempfile
 import xlrd
-from datetime import datetime
+import zipfile
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
 from model_bakery import baker
 
+from django.conf import settings
 from django.contrib.auth.models import Group, User
 from django.core import management
 from django.core.cache import cache
 from django.urls import reverse
+from django.db import connection
 from django.db.models import Q
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from accounts.models import OnlineDisclaimer
 from activitylog.models import ActivityLog
 from .helpers import format_content, TestSetupStaffLoginRequiredMixin
+from ..models import ExportJob
 from ..utils import int_str, chaffify
 from ..views.user_views import NAME_FILTERS
+from accounts.user_directory import first_letter_counts
+
+
+class CacheMetricsViewTests(TestSetupStaffLoginRequiredMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.url = reverse('ppadmin:cache_metrics')
+
+    def test_cache_metrics(self):
+        self.client.login(username=self.staff_user.username, password='test')
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('hits', resp.json())
+        self.assertIn('misses', resp.json())
 
 
 class ActivityLogListViewTests(TestSetupStaffLoginRequiredMixin, TestCase):
@@ -173,6 +198,11 @@ class UserListViewTests(TestSetupStaffLoginRequiredMixin, TestCase):
         super(UserListViewTests, cls).setUpTestData()
         cls.url = reverse('ppadmin:users')
 
+    def setUp(self):
+        super(UserListViewTests, self).setUp()
+        # first letter counts are cached
+        cache.clear()
+
     def test_all_users_are_displayed(self):
         baker.make(User, _quantity=6)
         # 8 users total, incl self.user, self.staff_user
@@ -324,6 +354,56 @@ class UserListViewTests(TestSetupStaffLoginRequiredMixin, TestCase):
             else:
                 self.assertFalse(opt['available'])
 
+    def test_filter_options_for_search(self):
+        self.client.login(username=self.staff_user.username, password='test')
+        baker.make(User, first_name='Anna', last_name='Smith')
+        baker.make(User, first_name='Bob', last_name='Smith')
+        baker.make(User, first_name='Bill', last_name='Jones')
+        resp = self.client.get(
+            self.url, {'search_submitted': 'Search', 'search': 'smith'}
+        )
+        options = {
+            opt['value']: opt for opt in resp.context_data['filter_options']
+        }
+        self.assertEqual(options['A']['count'], 1)
+        self.assertEqual(options['B']['count'], 1)
+        self.assertFalse(options['C']['available'])
+        self.assertEqual(resp.context_data['num_results'], 2)
+        self.assertEqual(
+            resp.context_data['total_users'], User.objects.count()
+        )
+
+    def test_letter_counts_cached(self):
+        self.client.login(username=self.staff_user.username, password='test')
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            counts = first_letter_counts()
+
+        # updated when a user is added
+        baker.make(User, first_name='Zed')
+        resp = self.client.get(self.url)
+        options = {
+            opt['value']: opt for opt in resp.context_data['filter_options']
+        }
+        self.assertTrue(options['Z']['available'])
+        self.assertEqual(
+            resp.context_data['total_users'], sum(counts.values()) + 1
+        )
+
+    def test_queries_independent_of_user_count(self):
+        self.client.login(username=self.staff_user.username, password='test')
+
+        def page_queries():
+            # the second load, once each user's waiver status is cached
+            self.client.get(self.url)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(self.url)
+            return len(queries)
+
+        initial_queries = page_queries()
+        baker.make(User, _quantity=40)
+        self.assertEqual(page_queries(), initial_queries)
+
 
 class UserDisclaimerViewTests(TestSetupStaffLoginRequiredMixin, TestCase):
     @classmethod
@@ -439,6 +519,7 @@ class DisclaimerDeleteViewTests(TestSetupStaffLoginRequiredMixin,
         self.assertEqual(OnlineDisclaimer.objects.count(), 0)
 
 
+@override_settings(EXPORT_JOBS_ROOT=tempfile.mkdtemp())
 class ExportEntriesView(TestSetupStaffLoginRequiredMixin, TestCase):
 
     @classmethod
@@ -446,6 +527,20 @@ class ExportEntriesView(TestSetupStaffLoginRequiredMixin, TestCase):
         super(ExportEntriesView, cls).setUpTestData()
         cls.url = reverse('ppadmin:export_entries')
 
+    def export(self, form_data):
+        """
+        Request an export, run the export worker and download the file
+        """
+        resp = self.client.post(self.url, data=form_data)
+        job = ExportJob.objects.latest('id')
+        self.assertEqual(
+            resp.url, reverse('ppadmin:export_job', args=[job.id])
+        )
+        management.call_command('process_export_jobs', stdout=StringIO())
+        return self.client.get(
+            reverse('ppadmin:export_job_download', args=[job.id])
+        )
+
     def test_no_entries(self):
         self.client.login(username=self.staff_user.username, password='test')
         form_data = {
@@ -485,13 +580,13 @@ class ExportEntriesView(TestSetupStaffLoginRequiredMixin, TestCase):
 
         # submitting from export button
         form_data.update({'export': True})
-        resp = self.client.post(self.url, data=form_data)
+        resp = self.export(form_data)
 
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp['Content-Type'], 'application/ms-excel')
         self.assertEqual(
             resp['Content-Disposition'],
-            'attachment; filename=competitors_all.xls'
+            'attachment; filename="competitors_all.xls"'
         )
 
     def test_file_content(self):
@@ -502,7 +597,7 @@ class ExportEntriesView(TestSetupStaffLoginRequiredMixin, TestCase):
             'include': ['name', 'pole_school', 'category'],
             'export': True
         }
-        resp = self.client.post(self.url, data=form_data)
+        resp = self.export(form_data)
 
         # test file content
         # Test data:
@@ -515,7 +610,7 @@ class ExportEntriesView(TestSetupStaffLoginRequiredMixin, TestCase):
         filename = os.path.join(curr_dir, "temp.xls")
 
         with open(filename, "wb") as f:
-            f.write(resp.content)
+            f.write(b''.join(resp.streaming_content))
         book = xlrd.open_workbook(filename)
 
         # 4 sheets, one per category
@@ -561,6 +656,40 @@ class ExportEntriesView(TestSetupStaffLoginRequiredMixin, TestCase):
 
         os.unlink(filename)
 
+    def test_xlsx_file_content(self):
+        self.client.login(username=self.staff_user.username, password='test')
+        management.call_command('setup_test_data')
+        form_data = {
+            'category': 'all', 'status': 'all',
+            'include': ['name', 'pole_school', 'category'],
+            'file_format': 'xlsx',
+            'export': True
+        }
+        resp = self.export(form_data)
+        self.assertEqual(
+            resp['Content-Type'],
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        self.assertEqual(
+            resp['Content-Disposition'],
+            'attachment; filename="competitors_all.xlsx"'
+        )
+
+        # xlsx files are zip archives of xml documents
+        book = zipfile.ZipFile(BytesIO(b''.join(resp.streaming_content)))
+        workbook_xml = book.read('xl/workbook.xml').decode()
+        sheet_names = re.findall(r'<sheet name="([^"]+)"', workbook_xml)
+        self.assertEqual(
+            sheet_names, ['Beginner', 'Intermediate', 'Advanced', 'Doubles']
+        )
+        beg = book.read('xl/worksheets/sheet1.xml').decode()
+        dou = book.read('xl/worksheets/sheet4.xml').decode()
+        self.assertEqual(beg.count('<row '), 4)  # header row + 3 data rows
+        for header in ['Name', 'Pole School', 'Category']:
+            self.assertIn('<t>{}</t>'.format(header), beg)
+        self.assertEqual(dou.count('<row '), 3)
+        self.assertIn('Sally Test &amp; Bob Test', dou)
+
     def test_submit_select_categories(self):
         self.client.login(username=self.staff_user.username, password='test')
         management.call_command('setup_test_data')
@@ -574,10 +703,154 @@ class ExportEntriesView(TestSetupStaffLoginRequiredMixin, TestCase):
 
         # submitting from export button
         form_data.update({'export': True})
-        resp = self.client.post(self.url, data=form_data)
+        resp = self.export(form_data)
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp['Content-Type'], 'application/ms-excel')
         self.assertEqual(
             resp['Content-Disposition'],
-            'attachment; filename=competitors_doubles.xls'
+            'attachment; filename="competitors_doubles.xls"'
+        )
+
+    def test_identical_export_requests_reuse_job(self):
+        self.client.login(username=self.staff_user.username, password='test')
+        management.call_command('setup_test_data')
+        form_data = {
+            'category': 'all', 'status': 'all', 'include': ['name'],
+            'file_format': 'xlsx', 'export': True
+        }
+        self.export(form_data)
+        self.client.post(self.url, data=form_data)
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+        # different columns create a new job
+        form_data['include'] = ['name', 'category']
+        self.client.post(self.url, data=form_data)
+        self.assertEqual(ExportJob.objects.count(), 2)
+
+        # completed jobs are not reused after the reuse window
+        ExportJob.objects.update(
+            completed=timezone.now() - timedelta(
+                seconds=settings.EXPORT_JOB_REUSE_SECONDS + 1
+            )
+        )
+        form_data['include'] = ['name']
+        self.export(form_data)
+        self.assertEqual(ExportJob.objects.count(), 3)
+
+    def test_stale_running_export_jobs(self):
+        """
+        A job left running by a worker that stopped isn't reused, and is
+        failed by the next process_export_jobs run
+        """
+        self.client.login(username=self.staff_user.username, password='test')
+        management.call_command('setup_test_data')
+        form_data = {
+            'category': 'all', 'status': 'all', 'include': ['name'],
+            'file_format': 'xlsx', 'export': True
+        }
+        self.client.post(self.url, data=form_data)
+        job = ExportJob.objects.get()
+        ExportJob.objects.update(
+            state='running',
+            started=timezone.now() - timedelta(
+                seconds=settings.EXPORT_JOB_STALE_SECONDS + 1
+            )
+        )
+        self.client.post(self.url, data=form_data)
+        self.assertEqual(ExportJob.objects.count(), 2)
+
+        management.call_command('process_export_jobs', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(ExportJob.objects.latest('id').state, 'done')
+
+    def test_export_job_failed_while_running_is_discarded(self):
+        self.client.login(username=self.staff_user.username, password='test')
+        management.call_command('setup_test_data')
+        self.client.post(
+            self.url, data={
+                'category': 'all', 'status': 'all', 'include': ['name'],
+                'file_format': 'xlsx', 'export': True
+            }
+        )
+        job = ExportJob.objects.get()
+
+        def write_export(*args):
+            # another run fails the job while this one is writing it
+            ExportJob.objects.filter(id=job.id).update(
+                state='failed', error='Export job stopped before it completed'
+            )
+
+        with patch(
+            'ppadmin.management.commands.process_export_jobs.write_export',
+            side_effect=write_export
+        ):
+            output = StringIO()
+            management.call_command('process_export_jobs', stdout=output)
+        self.assertIn(
+            'Export job {}: discarded'.format(job.id), output.getvalue()
+        )
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(job.filename, '')
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(
+                    settings.EXPORT_JOBS_ROOT, 'export_{}.xlsx'.format(job.id)
+                )
+            )
+        )
+
+    def test_export_job_status(self):
+        self.client.login(username=self.staff_user.username, password='test')
+        management.call_command('setup_test_data')
+        self.client.post(
+            self.url,
+            data={
+                'category': 'BEG', 'status': 'all', 'include': ['name'],
+                'export': True
+            }
+        )
+        job = ExportJob.objects.latest('id')
+        status_url = reverse('ppadmin:export_job_status', args=[job.id])
+        self.assertEqual(
+            self.client.get(status_url).json(),
+            {'state': 'pending', 'download_url': None}
+        )
+        # download not available until job is done
+        resp = self.client.get(
+            reverse('ppadmin:export_job_download', args=[job.id])
+        )
+        self.assertEqual(resp.status_code, 404)
+
+        management.call_command('process_export_jobs', stdout=StringIO())
+        self.assertEqual(
+            self.client.get(status_url).json(),
+            {
+                'state': 'done',
+                'download_url': reverse(
+                    'ppadmin:export_job_download', args=[job.id]
+                )
+            }
+        )
+
+    def test_expired_export_jobs_deleted(self):
+        self.client.login(username=self.staff_user.username, password='test')
+        management.call_command('setup_test_data')
+        self.export(
+            {
+                'category': 'BEG', 'status': 'all', 'include': ['name'],
+                'export': True
+            }
         )
+        job = ExportJob.objects.latest('id')
+        self.assertTrue(os.path.exists(job.filepath))
+        ExportJob.objects.update(
+            completed=timezone.now() - timedelta(
+                seconds=settings.EXPORT_JOB_EXPIRY_SECONDS + 1
+            )
+        )
+        management.call_command('process_export_jobs', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'expired')
+        self.assertFalse(os.path.exists(job.filepath))
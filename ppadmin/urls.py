@@ -5,13 +5,16 @@ from ppadmin.views import user_disclaimer, DisclaimerUpdateView, \
     UserListView, EntryListView, \
     EntryDetailView, EntryNotifiedListView, email_users_view, \
     EntrySelectionListView, toggle_selection, notified_selection_reset, \
-    notify_users, export_data, ExportFormView
+    notify_users, export_data, ExportFormView, ExportJobView, \
+    export_job_download, export_job_status, cache_metrics, \
+    email_campaign_view, email_campaign_status, resume_email_campaign
 
 
 app_name = 'ppadmin'
 
 
 urlpatterns = [
+    path('cache-metrics/', cache_metrics, name='cache_metrics'),
     path('users/', UserListView.as_view(), name="users"),
     path('users/<str:encoded_user_id>/disclaimer/',
         user_disclaimer,
@@ -62,6 +65,18 @@ urlpatterns = [
     path(
         'entries/export/excel/', export_data, name="entries_xls"
     ),
+    path(
+        'entries/export/<int:job_id>/', ExportJobView.as_view(),
+        name="export_job"
+    ),
+    path(
+        'entries/export/<int:job_id>/status/', export_job_status,
+        name="export_job_status"
+    ),
+    path(
+        'entries/export/<int:job_id>/download/', export_job_download,
+        name="export_job_download"
+    ),
     path(
         'entries/<str:ref>/', EntryDetailView.as_view(), name="entry"
     ),
@@ -71,6 +86,18 @@ urlpatterns = [
     path(
         'users/email-users/', email_users_view, name='email_users'
     ),
+    path(
+        'users/email-users/<int:campaign_id>/', email_campaign_view,
+        name='email_campaign'
+    ),
+    path(
+        'users/email-users/<int:campaign_id>/status/', email_campaign_status,
+        name='email_campaign_status'
+    ),
+    path(
+        'users/email-users/<int:campaign_id>/resume/', resume_email_campaign,
+        name='resume_email_campaign'
+    ),
     path('',
         RedirectView.as_view(url='/ppadmin/entries/', permanent=True)),
 ]
\ No newline at end of file
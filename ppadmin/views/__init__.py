@@ -1,18 +1,23 @@
 from .activitylog_views import ActivityLogListView
+from .cache_views import cache_metrics
 from .disclaimer_views import DisclaimerUpdateView, DisclaimerDeleteView, \
     user_disclaimer
-from .email_users_views import email_users_view
+from .email_users_views import email_campaign_status, email_campaign_view, \
+    email_users_view, resume_email_campaign
 from .user_views import UserListView
 from .entries_views import EntryDetailView, EntryListView, \
     EntrySelectionListView, EntryNotifiedListView, ExportFormView, \
-    export_data, \
+    ExportJobView, export_data, export_job_download, export_job_status, \
     notified_selection_reset, notify_users, toggle_selection
 
 __all__ = [
     'ActivityLogListView',
-    'email_users_view',
+    'cache_metrics',
+    'email_campaign_status', 'email_campaign_view', 'email_users_view',
+    'resume_email_campaign',
     'EntryDetailView', 'EntryListView', 'EntrySelectionListView',
     'EntryNotifiedListView', 'export_data', 'ExportFormView',
+    'ExportJobView', 'export_job_download', 'export_job_status',
     'DisclaimerDeleteView', 'DisclaimerUpdateView', 'user_disclaimer',
     'UserListView', 'toggle_selection', 'notified_selection_reset', 'notify_users',
 ]
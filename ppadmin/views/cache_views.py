@@ -0,0 +1,12 @@
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+
+from poleperformance.caching import get_metrics
+from ppadmin.views.helpers import staff_required
+
+
+@login_required
+@staff_required
+def cache_metrics(request):
+    # counts are for the process that handles the request
+    return JsonResponse(get_metrics())
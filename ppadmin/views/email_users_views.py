@@ -1,20 +1,22 @@
-import ast
 import logging
 
 from math import ceil
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import Group, User
 
 from django.contrib import messages
 from django.urls import reverse
 from django.template.response import TemplateResponse
-from django.shortcuts import HttpResponseRedirect
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, HttpResponseRedirect
 from django.utils.safestring import mark_safe
 
 from entries.email_helpers import send_pp_email
 
 from ..forms.email_users_forms import EmailUsersForm
+from ..models import EmailCampaign, RecipientSet
 from ..views.helpers import staff_required
 
 from activitylog.models import ActivityLog
@@ -23,38 +25,44 @@ from activitylog.models import ActivityLog
 logger = logging.getLogger(__name__)
 
 
+# number of users listed on the email form; the rest are only counted
+RECIPIENTS_PREVIEW_COUNT = 50
+
+
 @login_required
 @staff_required
 def email_users_view(
         request,
         template_name='ppadmin/email_users_form.html'
 ):
-    if 'users_to_email' in request.POST:  # posting a test email; already in
-        # dict form
-        users_to_email = ast.literal_eval(request.POST.get('users_to_email'))
+    new_recipients = 'email_selected' in request.POST or \
+        'email_filtered' in request.POST
+    if 'email_selected' in request.POST:
+        recipient_set = RecipientSet.from_selection(
+            request.user, request.POST.getlist('emailusers')
+        )
+    elif 'email_filtered' in request.POST:
+        recipient_set = RecipientSet.from_entries_filter(
+            request.user, request.POST.get('cat_filter'),
+            request.POST.get('status_filter')
+        )
+    elif request.POST.get('recipients'):
+        # posting a test email or sending; recipients were stored when the
+        # form was first shown
+        recipient_set = get_object_or_404(
+            RecipientSet, token=request.POST['recipients']
+        )
     else:
-        users = []
-        if 'email_selected' in request.POST:
-            users = User.objects.filter(id__in=request.POST.getlist('emailusers'))
-        users_to_email = [
-            {
-                'id': user.id,
-                'email': user.email,
-                'fullname': '{} {} ({})'.format(
-                    user.first_name, user.last_name, user.username
-                )
-            } for user in users
-        ]
+        recipient_set = None
 
     if request.method == 'POST':
-        if 'email_selected' in request.POST:
+        if new_recipients:
             form = EmailUsersForm()
         else:
             form = EmailUsersForm(request.POST)
             test_email = request.POST.get('send_test', False)
 
-            if form.is_valid():
-                prefix = ''
+            if form.is_valid() and recipient_set:
                 subject = '{}{}'.format(
                     form.cleaned_data['subject'],
                     ' [TEST EMAIL]' if test_email else ''
@@ -63,73 +71,48 @@ def email_users_view(
                 message = form.cleaned_data['message']
                 cc = form.cleaned_data['cc']
 
-                # bcc recipients
-                email_addresses = [user['email'] for user in users_to_email]
-                email_count = len(email_addresses)
-                number_of_emails = ceil(email_count / 99)
-
-                if test_email:
-                    email_lists = [[from_address]]
-                else:
-                    email_lists = [email_addresses]  # will be a list of lists
-                    # split into multiple emails of 99 bcc plus 1 cc
-                    if email_count > 99:
-                        email_lists = [
-                            email_addresses[i : i + 99]
-                            for i in range(0, email_count, 99)
-                            ]
-
-                for i, email_list in enumerate(email_lists):
-                    sent_ok = True
-                    ctx = {
-                              'subject': subject,
-                              'message': message,
-                              'number_of_emails': number_of_emails,
-                              'email_count': email_count,
-                              'is_test': test_email,
-                          }
-
-                    sent = send_pp_email(
-                        request, subject, ctx,
-                        'ppadmin/email/email_users.txt',
-                        'ppadmin/email/email_users.html',
-                        prefix=None,
-                        bcc_list=email_list,
-                        cc_list=[from_address] if i == 0 and not
-                        test_email else [],
-                        from_email=from_address,
-                        reply_to_list=[from_address]
-                    )
-
-                    if sent != 'OK':
-                        sent_ok = False
-
-                    if not test_email and sent_ok:
-                        ActivityLog.objects.create(
-                            log='Bulk email with subject "{}" sent to users '
-                                '{} by admin user {}'.format(
-                                subject, ', '.join(email_list),
-                                request.user.username
-                                )
-                        )
-                    if not sent_ok:
-                        ActivityLog.objects.create(
-                            log='There was a problem with at least one '
-                                'email in the bulk email with '
-                                'subject "{}"'.format(
-                                    subject, ', '.join(email_list),
-                                    request.user.username
-                                )
+                if not test_email:
+                    # sent in the background by send_email_campaigns
+                    campaign = EmailCampaign.objects.create(
+                        created_by=request.user,
+                        recipient_set=recipient_set,
+                        subject=subject,
+                        message=message,
+                        from_address=from_address,
+                        cc=cc,
+                        host='https://{}'.format(
+                            request.META.get('HTTP_HOST')
                         )
-
-                if not test_email and sent_ok:
+                    )
                     messages.success(
                         request,
-                        'Bulk email with subject "{}" has been sent to '
+                        'Bulk email with subject "{}" is being sent to '
                         'users'.format(subject)
                     )
-                    return HttpResponseRedirect(reverse('ppadmin:entries'))
-                else:
+                    return HttpResponseRedirect(
+                        reverse('ppadmin:email_campaign', args=[campaign.id])
+                    )
+
+                email_count = recipient_set.get_users().count()
+                ctx = {
+                    'subject': subject,
+                    'message': message,
+                    'number_of_emails': ceil(
+                        email_count / settings.BULK_EMAIL_BATCH_SIZE
+                    ),
+                    'email_count': email_count,
+                    'is_test': test_email,
+                }
+                sent = send_pp_email(
+                    request, subject, ctx,
+                    'ppadmin/email/email_users.txt',
+                    'ppadmin/email/email_users.html',
+                    prefix=None,
+                    bcc_list=[from_address],
+                    from_email=from_address,
+                    reply_to_list=[from_address]
+                )
+                if sent == 'OK':
                     messages.success(
                         request, 'Test email has been sent to {} only. Click '
                                  '"Send Email" below to send this email to '
@@ -137,6 +120,10 @@ def email_users_view(
                                     from_address
                                     )
                     )
+                else:
+                    messages.error(
+                        request, 'There was a problem sending the test email'
+                    )
 
             if form.errors:
                 messages.error(
@@ -149,9 +136,76 @@ def email_users_view(
     else:
         form = EmailUsersForm()
 
+    if recipient_set:
+        recipient_count = recipient_set.get_users().count()
+        users_to_email = [
+            {
+                'id': user.id,
+                'email': user.email,
+                'fullname': '{} {} ({})'.format(
+                    user.first_name, user.last_name, user.username
+                )
+            } for user in recipient_set.get_users()
+            .order_by('first_name', 'last_name')[:RECIPIENTS_PREVIEW_COUNT]
+        ]
+    else:
+        recipient_count = 0
+        users_to_email = []
+
     return TemplateResponse(
         request, template_name, {
             'form': form,
+            'recipient_set': recipient_set,
+            'recipient_count': recipient_count,
             'users_to_email': users_to_email,
         }
     )
+
+
+@login_required
+@staff_required
+def email_campaign_view(request, campaign_id):
+    campaign = get_object_or_404(EmailCampaign, id=campaign_id)
+    return TemplateResponse(
+        request, 'ppadmin/email_campaign.html', {'campaign': campaign}
+    )
+
+
+@login_required
+@staff_required
+def resume_email_campaign(request, campaign_id):
+    campaign = get_object_or_404(EmailCampaign, id=campaign_id)
+    if request.method == 'POST':
+        if campaign.resume():
+            messages.success(
+                request,
+                'Bulk email with subject "{}" will be sent to the remaining '
+                'users'.format(campaign.subject)
+            )
+            ActivityLog.objects.create(
+                log='Bulk email {} with subject "{}" resumed by admin user '
+                    '{}'.format(
+                        campaign.id, campaign.subject, request.user.username
+                    )
+            )
+        else:
+            messages.error(
+                request, 'This email can\'t be resumed; it is {}'.format(
+                    campaign.get_state_display().lower()
+                )
+            )
+    return HttpResponseRedirect(
+        reverse('ppadmin:email_campaign', args=[campaign.id])
+    )
+
+
+@login_required
+@staff_required
+def email_campaign_status(request, campaign_id):
+    campaign = get_object_or_404(EmailCampaign, id=campaign_id)
+    return JsonResponse({
+        'state': campaign.state,
+        'email_count': campaign.email_count,
+        'sent_emails': campaign.sent_emails,
+        'failed_emails': campaign.failed_emails,
+    })
@@ -1,16 +1,19 @@
 import logging
-import xlwt
+import tempfile
 
 from django.conf import settings
 
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.models import User
 from django.contrib import messages
 
 from django.urls import reverse
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import get_object_or_404, HttpResponse, \
     HttpResponseRedirect, render
 from django.template.response import TemplateResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic import DetailView, FormView, ListView
 
 from braces.views import LoginRequiredMixin
@@ -18,16 +21,22 @@ from braces.views import LoginRequiredMixin
 from ppadmin.forms import EntryFilterForm, EntrySelectionFilterForm, \
     ExportEntriesForm
 
+from ppadmin.models import ExportJob, filter_entries
+from ppadmin.spreadsheets import SPREADSHEET_WRITERS
 from ppadmin.views.helpers import staff_required, StaffUserMixin
 
 from activitylog.models import ActivityLog
 from entries.models import Entry, CATEGORY_CHOICES_DICT, STATUS_CHOICES_DICT
 from entries.email_helpers import send_pp_email
+from entries.utils import get_entry_stats, iter_by_category
+from entries.views_utils import entries_admin_etag
 
 
 logger = logging.getLogger(__name__)
 
 
+@method_decorator(cache_control(private=True, no_cache=True), name='get')
+@method_decorator(condition(etag_func=entries_admin_etag), name='get')
 class EntryListView(LoginRequiredMixin,  StaffUserMixin,  ListView):
 
     model = Entry
@@ -46,23 +55,10 @@ class EntryListView(LoginRequiredMixin,  StaffUserMixin,  ListView):
 
         if user_filter:
             queryset = queryset.filter(user__id=user_filter)
-        elif (status_filter == 'all_excl' and cat_filter == 'all') or \
-                reset:
-            # by default, exclude withdrawn and in progress
-            queryset = queryset.filter(withdrawn=False)\
-                .exclude(status='in_progress')
+        elif reset:
+            queryset = filter_entries(queryset)
         else:
-            if cat_filter and cat_filter != 'all':
-                queryset = queryset.filter(category=cat_filter)
-
-            if status_filter:
-                if status_filter == 'all_excl':
-                    queryset = queryset.filter(withdrawn=False)\
-                        .exclude(status='in_progress')
-                elif status_filter == 'withdrawn':
-                    queryset = queryset.filter(withdrawn=True)
-                elif status_filter != 'all':
-                    queryset = queryset.filter(status=status_filter)
+            queryset = filter_entries(queryset, cat_filter, status_filter)
 
         return queryset
 
@@ -84,6 +80,7 @@ class EntryListView(LoginRequiredMixin,  StaffUserMixin,  ListView):
                     'cat_filter': cat_filter, 'status_filter': status_filter
                 }
             )
+        context['entry_stats'] = get_entry_stats()
         return context
 
 
@@ -133,11 +130,14 @@ class SelectionMixin(object):
                 }
             ),
             'doubles': self.cat_filter == 'DOU',
-            'category': self.cat_filter
+            'category': self.cat_filter,
+            'entry_stats': get_entry_stats(),
         })
         return ctx
 
 
+@method_decorator(cache_control(private=True, no_cache=True), name='get')
+@method_decorator(condition(etag_func=entries_admin_etag), name='get')
 class EntrySelectionListView(
     LoginRequiredMixin,  StaffUserMixin,  SelectionMixin, ListView
 ):
@@ -262,6 +262,8 @@ def notify_users(request, selection_type):
         return HttpResponseRedirect(reverse('ppadmin:entries_selection'))
 
 
+@method_decorator(cache_control(private=True, no_cache=True), name='get')
+@method_decorator(condition(etag_func=entries_admin_etag), name='get')
 class EntryNotifiedListView(
     LoginRequiredMixin,  StaffUserMixin,  SelectionMixin, ListView
 ):
@@ -308,18 +310,16 @@ class ExportFormView(LoginRequiredMixin,  StaffUserMixin, FormView):
 
     def form_valid(self, form):
         if 'export' in self.request.POST:
-            category = form.cleaned_data['category']
-            status = form.cleaned_data['status']
-            column_names = form.cleaned_data['include']
-            entries = Entry.objects.select_related('user').filter(
-                withdrawn=False, entry_year=settings.CURRENT_ENTRY_YEAR
-            ).order_by('category')
-
-            if category != 'all':
-                entries = entries.filter(category=category)
-            if status != 'all':
-                entries = entries.filter(status=status)
-            return export_data(category, entries, column_names)
+            job, _ = ExportJob.request_export(
+                self.request.user,
+                form.cleaned_data['category'],
+                form.cleaned_data['status'],
+                form.cleaned_data['include'],
+                form.cleaned_data['file_format']
+            )
+            return HttpResponseRedirect(
+                reverse('ppadmin:export_job', args=[job.id])
+            )
         else:
             return TemplateResponse(
                 self.request,
@@ -328,6 +328,63 @@ class ExportFormView(LoginRequiredMixin,  StaffUserMixin, FormView):
             )
 
 
+class ExportJobView(LoginRequiredMixin,  StaffUserMixin, DetailView):
+
+    model = ExportJob
+    template_name = "ppadmin/export_job.html"
+    context_object_name = 'job'
+    pk_url_kwarg = 'job_id'
+
+
+@login_required
+@staff_required
+def export_job_status(request, job_id):
+    job = get_object_or_404(ExportJob, id=job_id)
+    return JsonResponse({
+        'state': job.state,
+        'download_url': reverse('ppadmin:export_job_download', args=[job.id])
+        if job.state == 'done' else None,
+    })
+
+
+@login_required
+@staff_required
+def export_job_download(request, job_id):
+    job = get_object_or_404(ExportJob, id=job_id, state='done')
+    writer_class = SPREADSHEET_WRITERS[job.file_format]
+    try:
+        return FileResponse(
+            open(job.filepath, 'rb'),
+            as_attachment=True,
+            filename=export_filename(job.category, writer_class.extension),
+            content_type=writer_class.content_type
+        )
+    except FileNotFoundError:
+        raise Http404()
+
+
+def get_export_entries(category, status, entry_year=None):
+    entries = Entry.objects.select_related(
+        'user', 'user__profile', 'partner', 'partner__profile'
+    ).filter(
+        withdrawn=False,
+        entry_year=entry_year or settings.CURRENT_ENTRY_YEAR
+    ).order_by('category')
+
+    if category != 'all':
+        entries = entries.filter(category=category)
+    if status != 'all':
+        entries = entries.filter(status=status)
+    return entries
+
+
+def export_filename(category, extension):
+    return 'competitors_{}.{}'.format(
+        'all' if category == 'all' else CATEGORY_CHOICES_DICT[category].lower(),
+        extension
+    )
+
+
 def get_columns_dict(entry=None, name=None, school=None):
     return {
         'name': (u"Name", 3000, name),
@@ -359,86 +416,70 @@ def get_columns_dict(entry=None, name=None, school=None):
     }
 
 
-def export_data(category, entries, column_names):
-    filename = 'competitors_all.xls'
-    if category != 'all':
-        filename = 'competitors_{}.xls'.format(
-            CATEGORY_CHOICES_DICT[category].lower()
-        )
-
-    response = HttpResponse(content_type='application/ms-excel')
-    response['Content-Disposition'] = 'attachment; filename={}'.format(
-        filename
-    )
-    wb = xlwt.Workbook(encoding='utf-8')
-
+def write_export(writer, category, entries, column_names):
     columns_dict = get_columns_dict()
     columns = [
         (columns_dict[col_name][0], columns_dict[col_name][1])
         for col_name in column_names
     ]
 
-    if category == 'all':
-        worksheet_names = CATEGORY_CHOICES_DICT
-    else:
-        worksheet_names = {category: CATEGORY_CHOICES_DICT[category]}
-
-    for worksheet_category, worksheet_name in worksheet_names.items():
-        row_num = 0
-
-        if category == 'all':
-            cat_entries = entries.filter(category=worksheet_category)
-        else:
-            cat_entries = entries
-
-        if cat_entries:
-            ws = wb.add_sheet(worksheet_name)
-
-            font_style = xlwt.XFStyle()
-            font_style.alignment.wrap = 1
-            font_style.font.bold = True
-
-            for col_num in range(len(columns)):
-                ws.write(row_num, col_num, columns[col_num][0], font_style)
-                # set column width
-                ws.col(col_num).width = columns[col_num][1]
-
-            font_style = xlwt.XFStyle()
-            font_style.alignment.wrap = 1
-
-            for entry in cat_entries:
-                if entry.category == 'DOU':
-                    partner = User.objects.get(email=entry.partner_email)
-
-                school = None
-                name = None
-                if 'pole_school' in column_names:
-                    school = entry.user.profile.pole_school
-                    if entry.category == 'DOU':
-                        partner_school = partner.profile.pole_school
-                        school = '{} ({}{}) / {} ({}{})'.format(
-                            school, entry.user.first_name[0],
-                            entry.user.last_name[0], partner_school,
-                            partner.first_name[0],
-                            partner.last_name[0]
-                        )
+    # stream the rows, starting a new sheet whenever the category changes;
+    # a single category export only yields that category
+    for worksheet_category, cat_entries in iter_by_category(entries):
+        writer.add_sheet(CATEGORY_CHOICES_DICT[worksheet_category], columns)
+
+        for entry in cat_entries:
+            partner = entry.partner if entry.category == 'DOU' else None
+
+            school = None
+            name = None
+            if 'pole_school' in column_names:
+                school = entry.user.profile.pole_school
+                if partner:
+                    partner_school = partner.profile.pole_school
+                    school = '{} ({}{}) / {} ({}{})'.format(
+                        school, entry.user.first_name[0],
+                        entry.user.last_name[0], partner_school,
+                        partner.first_name[0],
+                        partner.last_name[0]
+                    )
 
-                if 'name' in column_names:
-                    name = '{} {}'.format(
-                        entry.user.first_name, entry.user.last_name
+            if 'name' in column_names:
+                name = '{} {}'.format(
+                    entry.user.first_name, entry.user.last_name
+                )
+                if partner:
+                    name += ' & {} {}'.format(
+                        partner.first_name, partner.last_name
                     )
-                    if entry.category == 'DOU':
-                        name += ' & {} {}'.format(
-                            partner.first_name, partner.last_name
-                        )
+                elif entry.category == 'DOU':
+                    # partner hasn't registered
+                    name += ' & {}'.format(entry.partner_name)
+
+            columns_dict = get_columns_dict(entry, name, school)
+            writer.write_row(
+                [columns_dict[col_name][2] for col_name in column_names]
+            )
+    writer.close()
 
-                row_num += 1
 
-                columns_dict = get_columns_dict(entry, name, school)
-                row = [columns_dict[col_name][2] for col_name in column_names]
+def export_data(category, entries, column_names, file_format='xls'):
+    writer_class = SPREADSHEET_WRITERS[file_format]
 
-                for col_num in range(len(row)):
-                    ws.write(row_num, col_num, row[col_num], font_style)
+    if writer_class.extension == 'xls':
+        # xlwt builds the workbook in memory anyway; write it straight to
+        # the response
+        output = HttpResponse(content_type=writer_class.content_type)
+    else:
+        output = tempfile.TemporaryFile()
+    write_export(writer_class(output), category, entries, column_names)
 
-    wb.save(response)
+    if isinstance(output, HttpResponse):
+        response = output
+    else:
+        output.seek(0)
+        response = FileResponse(output, content_type=writer_class.content_type)
+    response['Content-Disposition'] = 'attachment; filename={}'.format(
+        export_filename(category, writer_class.extension)
+    )
     return response
@@ -2,24 +2,26 @@ import urllib
 
 from functools import wraps
 
-from django.core.cache import cache
 from django.urls import reverse
 from django.shortcuts import HttpResponseRedirect
 
+from poleperformance import caching
+
+
+def staff_cache_key(user):
+    return 'user_{}_is_staff'.format(user.id)
+
+
+def is_staff(user):
+    # cache for 30 mins
+    return caching.get_or_set(
+        staff_cache_key(user), lambda: user.is_staff, timeout=1800
+    )
+
 
 def staff_required(func):
     def decorator(request, *args, **kwargs):
-        cached_is_staff = cache.get('user_%s_is_staff' % str(request.user.id))
-        if cached_is_staff is not None:
-            user_is_staff = bool(cached_is_staff)
-        else:
-            user_is_staff = request.user.is_staff
-            # cache for 30 mins
-            cache.set(
-                'user_%s_is_staff' % str(request.user.id), user_is_staff, 1800
-            )
-
-        if user_is_staff:
+        if is_staff(request.user):
             return func(request, *args, **kwargs)
         else:
             return HttpResponseRedirect(reverse('permission_denied'))
@@ -29,14 +31,6 @@ def staff_required(func):
 class StaffUserMixin(object):
 
     def dispatch(self, request, *args, **kwargs):
-        cached_is_staff = cache.get('user_%s_is_staff' % str(request.user.id))
-        if cached_is_staff is not None:
-            user_is_staff = bool(cached_is_staff)
-        else:
-            user_is_staff = self.request.user.is_staff
-            cache.set(
-                'user_%s_is_staff' % str(request.user.id), user_is_staff, 1800
-            )
-        if not user_is_staff:
+        if not is_staff(request.user):
             return HttpResponseRedirect(reverse('permission_denied'))
         return super(StaffUserMixin, self).dispatch(request, *args, **kwargs)
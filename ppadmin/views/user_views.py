@@ -1,11 +1,12 @@
 import logging
 
 from django.contrib.auth.models import Group, User
-from django.db.models import Q
 from django.views.generic import ListView
 
 from braces.views import LoginRequiredMixin
 
+from accounts.user_directory import filter_by_first_letter, \
+    first_letter_counts, search_users
 from ppadmin.forms import UserListSearchForm
 from ppadmin.views.helpers import StaffUserMixin
 
@@ -19,11 +20,7 @@ NAME_FILTERS = (
 )
 
 
-def _get_name_filter_available(queryset):
-
-    names_list = queryset.distinct().values_list('first_name', flat=True)
-    letter_set = set([name[0].lower() for name in names_list if name])
-
+def _get_name_filter_available(letter_counts):
     name_filter_options = []
     for option in NAME_FILTERS:
         if option == "All":
@@ -32,7 +29,8 @@ def _get_name_filter_available(queryset):
             name_filter_options.append(
                 {
                     'value': option,
-                    'available': option.lower() in letter_set
+                    'available': letter_counts.get(option, 0) > 0,
+                    'count': letter_counts.get(option, 0),
                 }
             )
     return name_filter_options
@@ -45,44 +43,43 @@ class UserListView(LoginRequiredMixin,  StaffUserMixin,  ListView):
     context_object_name = 'users'
     paginate_by = 30
 
+    def get_search_text(self):
+        """
+        The search text, or None if the search has been reset or not used
+        """
+        if self.request.GET.get('reset'):
+            return None
+        return self.request.GET.get('search') or None
+
     def get_queryset(self):
         queryset = User.objects.all().order_by('first_name')
-        reset = self.request.GET.get('reset')
-        search_submitted = self.request.GET.get('search_submitted')
-        search_text = self.request.GET.get('search')
-        filter = self.request.GET.get('filter')
-
-        if reset or (search_submitted and not search_text) or \
-                (not reset and not search_submitted and not filter):
-            queryset = queryset
-        elif search_text:
-            queryset = queryset.filter(
-                Q(first_name__icontains=search_text) |
-                Q(last_name__icontains=search_text) |
-                Q(username__icontains=search_text)
-            )
+        search_text = self.get_search_text()
+        if search_text:
+            queryset = search_users(queryset, search_text)
 
+        filter = self.request.GET.get('filter')
         if filter and filter != 'All':
-            queryset = queryset.filter(first_name__istartswith=filter)
+            queryset = filter_by_first_letter(queryset, filter)
 
         return queryset
 
     def get_context_data(self):
-        queryset = self.get_queryset()
         context = super(UserListView,  self).get_context_data()
         context['search_submitted'] = self.request.GET.get('search_submitted')
         context['active_filter'] = self.request.GET.get('filter',  'All')
-        search_text = self.request.GET.get('search',  '')
-        reset = self.request.GET.get('reset')
-        context['filter_options'] = _get_name_filter_available(queryset)
+        search_text = self.get_search_text()
 
-        num_results = queryset.count()
-        total_users = User.objects.count()
+        # letters available for the current search; the counts for all users
+        # are cached, and give the total
+        all_letter_counts = first_letter_counts()
+        letter_counts = first_letter_counts(
+            search_users(User.objects.all(), search_text)
+        ) if search_text else all_letter_counts
+        context['filter_options'] = _get_name_filter_available(letter_counts)
 
-        if reset:
-            search_text = ''
-        form = UserListSearchForm(initial={'search': search_text})
+        form = UserListSearchForm(initial={'search': search_text or ''})
         context['form'] = form
-        context['num_results'] = num_results
-        context['total_users'] = total_users
+        # the paginator has already counted the results
+        context['num_results'] = context['paginator'].count
+        context['total_users'] = sum(all_letter_counts.values())
         return context
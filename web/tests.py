@@ -1,6 +1,21 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template import Context, Engine
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 
+from poleperformance import caching
+from poleperformance.middleware import RequestTimingMiddleware
+
 
 class HomeViewTests(TestCase):
 
@@ -10,3 +25,229 @@ class HomeViewTests(TestCase):
 
     def test_no_login_required(self):
         self.client.get(self.url)
+
+
+class MiddlewareProfileTests(TestCase):
+
+    def test_test_profile_excludes_optional_middleware(self):
+        self.assertEqual(settings.MIDDLEWARE_PROFILE, 'test')
+        self.assertNotIn(
+            'debug_toolbar.middleware.DebugToolbarMiddleware',
+            settings.MIDDLEWARE
+        )
+        self.assertNotIn(
+            'poleperformance.middleware.RequestTimingMiddleware',
+            settings.MIDDLEWARE
+        )
+
+    def test_request_timing_middleware(self):
+        middleware = RequestTimingMiddleware(lambda request: HttpResponse())
+        response = middleware(RequestFactory().get('/'))
+        self.assertTrue(response['Server-Timing'].startswith('total;dur='))
+
+    @override_settings(SLOW_REQUEST_MS=-1)
+    def test_request_timing_middleware_logs_slow_requests(self):
+        middleware = RequestTimingMiddleware(lambda request: HttpResponse())
+        with self.assertLogs('poleperformance.middleware', 'WARNING') as logs:
+            middleware(RequestFactory().get('/foo/'))
+        self.assertIn('Slow request: GET /foo/', logs.output[0])
+
+
+class AutoReloadLoaderTests(TestCase):
+
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.template_dir)
+        self.template_path = os.path.join(self.template_dir, 'test.html')
+        self.write_template('Original', mtime=1000)
+        self.engine = Engine(
+            dirs=[self.template_dir],
+            loaders=[(
+                'poleperformance.template_loaders.AutoReloadLoader',
+                ['django.template.loaders.filesystem.Loader']
+            )]
+        )
+
+    def write_template(self, content, mtime):
+        with open(self.template_path, 'w') as template_file:
+            template_file.write(content)
+        os.utime(self.template_path, (mtime, mtime))
+
+    def test_template_is_cached(self):
+        template = self.engine.get_template('test.html')
+        self.assertIs(self.engine.get_template('test.html'), template)
+
+    def test_modified_template_is_reloaded(self):
+        template = self.engine.get_template('test.html')
+        self.assertEqual(template.render(Context()), 'Original')
+
+        self.write_template('Modified', mtime=2000)
+        template = self.engine.get_template('test.html')
+        self.assertEqual(template.render(Context()), 'Modified')
+        self.assertIs(self.engine.get_template('test.html'), template)
+
+
+class ResilientCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cache.clear()
+        caching.metrics.clear()
+
+    def test_get_or_set(self):
+        compute = lambda: 'foo'
+        self.assertEqual(caching.get_or_set('test_key', compute, 60), 'foo')
+        self.assertEqual(cache.get('test_key'), 'foo')
+        self.assertEqual(caching.get_or_set('test_key', compute, 60), 'foo')
+        metrics = caching.get_metrics()
+        self.assertEqual(metrics['hits'], 1)
+        self.assertEqual(metrics['misses'], 1)
+        self.assertEqual(metrics['computed'], 1)
+        self.assertEqual(metrics['hit_rate'], 0.5)
+
+    def test_false_values_are_cached(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return False
+
+        self.assertFalse(caching.get_or_set('test_key', compute, 60))
+        self.assertFalse(caching.get_or_set('test_key', compute, 60))
+        self.assertEqual(len(calls), 1)
+
+    def test_delete(self):
+        caching.set_value('test_key', 'foo', 60)
+        caching.delete('test_key')
+        self.assertIsNone(cache.get('test_key'))
+        self.assertIsNone(caching.local_cache.get('test_key'))
+        self.assertEqual(caching.get_or_set('test_key', lambda: 'bar', 60), 'bar')
+
+    def test_timeouts_are_jittered(self):
+        timeouts = {caching.jitter(1000) for _ in range(50)}
+        self.assertGreater(len(timeouts), 1)
+        for timeout in timeouts:
+            self.assertTrue(900 <= timeout <= 1100)
+        self.assertIsNone(caching.jitter(None))
+
+    @override_settings(CACHE_LOCK_WAIT=0.1)
+    def test_stale_local_value_not_used_while_another_process_recomputes(
+            self
+    ):
+        caching.set_value('test_key', 'old', 60)
+        # invalidated by another process, which is recomputing it
+        cache.delete('test_key')
+        cache.add('test_key_lock', 1)
+        self.assertEqual(caching.get_or_set('test_key', lambda: 'new', 60), 'new')
+        self.assertEqual(caching.get_metrics()['fallback_hits'], 0)
+
+    def test_value_from_another_process_used(self):
+        cache.add('test_key_lock', 1)
+
+        def sleep(seconds):
+            # the other process finishes recomputing
+            cache.set('test_key', 'other', 60)
+
+        with patch.object(caching.time, 'sleep', side_effect=sleep):
+            self.assertEqual(
+                caching.get_or_set('test_key', lambda: 'new', 60), 'other'
+            )
+
+    def test_shared_cache_unavailable(self):
+        caching.set_value('test_key', 'old', 60)
+        with patch.object(caching, 'cache') as mock_cache:
+            mock_cache.get.side_effect = Exception('Connection refused')
+            mock_cache.add.side_effect = Exception('Connection refused')
+            self.assertEqual(
+                caching.get_or_set('test_key', lambda: 'new', 60), 'old'
+            )
+            # nothing cached locally and no lock held; compute without waiting
+            self.assertEqual(
+                caching.get_or_set('other_key', lambda: 'new', 60), 'new'
+            )
+        self.assertEqual(caching.get_metrics()['errors'], 6)
+
+    def test_memcached_server_down(self):
+        # python-memcached doesn't raise when the server is down; gets return
+        # None and adds return 0
+        caching.set_value('test_key', 'old', 60)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return 'new'
+
+        with patch.object(caching, 'cache') as mock_cache:
+            mock_cache.get.return_value = None
+            mock_cache.add.return_value = 0
+            for _ in range(3):
+                self.assertEqual(
+                    caching.get_or_set('test_key', compute, 60), 'old'
+                )
+            # nothing cached locally; compute without waiting
+            self.assertEqual(
+                caching.get_or_set('other_key', compute, 60), 'new'
+            )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(caching.get_metrics()['fallback_hits'], 3)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'foo'
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    caching.get_or_set('test_key', compute, 60)
+                )
+            ) for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['foo'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    @patch.object(caching, '_key_lock')
+    def test_other_keys_not_held_up_by_recompute(self, mock_key_lock):
+        # every key shares the same lock stripe
+        mock_key_lock.return_value = caching._key_locks[0]
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow_compute():
+            started.set()
+            finish.wait(5)
+            return 'slow'
+
+        thread = threading.Thread(
+            target=lambda: caching.get_or_set('test_key', slow_compute, 60)
+        )
+        thread.start()
+        started.wait(5)
+        try:
+            self.assertEqual(
+                caching.get_or_set('other_key', lambda: 'fast', 60), 'fast'
+            )
+            # returned while the other key is still being recomputed
+            self.assertTrue(thread.is_alive())
+        finally:
+            finish.set()
+            thread.join()
+
+    def test_local_cache_is_bounded(self):
+        local_cache = caching.LocalCache(max_entries=2)
+        local_cache.set('a', 1, 60)
+        local_cache.set('b', 2, 60)
+        local_cache.get('a')
+        local_cache.set('c', 3, 60)
+        # least recently used is discarded
+        self.assertIsNone(local_cache.get('b'))
+        self.assertEqual(local_cache.get('a'), 1)
+        self.assertEqual(len(local_cache), 2)